@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+""" Micro-benchmark of scoring one input SOP against many alternative forms, one form at a time vs vectorized
+
+    Run with: python benchmarks/bench_batch.py
+"""
+import os, sys, random, timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phonomatic.confusionmatrix import ConfusionMatrix, PackedSOPs
+
+def run(number = 5):
+  random.seed(0)
+  cm = ConfusionMatrix()
+  phonemes = cm.submap.discode("aeiouɛɔəyøœɑpbtdkɡfvszʃʒmnlʁj")
+  def randomSOP(words):
+    return [ [ random.choice(phonemes) for _ in range(random.randint(2, 7)) ] for _ in range(words) ]
+
+  SOP = randomSOP(6)
+  for count in (10, 100, 1000):
+    forms = [ randomSOP(random.randint(1, 3)) for _ in range(count) ]
+    packed = PackedSOPs(forms)
+    loop = lambda: [ cm.confuseScorePre(form, SOP, 3.0) for form in forms ]
+    batch = lambda: cm.confuseScorePreBatch(packed, SOP, 3.0)
+    tl = min(timeit.repeat(loop, number = number, repeat = 3)) / number
+    tb = min(timeit.repeat(batch, number = number, repeat = 3)) / number
+    print("{:5d} forms: loop {:8.3f} ms, batch {:8.3f} ms  x{:.1f}".format(count, tl * 1000, tb * 1000, tl / tb))
+
+if __name__ == "__main__":
+  run()
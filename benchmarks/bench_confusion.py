@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+""" Micro-benchmark of the phoneme pair scoring cost with and without the weighted confusion matrix
+
+    Run with: python benchmarks/bench_confusion.py
+"""
+import os, sys, random, timeit
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phonomatic.confusionmatrix import ConfusionMatrix
+
+def run(pairs = 100000, number = 5):
+  random.seed(0)
+  identity = ConfusionMatrix(weighted = False)
+  weighted = ConfusionMatrix()
+  sm = weighted.submap
+  phonemes = [ sm.index[x] for x in "aeiouɛɔəyøœɑpbtdkɡfvszʃʒmnlʁj" ]
+  a = [ random.choice(phonemes) for _ in range(pairs) ]
+  b = [ x if random.random() < 0.8 else random.choice(phonemes) for x in a ]
+  words = [ (a[i:i+6], b[i:i+6]) for i in range(0, pairs, 6) ]
+
+  def equality():
+    return [ 1.0 if x == y else 0.0 for x, y in zip(a, b) ]
+  def method():
+    f = weighted.confuseScorePhoneme
+    return [ f(x, y) for x, y in zip(a, b) ]
+  def rows():
+    m = weighted.rows
+    return [ m[x][y] for x, y in zip(a, b) ]
+  na, nb = np.array(a), np.array(b)
+  def numpy():
+    return weighted.matrix[na, nb]
+
+  print("Per phoneme pair scoring cost:")
+  for name, func in (("equality (old)", equality), ("method call", method), ("matrix rows", rows), ("numpy gather", numpy)):
+    t = min(timeit.repeat(func, number = number, repeat = 3)) / number
+    print("  {:<16} {:8.1f} ns/pair".format(name, t * 1e9 / pairs))
+
+  print("Budgeted word scoring (_confuseScorePre):")
+  for name, cm in (("identity", identity), ("weighted", weighted)):
+    func = lambda: [ cm._confuseScorePre(x, y, 3.0) for x, y in words ]
+    t = min(timeit.repeat(func, number = number, repeat = 3)) / number
+    print("  {:<16} {:8.1f} ns/pair".format(name, t * 1e9 / pairs))
+
+if __name__ == "__main__":
+  run()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+""" Micro-benchmark of the IPA discoding step (old binary search vs codepoint lookup table vs batch encoder)
+
+    Run with: python benchmarks/bench_discode.py
+"""
+import os, sys, timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phonomatic.confusionmatrix import IPASubmap
+
+# A long transcript in IPA (what Epitran outputs for French), repeated to emulate long ASR outputs
+transcript = "uvʁe lɛ ʁido sil vu plɛ mɔ̃te lə vɔlym də kat vɛ̃ dis ɥit puʁsɑ̃ fɛʁme lɛ vɔlɛ mɛʁsi "
+words = (transcript * 200).split()
+
+def discodeBinarySearch(sm, text):
+  """ The previous implementation, searching the alphabet for each character """
+  r = [ sm.binarySearchOnString(sm.alphabet, c) for c in text ]
+  return [ c for c in r if c >= 0 ]
+
+def run(number = 20):
+  sm = IPASubmap()
+  phonemes = sum(len(w) for w in words)
+  results = [
+    ("binary search", lambda: [discodeBinarySearch(sm, w) for w in words]),
+    ("lookup table", lambda: sm.discode(words)),
+    ("batch encoder", lambda: sm.discodeBatch(words)),
+  ]
+  base = None
+  for name, func in results:
+    t = min(timeit.repeat(func, number = number, repeat = 3)) / number
+    base = base or t
+    print("{:<14} {:8.3f} ms/transcript {:10.0f} phonemes/s  x{:.1f}".format(name, t * 1000, phonemes / t, base / t))
+
+if __name__ == "__main__":
+  run()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+""" Time to build a synthetic grammar node by node (each node transliterating its own texts) versus in bulk from its
+    declarative specification (each distinct text or word transliterated once, see grammarspec)
+
+    Run with: python benchmarks/bench_loader.py [--offline] [--intents 250] [--vocabulary 3000] [--wordProcessing]
+    With 250 intents, the grammar has about 50000 alternative forms. The words of the synthetic grammar are random, so
+    they are mapped to a smaller vocabulary, like a real grammar whose forms share their words (0 to keep them)
+"""
+import os, sys, argparse, random, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phonomatic.node import TreeNode
+from phonomatic.matcher import Matcher
+from phonomatic.grammarspec import buildNodes
+from synthetic import StubTransliterator, makeGrammar, buildGrammar, pseudoWord
+
+def restrictVocabulary(specs, rng, size):
+  """ Map each word of the specifications to one of size words """
+  vocabulary = [ pseudoWord(rng) for _ in range(size) ]
+  mapping = {}
+  def text(t):
+    return " ".join(mapping.setdefault(w, rng.choice(vocabulary)) for w in t.split(" "))
+  def node(n):
+    if n[0] == "basic":
+      return (n[0], n[1], text(n[2]))
+    if n[0] == "alternative":
+      return (n[0], [ (x[0], text(x[1])) for x in n[1] ])
+    if n[0] == "optional":
+      return (n[0], [ text(x) for x in n[1] ])
+    return n
+  return [ (intent, [ node(n) for n in nodes ]) for intent, nodes in specs ]
+
+def run(intents = 250, vocabulary = 3000, offline = False, wordProcessing = False, seed = 0, language = "fra-Latn-p"):
+  TreeNode.matcher = Matcher(language, transliterator = StubTransliterator() if offline else None, wordProcessing = wordProcessing)
+  TreeNode.epiInst = TreeNode.matcher.transliterator
+  rng = random.Random(seed)
+  specs = makeGrammar(rng, intents)
+  if vocabulary:
+    specs = restrictVocabulary(specs, rng, vocabulary)
+  forms = sum(len(node[1]) for _, nodes in specs for node in nodes if node[0] in ("alternative", "optional"))
+  # Load the language before timing
+  TreeNode.splitToSOP("a")
+  report = {}
+  for name, build in (("Node by node", buildGrammar), ("Bulk", buildNodes)):
+    start = time.perf_counter()
+    grammar = build(specs)
+    report[name] = time.perf_counter() - start
+    print("{}: {:.3f}s for {} intents and {} forms".format(name, report[name], intents, forms))
+    report[name + " keys"] = [ [ x.key() for x in root.children ] for _, root in grammar ]
+  assert report["Node by node keys"] == report["Bulk keys"], "Both should build the same nodes"
+  print("Speedup: {:.1f}x".format(report["Node by node"] / report["Bulk"]))
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Benchmark building a grammar in bulk")
+  parser.add_argument("--offline", action = "store_true", help = "Use a stub instead of Epitran")
+  parser.add_argument("--wordProcessing", action = "store_true", help = "Transliterate word by word")
+  parser.add_argument("--intents", type = int, default = 250)
+  parser.add_argument("--vocabulary", type = int, default = 3000, help = "Number of distinct words (0 for the generated ones)")
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("--language", default = "fra-Latn-p")
+  args = parser.parse_args()
+  run(args.intents, args.vocabulary, args.offline, args.wordProcessing, args.seed, args.language)
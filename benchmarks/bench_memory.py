@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+""" Memory used by the grammar: bytes per form of alternative and optional nodes, bytes per node and per match result
+
+    The forms are random SOPs (no transliteration is needed), built with fromSOP like a grammar loaded from a file.
+    Small nodes are measured with their own arena (the default) and with one arena for the grammar (like buildGrammar),
+    and the large node is also measured when loaded from a grammar file (its forms are then read from the mapped file).
+    Run with: python benchmarks/bench_memory.py [--forms 100000] [--nodes 20000]
+"""
+import os, sys, argparse, random, tracemalloc, pickle, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, OptionalNode
+from phonomatic.grammarfile import saveGrammar, GrammarFile
+from phonomatic.sop import SOPArena
+from phonomatic.matchresults import ID, Parameter
+
+def randomSOP(rng):
+  return [ [ rng.randrange(60) for _ in range(rng.randint(2, 6)) ] for _ in range(rng.randint(1, 3)) ]
+
+def allocated(func):
+  """ Run func and get its result and the memory it allocated that's still alive (in bytes) """
+  tracemalloc.start()
+  try:
+    result = func()
+    return result, tracemalloc.get_traced_memory()[0]
+  finally:
+    tracemalloc.stop()
+
+def run(forms = 100000, nodes = 20000, seed = 0):
+  rng = random.Random(seed)
+  # Pickled, so building the input isn't counted
+  large = pickle.dumps([ ("form{}".format(i), randomSOP(rng)) for i in range(forms) ])
+  small = pickle.dumps([ [ ("form{}".format(i), randomSOP(rng)) for i in range(4) ] for _ in range(nodes) ])
+  basics = pickle.dumps([ ("id{}".format(i), randomSOP(rng)) for i in range(nodes) ])
+  report = {}
+
+  node, size = allocated(lambda: AlternativeNode.fromSOP(pickle.loads(large)))
+  report["large"] = size / forms
+  print("Alternative node with {} forms: {:.0f} bytes per form".format(forms, report["large"]))
+
+  with tempfile.TemporaryDirectory() as folder:
+    root = TreeNode()
+    root.appendChild(node)
+    path = os.path.join(folder, "grammar.phm")
+    saveGrammar([("large", root)], path)
+    grammar = GrammarFile(path)
+    _, size = allocated(lambda: grammar[0])
+    report["file"] = size / forms
+    print("Alternative node with {} forms from a grammar file: {:.0f} bytes per form".format(forms, report["file"]))
+    grammar.roots.clear()
+    grammar.close()
+
+  _, size = allocated(lambda: [ AlternativeNode.fromSOP(x) for x in pickle.loads(small) ])
+  report["small"] = size / (4 * nodes)
+  print("{} alternative nodes with 4 forms: {:.0f} bytes per form".format(nodes, report["small"]))
+
+  _, size = allocated(lambda: [ AlternativeNode.fromSOP(x, arena = arena) for arena in [SOPArena()] for x in pickle.loads(small) ])
+  report["smallGrammar"] = size / (4 * nodes)
+  print("{} alternative nodes with 4 forms in a grammar arena: {:.0f} bytes per form".format(nodes, report["smallGrammar"]))
+
+  _, size = allocated(lambda: [ OptionalNode.fromSOP([ x[0] for x in f ], [ x[1] for x in f ]) for f in pickle.loads(small) ])
+  report["optional"] = size / (4 * nodes)
+  print("{} optional nodes with 4 texts: {:.0f} bytes per text".format(nodes, report["optional"]))
+
+  _, size = allocated(lambda: [ BasicNode.fromSOP(x[0], [ "" ] * len(x[1]), x[1]) for x in pickle.loads(basics) ])
+  report["basic"] = size / nodes
+  print("{} basic nodes: {:.0f} bytes per node".format(nodes, report["basic"]))
+
+  _, size = allocated(lambda: [ ID("id") for _ in range(nodes) ])
+  report["ID"] = size / nodes
+  _, size = allocated(lambda: [ Parameter("name", "value") for _ in range(nodes) ])
+  report["Parameter"] = size / nodes
+  print("Results: ID {:.0f} bytes, Parameter {:.0f} bytes".format(report["ID"], report["Parameter"]))
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Measure the memory used by the grammar nodes")
+  parser.add_argument("--forms", type = int, default = 100000)
+  parser.add_argument("--nodes", type = int, default = 20000)
+  parser.add_argument("--seed", type = int, default = 0)
+  args = parser.parse_args()
+  run(args.forms, args.nodes, args.seed)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+""" Benchmark of the whole matching pipeline on a synthetic grammar and a corpus of noisy utterances
+
+    It reports the grammar build time, the transliteration, discode and confuseScorePre throughputs, the latency
+    percentiles of matching a text (and the top-1 accuracy), with and without the n-gram shortlist (and its recall
+    against matching all the intents), the time and accuracy of matching N-best lists in one pass compared to matching
+    each transcript, and the peak memory of building and matching.
+    The grammar and the corpus are generated from the seed, so runs are reproducible.
+
+    Run with: python benchmarks/bench_suite.py [--offline] [--intents 200] [--utterances 300] [--topM 20]
+    In offline mode, a stub replaces Epitran (the timings then exclude Epitran, but everything else is the same)
+"""
+import os, sys, argparse, math, random, time, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phonomatic.node import TreeNode
+from phonomatic.matcher import Matcher
+from phonomatic.graph import IntentGraph
+from phonomatic.prefilter import NGramIndex, shortlistRecall
+from phonomatic.sop import SOPBuffer
+from synthetic import StubTransliterator, makeGrammar, buildGrammar, makeCorpus, makeNBestCorpus
+
+def percentile(values, p):
+  """ Nearest rank percentile of the sorted values """
+  return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+def timed(func):
+  start = time.perf_counter()
+  result = func()
+  return result, time.perf_counter() - start
+
+def peakMemory(func):
+  """ Run func and get its result and the peak memory it allocated (in bytes) """
+  tracemalloc.start()
+  try:
+    result = func()
+    return result, tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+def run(intents = 200, utterances = 300, offline = False, seed = 0, budget = 2.0, language = "fra-Latn-p", topM = 20):
+  if offline:
+    TreeNode.matcher = Matcher(transliterator = StubTransliterator())
+  else:
+    TreeNode.setLanguage(language)
+  ctx = TreeNode.matcher
+  rng = random.Random(seed)
+  specs = makeGrammar(rng, intents)
+  corpus = makeCorpus(rng, specs, utterances)
+  texts = [ x[0] for x in corpus ]
+  report = {}
+
+  grammar, report["build"] = timed(lambda: buildGrammar(specs))
+  graph, report["graph"] = timed(lambda: IntentGraph(grammar))
+  print("Grammar: {} intents ({} graph nodes), built in {:.3f}s, graph compiled in {:.3f}s".format(intents, graph.nodeCount, report["build"], report["graph"]))
+  indexed, report["index"] = timed(lambda: IntentGraph(grammar, NGramIndex()))
+  print("Graph with n-gram index compiled in {:.3f}s".format(report["index"]))
+
+  ipa, elapsed = timed(lambda: [ ctx.splitToSOP(x) for x in texts ])
+  report["transliteration"] = len(texts) / elapsed
+  buffers, elapsed = timed(lambda: [ SOPBuffer.fromIPA(x, ctx.submap) for x in ipa ])
+  phonemes = sum(len(x.phonemes) for x in buffers)
+  report["discode"] = phonemes / elapsed
+  print("Transliteration: {:.0f} texts/s, discode: {:.0f} phonemes/s".format(report["transliteration"], report["discode"]))
+
+  # Score each utterance against the basic node of its intent
+  basics = { intent: [ x for x in root.children if x.key() != None and x.key()[0] == "basic" ][0] for intent, root in grammar }
+  pairs = [ (basics[intent].SOP, buffer.cursor().skipWords(1)) for (_, intent), buffer in zip(corpus, buffers) ]
+  # The matrix of the language is built on first use, so get it before timing
+  matrix = ctx.confusionMatrix
+  _, elapsed = timed(lambda: [ matrix.confuseScorePre(a, b, budget) for a, b in pairs ])
+  report["confuseScorePre"] = len(pairs) / elapsed
+  print("confuseScorePre: {:.0f} pairs/s".format(report["confuseScorePre"]))
+
+  report["recall"], counted = shortlistRecall(indexed, texts, budget, topM, ctx)
+  print("Shortlist recall of the top {} intents: {:.1%} ({} matched utterances)".format(topM, report["recall"], counted))
+
+  for name, match in (("matchText", lambda x: graph.matchText(x, budget)), ("matchBeam", lambda x: graph.matchBeam(x, budget)),
+                      ("matchText shortlist", lambda x: indexed.matchText(x, budget, topM = topM)),
+                      ("matchBeam shortlist", lambda x: indexed.matchBeam(x, budget, topM = topM))):
+    latencies = []
+    correct = 0
+    for text, intent in corpus:
+      result, elapsed = timed(lambda: match(text))
+      latencies.append(elapsed)
+      correct = correct + (1 if result and result[0][1] == intent else 0)
+    latencies.sort()
+    report[name] = { "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99),
+                     "accuracy": correct / len(corpus) }
+    print("{}: p50 {:.3f} ms, p95 {:.3f} ms, p99 {:.3f} ms, top-1 accuracy {:.1%}".format(name, *(report[name][x] * (1000 if x != "accuracy" else 1) for x in ("p50", "p95", "p99", "accuracy"))))
+
+  # N-best lists: the most confident transcript only, each transcript matched in turn (the best result, with the same
+  # confidence penalty as matchNBest, wins) and all of them in one pass
+  nbest = makeNBestCorpus(rng, specs, max(1, utterances // 2))
+  def eachTranscript(transcripts):
+    results = []
+    for text, confidence in transcripts:
+      penalty = math.log(transcripts[0][1] / confidence)
+      results += [ (x[0] - penalty, x[1]) for x in graph.matchBeam(text, budget) if x[0] > penalty ]
+    return sorted(results, key = lambda x: -x[0])
+  for name, match in (("N-best, top transcript", lambda x: graph.matchBeam(x[0][0], budget)), ("N-best, each transcript", eachTranscript),
+                      ("N-best, matchNBest", lambda x: graph.matchNBest(x, budget))):
+    correct = 0
+    start = time.perf_counter()
+    for transcripts, intent in nbest:
+      result = match(transcripts)
+      correct = correct + (1 if result and result[0][1] == intent else 0)
+    report[name] = { "time": (time.perf_counter() - start) / len(nbest), "accuracy": correct / len(nbest) }
+    print("{}: {:.3f} ms per list, top-1 accuracy {:.1%}".format(name, report[name]["time"] * 1000, report[name]["accuracy"]))
+
+  # Memory is measured in a separate pass since tracing slows everything down
+  _, report["buildMemory"] = peakMemory(lambda: IntentGraph(buildGrammar(specs)))
+  _, report["matchMemory"] = peakMemory(lambda: [ graph.matchText(x, budget) for x in texts[:50] ])
+  print("Peak memory: build {:.1f} MB, matching {:.1f} kB".format(report["buildMemory"] / 1e6, report["matchMemory"] / 1e3))
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Benchmark the matching pipeline on a synthetic grammar")
+  parser.add_argument("--offline", action = "store_true", help = "Use a stub instead of Epitran")
+  parser.add_argument("--intents", type = int, default = 200)
+  parser.add_argument("--utterances", type = int, default = 300)
+  parser.add_argument("--budget", type = float, default = 2.0)
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("--language", default = "fra-Latn-p")
+  parser.add_argument("--topM", type = int, default = 20, help = "Number of intents shortlisted by the n-gram index")
+  args = parser.parse_args()
+  run(args.intents, args.utterances, args.offline, args.seed, args.budget, args.language, args.topM)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+""" Transliteration throughput of Epitran alone versus a chain looking the words up in a lexicon first, then Epitran for
+    the unknown words, and the time to import phonomatic (Epitran isn't imported until it's used)
+
+    The texts are made of random pseudo words, the lexicon is precomputed with Epitran for a part of the vocabulary.
+    Run with: python benchmarks/bench_translit.py [--texts 2000] [--vocabulary 2000] [--known 0.9]
+"""
+import os, sys, argparse, random, subprocess, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phonomatic.matcher import Matcher
+from phonomatic.transliterators import EpitranInst, DictionaryTransliterator, ChainTransliterator
+from synthetic import pseudoWord
+
+def importTime():
+  """ Time to import phonomatic in a new interpreter """
+  code = "import time; start = time.perf_counter(); import phonomatic; print(time.perf_counter() - start)"
+  env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path))
+  return float(subprocess.run([sys.executable, "-c", code], env = env, capture_output = True, check = True).stdout)
+
+def run(texts = 2000, vocabulary = 2000, known = 0.9, seed = 0, language = "fra-Latn-p"):
+  rng = random.Random(seed)
+  words = list(set(pseudoWord(rng) for _ in range(vocabulary)))
+  texts = [ " ".join(rng.choice(words) for _ in range(rng.randint(3, 8))) for _ in range(texts) ]
+  report = { "import": importTime() }
+  print("Import phonomatic: {:.3f}s".format(report["import"]))
+
+  epitran = EpitranInst(language)
+  epitran.transliterate("a")
+  lexicon = DictionaryTransliterator.precompute(words[:int(len(words) * known)], epitran)
+  chain = ChainTransliterator([lexicon, epitran])
+  for name, transliterator in (("Epitran", epitran), ("Lexicon then Epitran", chain)):
+    matcher = Matcher(transliterator = transliterator, wordProcessing = True)
+    start = time.perf_counter()
+    for text in texts:
+      matcher.splitToSOP(text)
+    report[name] = len(texts) / (time.perf_counter() - start)
+    print("{}: {:.0f} texts/s".format(name, report[name]))
+  print("Words found in the lexicon: {:.1%}".format(chain.hits[0] / sum(chain.hits)))
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Benchmark the transliterators")
+  parser.add_argument("--texts", type = int, default = 2000)
+  parser.add_argument("--vocabulary", type = int, default = 2000)
+  parser.add_argument("--known", type = float, default = 0.9, help = "Part of the vocabulary in the lexicon")
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("--language", default = "fra-Latn-p")
+  args = parser.parse_args()
+  run(args.texts, args.vocabulary, args.known, args.seed, args.language)
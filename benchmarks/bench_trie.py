@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+""" Micro-benchmark of matching an utterance against a large alternative set, vectorized linear scan vs phonetic trie
+
+    Run with: python benchmarks/bench_trie.py
+"""
+import os, sys, random, timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phonomatic.confusionmatrix import ConfusionMatrix, PackedSOPs
+from phonomatic.phonetictrie import PhoneticTrie
+
+def run(number = 3):
+  random.seed(0)
+  cm = ConfusionMatrix()
+  phonemes = cm.submap.discode("aeiouɛɔəyøœɑpbtdkɡfvszʃʒmnlʁj")
+  def randomSOP(words):
+    return [ [ random.choice(phonemes) for _ in range(random.randint(2, 7)) ] for _ in range(words) ]
+
+  for count in (1000, 10000, 50000):
+    forms = [ randomSOP(random.randint(1, 3)) for _ in range(count) ]
+    packed = PackedSOPs(forms)
+    trie = PhoneticTrie(forms)
+    SOP = random.choice(forms) + randomSOP(3)
+    flat = [ x for word in SOP for x in word ]
+    for budget in (2.0, 3.0):
+      batch = lambda: cm.confuseScorePreBatch(packed, SOP, budget)
+      search = lambda: trie.best(flat, budget, cm)
+      tb = min(timeit.repeat(batch, number = number, repeat = 3)) / number
+      tt = min(timeit.repeat(search, number = number, repeat = 3)) / number
+      print("{:6d} forms, budget {}: linear {:8.3f} ms, trie {:8.3f} ms  x{:.1f}".format(count, budget, tb * 1000, tt * 1000, tb / tt))
+
+if __name__ == "__main__":
+  run()
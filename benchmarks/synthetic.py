@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+""" Synthetic grammars and noisy utterances for the benchmarks, plus a stub transliterator to run them offline
+
+    A grammar is first generated as a list of intent specifications (so the time to build the nodes can be measured
+    on its own), each being a tuple (intent, list of node specifications) where a node specification is one of:
+        ("basic", id, text)
+        ("alternative", [(id, text), ...])
+        ("optional", [text, ...])
+        ("parametric", name)
+        ("end",)
+"""
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+
+consonants = "bdfklmnprstv"
+vowels = "aeiou"
+
+class StubTransliterator(object):
+  """ A crude letter to phoneme transliterator, so the benchmarks don't need Epitran (nor its data) """
+  language = "stub"
+  table = { "a": "a", "e": "ə", "i": "i", "o": "o", "u": "y", "y": "i", "c": "k", "q": "k", "g": "ɡ", "j": "ʒ",
+            "r": "ʁ", "h": "", "x": "ks", "é": "e", "è": "ɛ", "ê": "ɛ", "à": "a", "ç": "s" }
+
+  def transliterate(self, text):
+    return "".join(self.table.get(x, x) for x in text.lower())
+
+def pseudoWord(rng, syllables = None):
+  """ A random pronounceable word """
+  return "".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(syllables or rng.randint(1, 3)))
+
+def pseudoText(rng, words):
+  return " ".join(pseudoWord(rng) for _ in range(words))
+
+def makeGrammar(rng, intents = 200, alternatives = 8, largeAlternatives = 2000, optionals = 2, parametric = 0.3):
+  """ Generate the specifications of a grammar with the given number of intents.
+      Intents share a few leading verbs (so they are merged in an IntentGraph), then have their own words, an alternative
+      node (one in ten being a large alternative node with largeAlternatives forms), a chain of optional nodes and, for
+      the given ratio of intents, a parametric node """
+  verbs = [ [ ("verb{}_{}".format(v, i), pseudoWord(rng, 2)) for i in range(3) ] for v in range(5) ]
+  specs = []
+  for i in range(intents):
+    nodes = [ ("alternative", verbs[i % len(verbs)]), ("basic", "object{}".format(i), pseudoText(rng, rng.randint(1, 2))) ]
+    count = largeAlternatives if i % 10 == 0 else alternatives
+    nodes.append(("alternative", [ ("form{}_{}".format(i, j), pseudoText(rng, rng.randint(1, 2))) for j in range(count) ]))
+    for _ in range(optionals):
+      nodes.append(("optional", [ pseudoWord(rng) for _ in range(2) ]))
+    if rng.random() < parametric:
+      nodes.append(("parametric", "value"))
+      nodes.append(("basic", "unit", pseudoWord(rng, 2)))
+    else:
+      nodes.append(("end",))
+    specs.append(("intent{}".format(i), nodes))
+  return specs
+
+def buildGrammar(specs):
+  """ Build the intents (a list of tuple (intent, root TreeNode)) from their specifications """
+  intents = []
+  for intent, nodes in specs:
+    root = TreeNode()
+    for node in nodes:
+      if node[0] == "basic":
+        root.appendChild(BasicNode((node[1], node[2])))
+      elif node[0] == "alternative":
+        root.appendChild(AlternativeNode(node[1]))
+      elif node[0] == "optional":
+        root.appendChild(OptionalNode(node[1]))
+      elif node[0] == "parametric":
+        root.appendChild(ParametricNode(node[1]))
+      else:
+        root.appendChild(EndNode())
+    intents.append((intent, root))
+  return intents
+
+def addNoise(rng, text, noise):
+  """ Simulate ASR errors: each letter can be replaced by a similar one, dropped or doubled """
+  similar = [ "bp", "dt", "kg", "fv", "sz", "mn", "lr", "ae", "eiy", "ou" ]
+  out = []
+  for c in text:
+    r = rng.random()
+    if c == " " or r >= noise:
+      out.append(c)
+    elif r < noise / 2:
+      group = [ x for x in similar if c in x ]
+      out.append(rng.choice(group[0]) if group else c)
+    elif r < noise * 3 / 4:
+      continue
+    else:
+      out.append(c + c)
+  return "".join(out)
+
+def makeUtterance(rng, specs):
+  """ Generate a clean utterance of the grammar, as a tuple (text, expected intent) """
+  intent, nodes = rng.choice(specs)
+  words = []
+  for node in nodes:
+    if node[0] == "basic":
+      words.append(node[2])
+    elif node[0] == "alternative":
+      words.append(rng.choice(node[1])[1])
+    elif node[0] == "optional" and rng.random() < 0.5:
+      words.append(rng.choice(node[1]))
+    elif node[0] == "parametric":
+      words.append(pseudoText(rng, rng.randint(1, 3)))
+  return (" ".join(words), intent)
+
+def makeCorpus(rng, specs, count = 500, noise = 0.1):
+  """ Generate noisy utterances of the grammar, as a list of tuple (text, expected intent) """
+  corpus = []
+  for _ in range(count):
+    text, intent = makeUtterance(rng, specs)
+    corpus.append((addNoise(rng, text, noise), intent))
+  return corpus
+
+def makeNBestCorpus(rng, specs, count = 500, noise = 0.1, n = 4):
+  """ Generate noisy N-best lists of utterances of the grammar, as a list of tuple (transcripts, expected intent), the
+      transcripts being n tuples (text, confidence) sorted by decreasing confidence. Like an ASR engine, the most
+      confident transcript isn't always the best one: each transcript is a noisy version of the utterance and its
+      confidence is only loosely related to its noise """
+  corpus = []
+  for _ in range(count):
+    text, intent = makeUtterance(rng, specs)
+    transcripts = []
+    for _ in range(n):
+      level = rng.uniform(0, 2 * noise)
+      transcripts.append((addNoise(rng, text, level), max(0.05, 1.0 - level / (2 * noise) + rng.uniform(-0.3, 0.3))))
+    transcripts.sort(key = lambda x: -x[1])
+    corpus.append((transcripts, intent))
+  return corpus
@@ -1,3 +1,17 @@
 #from phonomatic._phonomatic import Phonomatic
 from phonomatic.confusionmatrix import ConfusionMatrix, IPASubmap
+from phonomatic.phonetictrie import PhoneticTrie
+from phonomatic.sop import SOPBuffer, SOPCursor, SOPArena
+from phonomatic.translitcache import TransliterationCache
 from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+from phonomatic.graph import IntentGraph
+from phonomatic.grammarfile import saveGrammar, GrammarFile
+from phonomatic.parallel import matchMany
+from phonomatic.matcher import Matcher
+from phonomatic.asyncmatcher import AsyncMatcher
+from phonomatic.stream import MatchSession
+from phonomatic.instrumentation import Instrumentation
+from phonomatic.values import ValueGrammar, EntityValues, NumberValues, PatternValues
+from phonomatic.prefilter import NGramIndex, shortlistRecall
+from phonomatic.transliterators import Transliterator, EpitranInst, DictionaryTransliterator, RuleTransliterator, ChainTransliterator
+from phonomatic.grammarspec import parseSentence, buildGrammar, loadGrammar
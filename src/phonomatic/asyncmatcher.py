@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+class AsyncMatcher(object):
+  """ An asyncio front end to match texts without blocking the event loop.
+      The texts given to match are queued and grouped in small batches: a batch starts with the first queued text and
+      collects the texts arriving in the next window seconds (up to maxBatch texts). The batch is then matched in an
+      executor (the default thread pool if None), while the next batch is being collected.
+      Since the matching is done by a Matcher that's never modified, many batches can run at the same time.
+
+      Use it like this:
+          matcher = AsyncMatcher(IntentGraph(intents), 2.0)
+          result = await matcher.match("Ouvrez les rideaux")
+          ...
+          await matcher.close()
+  """
+  def __init__(self, grammar, budget, ctx = None, window = 0.005, maxBatch = 32, executor = None):
+    """ grammar is an IntentGraph (or a root TreeNode), matched with the given budget and Matcher (the default one if None).
+        The result of a match is what grammar.matchText returns """
+    self.grammar = grammar
+    self.budget = budget
+    self.ctx = ctx
+    self.window = window
+    self.maxBatch = maxBatch
+    self.executor = executor
+    self.queue = None
+    self.task = None
+    self.running = set()
+    # Statistics
+    self.batches = 0
+    self.texts = 0
+
+  async def match(self, text):
+    """ Match the given text, the returned result is ready once its batch is matched """
+    loop = asyncio.get_running_loop()
+    if self.task == None:
+      self.queue = asyncio.Queue()
+      self.task = loop.create_task(self._collect())
+    future = loop.create_future()
+    self.queue.put_nowait((text, future))
+    return await future
+
+  async def close(self):
+    """ Stop collecting batches and wait for the running ones """
+    if self.task != None:
+      self.task.cancel()
+      try:
+        await self.task
+      except asyncio.CancelledError:
+        pass
+      self.task = None
+    # Texts that weren't collected yet are matched now
+    while self.queue != None and not self.queue.empty():
+      await self._run(self._take(self.maxBatch))
+    if self.running:
+      await asyncio.gather(*self.running)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *args):
+    await self.close()
+
+  def _take(self, count):
+    batch = []
+    while len(batch) < count and not self.queue.empty():
+      batch.append(self.queue.get_nowait())
+    return batch
+
+  async def _collect(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = []
+      try:
+        batch.append(await self.queue.get())
+        deadline = loop.time() + self.window
+        while len(batch) < self.maxBatch:
+          timeout = deadline - loop.time()
+          if timeout <= 0:
+            break
+          try:
+            batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+          except asyncio.TimeoutError:
+            break
+      except asyncio.CancelledError:
+        # Closed while collecting: the texts already taken from the queue are still matched, else their callers would
+        # wait forever
+        if batch:
+          self._start(batch)
+        raise
+      self._start(batch)
+
+  def _start(self, batch):
+    task = asyncio.get_running_loop().create_task(self._run(batch))
+    self.running.add(task)
+    task.add_done_callback(self.running.discard)
+
+  async def _run(self, batch):
+    self.batches = self.batches + 1
+    self.texts = self.texts + len(batch)
+    try:
+      results = await asyncio.get_running_loop().run_in_executor(self.executor, self._matchBatch, [x[0] for x in batch])
+    except Exception as e:
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+    for (_, future), result in zip(batch, results):
+      if not future.done():
+        future.set_result(result)
+
+  def _matchBatch(self, texts):
+    # Identical texts (like repeated commands) are only matched once per batch
+    results = dict.fromkeys(texts)
+    for text in results:
+      results[text] = self.grammar.matchText(text, self.budget, self.ctx)
+    return [results[text] for text in texts]
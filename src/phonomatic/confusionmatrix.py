@@ -3,63 +3,170 @@
 # For license information, please see license.txt
 
 from __future__ import unicode_literals
+from array import array
+import math
+import threading
+import numpy as np
+from .instrumentation import logger
+from .sop import SOPCursor, SOPArena
 
 # English case below
 
 # From Phoneme Perception Errors Munson et al. (2002) JASA
 # Table II. Vowel confusion matrix, poorer listeners
-#     Q   A   E  eI   ‘   I   i  oU   U   U   u
-# Q 303  28  66  20  30  16  12   4   2   4   1
-# A 143 207  11   6  61   2   1  22   6  22   5
-# E  19   5 186  14   4 186  11   4  25  30   2
-# eI 21   6  16 305  12  17  98   3   2   2   4
-# ‘   8  11  29   8 240  13   2  36  47  27  65
-# I   6   0  66  12   3 356  30   1   4   7   1
-# i  10   0  11  49   6  18 387   4   1   0   0
-# oU  2  17   7   4  33   2   2 231  31   8 149
-# U   7  10  28   4  22  39   4  31 257  47  37
-# U  11  19  64   3  19  38   6  15 164 134  13
-# u  10  12   7   7  54   5   1  94  38  12 246
-#
-#
-#
-
+# Rows are the presented phonemes, columns are the listeners' answers (the labels are the paper's ASCII transcription)
+munsonVowels = """
+    Q   A   E  eI   ‘   I   i  oU   U   U   u
+Q 303  28  66  20  30  16  12   4   2   4   1
+A 143 207  11   6  61   2   1  22   6  22   5
+E  19   5 186  14   4 186  11   4  25  30   2
+eI 21   6  16 305  12  17  98   3   2   2   4
+‘   8  11  29   8 240  13   2  36  47  27  65
+I   6   0  66  12   3 356  30   1   4   7   1
+i  10   0  11  49   6  18 387   4   1   0   0
+oU  2  17   7   4  33   2   2 231  31   8 149
+U   7  10  28   4  22  39   4  31 257  47  37
+U  11  19  64   3  19  38   6  15 164 134  13
+u  10  12   7   7  54   5   1  94  38  12 246
+"""
+# The IPA phoneme for each of the table's columns, in order. Diphthongs are reduced to their first phoneme since the
+# submap works on single characters (and the second "U" column is the r-colored vowel)
+munsonVowelsIPA = ["æ", "ɑ", "ɛ", "e", "ʌ", "ɪ", "i", "o", "ʊ", "ɝ", "u"]
 
 # Table IV. Consonant confusion matrix, poorer listeners
-#     p   t   k   b   d   g   f   T   s   S   v   D   z   Z   m   n   r   l  j
-# p 188  98 106  12   6  15  17  13   5   1   3   3   2   2   0   2   2   4  1
-# t  55 234 135   2   2   5   8  22   3   4   1   3   2   2   0   0   0   2  0
-# k  72 115 242   1   1   4   7  11   9   4   0   5   1   0   1   2   0   3  2
-# b  32   3   6 190  55  60  31  21   3   0  33  10   3   0  16   9   3   5  0
-# d  13  12   9  42 151 200   9  11   0   0   7   7   0   0   4   5   1   3  6
-# g  14  16  15  15  80 268   7   9   3   1  11   5   6   2   2  11   3   3  9
-# f  39  14  13  11   1   4 177  86  55  17  20  13   5   8   3   2   3   2  7
-# T  44  16  12   9   8   4 171 127  50   5   5  19   4   0   0   2   0   3  1
-# s  24   8   6   7   7   4 102  79 128  46  10  21  11  18   1   3   4   1  0
-# S   2   5   0   0   1   0   5   1  49 353   1   2  11  46   1   0   1   2  0
-# v  15   9   8  55  16  39  16  42  19   2 101  22  25   6  26  26  22  21 10
-# D  10   7   6  66  24  28  22  51   7   2 101  23  21   8  17  37  18  19 13
-# z   9   2   5  22  11  14  17  39  31  32  57   9  79  43   5  22  22  11 50
-# Z   1   4   2   1   0   3   4   3   7 103   5   2  54 258   2   2   7   4 18
-# m   7   0   7  23   2   5  19   4   4   1  14   2   6   2 217 119  20  25  3
-# n   7   6   6   8  21  12   4   4   5   1  16   2  12   2  67 250   8  11 38
-# r   4   0   2  14   2   7   5   6   5   0  56   5  10   5  22  24 206  29 78
-# l   5   1   0  17   1   4   5   1   3   1  12   2   5   0  78  87  95 128 35
-# j   2   5   5   1   4  10   4   3   6  12  11   2  24  13   6  28   8   5 33
-#
+munsonConsonants = """
+    p   t   k   b   d   g   f   T   s   S   v   D   z   Z   m   n   r   l  j
+p 188  98 106  12   6  15  17  13   5   1   3   3   2   2   0   2   2   4  1
+t  55 234 135   2   2   5   8  22   3   4   1   3   2   2   0   0   0   2  0
+k  72 115 242   1   1   4   7  11   9   4   0   5   1   0   1   2   0   3  2
+b  32   3   6 190  55  60  31  21   3   0  33  10   3   0  16   9   3   5  0
+d  13  12   9  42 151 200   9  11   0   0   7   7   0   0   4   5   1   3  6
+g  14  16  15  15  80 268   7   9   3   1  11   5   6   2   2  11   3   3  9
+f  39  14  13  11   1   4 177  86  55  17  20  13   5   8   3   2   3   2  7
+T  44  16  12   9   8   4 171 127  50   5   5  19   4   0   0   2   0   3  1
+s  24   8   6   7   7   4 102  79 128  46  10  21  11  18   1   3   4   1  0
+S   2   5   0   0   1   0   5   1  49 353   1   2  11  46   1   0   1   2  0
+v  15   9   8  55  16  39  16  42  19   2 101  22  25   6  26  26  22  21 10
+D  10   7   6  66  24  28  22  51   7   2 101  23  21   8  17  37  18  19 13
+z   9   2   5  22  11  14  17  39  31  32  57   9  79  43   5  22  22  11 50
+Z   1   4   2   1   0   3   4   3   7 103   5   2  54 258   2   2   7   4 18
+m   7   0   7  23   2   5  19   4   4   1  14   2   6   2 217 119  20  25  3
+n   7   6   6   8  21  12   4   4   5   1  16   2  12   2  67 250   8  11 38
+r   4   0   2  14   2   7   5   6   5   0  56   5  10   5  22  24 206  29 78
+l   5   1   0  17   1   4   5   1   3   1  12   2   5   0  78  87  95 128 35
+j   2   5   5   1   4  10   4   3   6  12  11   2  24  13   6  28   8   5 33
+"""
+munsonConsonantsIPA = ["p", "t", "k", "b", "d", "ɡ", "f", "θ", "s", "ʃ", "v", "ð", "z", "ʒ", "m", "n", "ɹ", "l", "j"]
+
+# Phonemes that aren't in the tables but are close enough to a tabled phoneme to share its confusions
+# (mainly the other rhotics, since the tables only know about the English one, and the open o)
+aliasesIPA = { "ɹ": "rɾʁ", "ɑ": "a", "ɝ": "ɚ", "o": "ɔ" }
+aliasSimilarity = 0.9
+
+# The confusion tables of English, as a list of tuple (confusion table, IPA phoneme of each column)
+englishTables = [(munsonVowels, munsonVowelsIPA), (munsonConsonants, munsonConsonantsIPA)]
+
+# For the languages without confusion tables, the similarity of two phonemes is derived from the number of their
+# phonological features that differ (from panphon): featureSimilarity * (1 - differences / featureRange). This is
+# fitted on the English tables, where phonemes differing by one feature have a similarity around 0.16 (the listeners
+# mostly hear the right phoneme) and it goes down to nothing for about ten features
+featureSimilarity = 0.2
+featureRange = 10.0
+
+
+def parseConfusionTable(table):
+  """ Parse a confusion table given as text, the first line being the column labels and each following line being
+      the row label followed by the counts of each answer. Returns the list of rows as list of counts """
+  lines = [ line.split() for line in table.strip().splitlines() ]
+  labels = lines[0]
+  rows = [ [ float(x) for x in line[1:] ] for line in lines[1:] ]
+  if len(rows) != len(labels) or any(len(row) != len(labels) for row in rows):
+    raise ValueError("Confusion table must be square")
+  return rows
+
+def normalizeConfusionTable(rows):
+  """ Convert a confusion count table to a symmetric similarity table with 1 on the diagonal.
+      This uses Shepard's similarity: S(i,j) = sqrt(P(j|i) * P(i|j) / (P(i|i) * P(j|j))) """
+  n = len(rows)
+  p = [ [ x / sum(row) for x in row ] for row in rows ]
+  return [ [ 1.0 if i == j else min(1.0, math.sqrt((p[i][j] * p[j][i]) / (p[i][i] * p[j][j]))) for j in range(n) ] for i in range(n) ]
+
+
+def loadConfusionTables(path):
+  """ Load the confusion tables of a file, as a list of tuple (confusion table, IPA phoneme of each column).
+      The file contains one or more tables separated by blank lines, in the format of parseConfusionTable where the
+      labels are IPA phonemes (like a table of vowels and a table of consonants). Lines starting with # are ignored """
+  with open(path, encoding = "utf-8") as f:
+    lines = [ line for line in f.read().splitlines() if not line.lstrip().startswith("#") ]
+  tables = []
+  for block in "\n".join(lines).split("\n\n"):
+    if block.strip():
+      tables.append((block, block.strip().splitlines()[0].split()))
+  if not tables:
+    raise ValueError("No confusion table in {}".format(path))
+  return tables
+
 
 class IPASubmap(object):
   """ In order to use IPA for phoneme fuzzy matching, we first remove all diacritics and map all remaining phonemes to an index in a chart as seen below.
       This allows to simplify the confusion matrix fuzzy matching algorithm (but at a loss of precision).
 
       use discode to convert a unicode encoded IPA string to an array of index in the alphabet
+
+      With ordered = True, the indexes follow the similarity of the phonemes instead of their Unicode order: the phonemes
+      of the confusion tables come first (vowels then consonants), each table ordered so that neighbours are the most
+      similar phonemes (with their aliases right after them), then all the other characters. Close indexes are then
+      likely to be similar phonemes, see ConfusionMatrix.gapPenalty for the bound this gives.
       """
 
-  def __init__(self):
+  def __init__(self, ordered = False):
     # Extracted from https://en.wikipedia.org/wiki/Phonetic_symbols_in_Unicode, sorted, ignoring diacritics and modifiers,
     # That's exactly 424 characters, so an index into this string will require 9 bits
     self.alphabet = "abcdefhijklmnopqrstuvwxyzæçðøħŋœǀǁǂǃȡȴȵȶɐɑɒɓɔɕɖɗɘəɚɛɜɝɞɟɠɡɢɣɤɥɦɧɨɩɪɫɬɭɮɯɰɱɲɳɴɵɶɷɸɹɺɻɼɽɾɿʀʁʂʃʄʅʆʇʈʉʊʋʌʍʎʏʐʑʒʓʔʕʖʗʘʙʚʛʜʝʞʟʠʡʢʣʤʥʦʧʨʩʪʫʬʭʮʯʰʱʲʳʴʵʶʷʸʹʺʻʼʽʾʿˀˁ˂˃˄˅ˆˇˈˉˊˋˌˍˎˏːˑ˒˓˔˕˖˗˘˙˚˛˜˝˞˟ˠˡˢˣˤ˥˦˧˨˩˪˫ˬ˭ˮ˯˰˱˲˳˴˵˶˷˸˹˺˻˼˽˾˿̞̟̥̪̈̊͡βθχᶑᷰⱱꞎᴀᴁᴂᴃᴄᴅᴆᴇᴈᴉᴊᴋᴌᴍᴎᴏᴐᴑᴒᴓᴔᴕᴖᴗᴘᴙᴚᴛᴜᴝᴞᴟᴠᴡᴢᴣᴤᴥᴦᴧᴨᴩᴪᴫᴬᴭᴮᴯᴰᴱᴲᴳᴴᴵᴶᴷᴸᴹᴺᴻᴼᴽᴾᴿᵀᵁᵂᵃᵄᵅᵆᵇᵈᵉᵊᵋᵌᵍᵎᵏᵐᵑᵒᵓᵔᵕᵖᵗᵘᵙᵚᵛᵜᵝᵞᵟᵠᵡᵢᵣᵤᵥᵦᵧᵨᵩᵪᵫᵬᵭᵮᵯᵰᵱᵲᵳᵴᵵᵶᵷᵸᵹᵺᵻᵼᵽᵾᵿᶀᶁᶂᶃᶄᶅᶆᶇᶈᶉᶊᶋᶌᶍᶎᶏᶐᶑᶒᶓᶔᶕᶖᶗᶘᶙᶚᶛᶜᶝᶞᶟᶠᶡᶢᶣᶤᶥᶦᶧᶨᶩᶪᶫᶬᶭᶮᶯᶰᶱᶲᶳᶴᶵᶶᶷᶸᶹᶺᶻᶼᶽᶾᶿ"
+    self.ordered = ordered
+    if ordered:
+      self.alphabet = IPASubmap.similarityOrder(self.alphabet)
 
+    # Precompute the codepoint => index table once, so discoding doesn't need to search the alphabet for each character
+    # (the alphabet isn't strictly sorted and contains a duplicate, the first occurrence wins here)
+    self.index = {}
+    for i, c in enumerate(self.alphabet):
+      self.index.setdefault(c, i)
+
+  @staticmethod
+  def similarityOrder(alphabet):
+    """ Reorder the alphabet so the phonemes of the confusion tables come first, in an order where the most similar
+        phonemes are neighbours. Each table is ordered by a greedy chain: starting from each phoneme in turn, the chain
+        is extended at the end (or the beginning) with the remaining phoneme that's the most similar to it, and the
+        chain with the highest similarity between neighbours is kept """
+    order = []
+    for table, phonemes in ((munsonVowels, munsonVowelsIPA), (munsonConsonants, munsonConsonantsIPA)):
+      similarity = normalizeConfusionTable(parseConfusionTable(table))
+      best = None
+      for start in range(len(phonemes)):
+        chain = [start]
+        left = set(range(len(phonemes))) - {start}
+        while left:
+          # Sorted, so ties are broken the same way on each run
+          after = max(sorted(left), key = lambda x: similarity[chain[-1]][x])
+          before = max(sorted(left), key = lambda x: similarity[chain[0]][x])
+          if similarity[chain[-1]][after] >= similarity[chain[0]][before]:
+            chain.append(after)
+            left.remove(after)
+          else:
+            chain.insert(0, before)
+            left.remove(before)
+        score = sum(similarity[chain[i]][chain[i + 1]] for i in range(len(chain) - 1))
+        if best == None or score > best[0]:
+          best = (score, chain)
+      for i in best[1]:
+        order.append(phonemes[i])
+        order.extend(aliasesIPA.get(phonemes[i], ""))
+    # Keep the duplicate of the alphabet (if any) in the remaining characters so the length is unchanged
+    rest = list(alphabet)
+    for c in order:
+      rest.remove(c)
+    return "".join(order) + "".join(rest)
 
   @staticmethod
   def binarySearchOnString(arr, x):
@@ -76,21 +183,211 @@ class IPASubmap(object):
     return -1  #   If element is not found  then it will return -1
 
   def _discode(self, text):
-    r = [ self.binarySearchOnString(self.alphabet, c) for c in text ]
-    return [ c for c in r if c >= 0 ]
+    get = self.index.get
+    return [ c for c in map(get, text) if c is not None ]
 
   def discode(self, text):
     if isinstance(text, list):
       return [ self._discode(t) for t in text ]
     return self._discode(text)
 
+  def discodeBatch(self, texts):
+    """ Discode many strings at once into a single compact buffer.
+        This returns a tuple (phonemes, offsets) where phonemes is an array('H') of all the indexes concatenated
+        and offsets is an array('I') of len(texts) + 1 items, so the i-th string is phonemes[offsets[i]:offsets[i+1]] """
+    get = self.index.get
+    phonemes = array('H')
+    offsets = array('I', [0])
+    for text in texts:
+      phonemes.fromlist([ c for c in map(get, text) if c is not None ])
+      offsets.append(len(phonemes))
+    return (phonemes, offsets)
+
 
 class ConfusionMatrix(object):
-  """ Get the confusion matrix for the given language (currently, only English is supported)"""
-  def __init__(self, language = "en"):
-    if language == "en":
-      self.matrix = []
-      self.submap = IPASubmap()
+  """ Get the confusion matrix for the given language (an Epitran code like "fra-Latn-p", or just its language part).
+      The matrix is a dense float32 similarity matrix indexed by the submap indexes (1: same phoneme, 0: very different).
+      It's built once per language (and submap ordering) and shared by all instances. Use weighted = False to only accept
+      identical phonemes and ordered = True to use the similarity ordered submap (see IPASubmap).
+
+      The matrix of a language comes from the registry of confusion tables: the built-in English tables, or the tables
+      registered for the language (see register). A language without tables falls back to a matrix built from the
+      phonological features of the phonemes (this needs panphon, else the English tables are used). Nothing is loaded
+      until a language is used, and forLanguage gives the instance shared by all the grammars and matchers, so a process
+      serving many languages only pays for the ones it sees. The languages using the same tables (like "fra-Latn" and
+      "fra-Latn-p", or all the languages falling back to the phonological features) share the same instance, and any
+      instance built for the same tables shares the matrix and its views (rows, sim and gapPenalty).
+
+      gapPenalty is the distance bound between the indexes and the penalty (1 - similarity): gapPenalty[g] is the
+      smallest penalty of any two phonemes whose indexes are at least g apart. It holds for any ordering, but it's only
+      useful with the ordered submap where it grows quickly with the gap. Phonetic indexes can then find all the phonemes
+      that are closer than a penalty in an index range (see neighborhood) and get a lower bound of a substitution from
+      the indexes alone (see penaltyBound), without reading the matrix """
+  # Tables key (see tablesKey) => tuple (matrix, gapPenalty, rows, sim)
+  matrices = {}
+  # Language => confusion tables (a list of tuple (table, IPA phonemes)) or the path of a file with the tables
+  sources = { "en": englishTables, "eng": englishTables }
+  # Tables key => the shared instance, and language => its instance (read without the lock), see forLanguage
+  instances = {}
+  languages = {}
+  # The tables of the languages without tables, built from the phonological features the first time they're needed
+  features = None
+  lock = threading.RLock()
+  # Under this number of candidates, batch scoring falls back to scoring each candidate in turn
+  batchThreshold = 16
+
+  def __init__(self, language = "en", weighted = True, ordered = False):
+    self.submap = IPASubmap(ordered)
+    self.language = language if weighted else None
+    # Reading a numpy array item by item from Python is slower than reading lists, so the scalar scoring loop uses a list
+    # view (rows), and the batch scoring computes in double precision (sim) to give the exact same results as the scalar path
+    self.matrix, self.gapPenalty, self.rows, self.sim = ConfusionMatrix.buildShared(self.submap, self.language)
+
+  @staticmethod
+  def register(language, source):
+    """ Register the confusion tables of a language: either a list of tuple (confusion table, IPA phoneme of each
+        column) or the path of a file with the tables (see loadConfusionTables), that's only read when the language is
+        used. Registering "fra" applies to all the Epitran codes of French (like "fra-Latn-p") """
+    with ConfusionMatrix.lock:
+      ConfusionMatrix.sources[language] = source
+      # Forget what was built, for this language or the languages that fell back to another source
+      ConfusionMatrix.matrices.clear()
+      ConfusionMatrix.instances.clear()
+      ConfusionMatrix.languages.clear()
+
+  @staticmethod
+  def forLanguage(language):
+    """ Get the confusion matrix of the language, built the first time it's used and shared afterwards """
+    # Each match gets the matrix many times, so a language already seen is found without locking
+    instance = ConfusionMatrix.languages.get(language)
+    if instance == None:
+      with ConfusionMatrix.lock:
+        key = ConfusionMatrix.tablesKey(language, False)[0]
+        instance = ConfusionMatrix.instances.get(key)
+        if instance == None:
+          instance = ConfusionMatrix(language)
+          ConfusionMatrix.instances[key] = instance
+        ConfusionMatrix.languages[language] = instance
+    return instance
+
+  @staticmethod
+  def resolve(language):
+    """ Get the registered language whose tables are used for the given language, or None if it has no tables """
+    if language in ConfusionMatrix.sources:
+      return language
+    prefix = language.split("-")[0]
+    return prefix if prefix in ConfusionMatrix.sources else None
+
+  @staticmethod
+  def tablesKey(language, ordered):
+    """ Get the tables used for the language (None for the identity matrix) and the key identifying them, as a tuple
+        (key, tables). Languages using the same tables (like "en" and "eng-Latn") have the same key """
+    with ConfusionMatrix.lock:
+      tables = None
+      if language != None:
+        source = ConfusionMatrix.resolve(language)
+        if source != None:
+          tables = ConfusionMatrix.sources[source]
+        else:
+          if ConfusionMatrix.features == None:
+            ConfusionMatrix.features = ConfusionMatrix.featureTables() or englishTables
+          tables = ConfusionMatrix.features
+      return ((tables if isinstance(tables, (str, type(None))) else id(tables), ordered), tables)
+
+  @staticmethod
+  def buildShared(submap, language):
+    """ Build (or get from cache) the similarity matrix for the given language and its views, as a tuple
+        (matrix, gapPenalty, rows, sim) """
+    with ConfusionMatrix.lock:
+      key = ConfusionMatrix.tablesKey(language, submap.ordered)[0]
+      if key not in ConfusionMatrix.matrices:
+        matrix = ConfusionMatrix.buildMatrix(submap, language)
+        ConfusionMatrix.matrices[key] = (matrix, ConfusionMatrix.buildGapPenalty(matrix), matrix.tolist(), matrix.astype(np.float64))
+      return ConfusionMatrix.matrices[key]
+
+  @staticmethod
+  def buildMatrix(submap, language):
+    """ Build (or get from cache) the similarity matrix for the given language """
+    with ConfusionMatrix.lock:
+      key, tables = ConfusionMatrix.tablesKey(language, submap.ordered)
+      if key in ConfusionMatrix.matrices:
+        return ConfusionMatrix.matrices[key][0]
+
+      if isinstance(tables, str):
+        tables = loadConfusionTables(tables)
+      matrix = np.identity(len(submap.alphabet), dtype = np.float32)
+      for table, phonemes in (tables or []):
+        for x in phonemes:
+          if x not in submap.index:
+            raise ValueError("Unknown phoneme {} in the confusion table of {}".format(x, language))
+        similarity = table if isinstance(table, np.ndarray) else normalizeConfusionTable(parseConfusionTable(table))
+        indexes = [ submap.index[x] for x in phonemes ]
+        matrix[np.ix_(indexes, indexes)] = similarity
+      # Then copy the confusions of the tabled phonemes to their aliases (if the tables don't have the aliases already)
+      tabled = set(x for _, phonemes in (tables or []) for x in phonemes)
+      for phoneme, aliases in aliasesIPA.items():
+        if phoneme not in tabled:
+          continue
+        p = submap.index[phoneme]
+        for alias in aliases:
+          if alias in tabled:
+            continue
+          a = submap.index[alias]
+          matrix[a, :] = matrix[p, :]
+          matrix[:, a] = matrix[:, p]
+          matrix[a, p] = matrix[p, a] = aliasSimilarity
+          matrix[a, a] = 1.0
+
+      matrix.setflags(write = False)
+      return matrix
+
+  @staticmethod
+  def featureTables():
+    """ Build the similarity table of all the phonemes known to panphon from their features (see featureSimilarity),
+        as the tables of a language. Returns None if panphon isn't installed """
+    try:
+      import panphon
+    except ImportError:
+      logger.debug("panphon isn't installed, the English confusion tables are used for all the languages")
+      return None
+    features = panphon.FeatureTable()
+    phonemes = []
+    vectors = []
+    for c in IPASubmap().alphabet:
+      vector = features.word_to_vector_list(c, numeric = True)
+      # Only the characters that are a phoneme on their own
+      if len(vector) == 1 and c not in phonemes:
+        phonemes.append(c)
+        vectors.append(vector[0])
+    vectors = np.array(vectors)
+    differences = (vectors[:, None, :] != vectors[None, :, :]).sum(axis = 2)
+    similarity = featureSimilarity * np.maximum(0.0, 1.0 - differences / featureRange)
+    np.fill_diagonal(similarity, 1.0)
+    return [(similarity, phonemes)]
+
+  @staticmethod
+  def buildGapPenalty(matrix):
+    """ Compute the smallest penalty for each index gap, see gapPenalty """
+    n = len(matrix)
+    penalty = np.zeros(n, dtype = np.float64)
+    for gap in range(1, n):
+      penalty[gap] = 1.0 - float(np.diagonal(matrix, gap).max())
+    # The bound is for a gap of at least g, so it's the minimum over all the larger gaps
+    penalty[1:] = np.minimum.accumulate(penalty[1:][::-1])[::-1]
+    penalty.setflags(write = False)
+    return penalty
+
+  def penaltyBound(self, a, b):
+    """ A lower bound of the penalty of substituting phoneme index a by b, from their index gap only """
+    return self.gapPenalty[abs(a - b)]
+
+  def neighborhood(self, phoneme, penalty):
+    """ Get the range of indexes (start, stop) that contains all the phonemes whose penalty against the given phoneme
+        index is lower than penalty. With the ordered submap, it's a small range around the phoneme for low penalties """
+    n = len(self.gapPenalty)
+    # The smallest gap from which every phoneme costs at least the penalty
+    gap = int(np.searchsorted(self.gapPenalty[1:], penalty, side = "left")) + 1
+    return (max(0, phoneme - gap + 1), min(n, phoneme + gap))
 
   def _confuseScorePre(self, a, b, budget = None):
     """ Get the similarity score of string of phoneme A vs string of phoneme B that are already preprocessed. 
@@ -98,6 +395,7 @@ class ConfusionMatrix(object):
         If budget is None, this returns a score of similarity of 1 for similar SOP.
         Else, this returns the updated budget, where each change decreasing the budget by the confusion matrix score. It stops matching if budget is 0.
     """
+    sim = self.rows
     if budget == None:
       # Don't try a Levenshtein search if no budget for it
       # For now, string of different length are different in all cases
@@ -105,38 +403,64 @@ class ConfusionMatrix(object):
         return 0.0
       score = 1.0
       for c in zip(a, b):
-        score = score * self.confuseScorePhoneme(c[0], c[1])
+        score = score * sim[c[0]][c[1]]
       return score
-    else:
-      threshold = 0.99
-      score = budget
-      j = 0; i = 0
-      if len(a) < len(b): # Swap
-        a, b = b, a
-      while i < len(a):
-        # Substitution on end of the string ?
-        if j >= len(b):
-          return max(0.0, score - (len(a) - i) * 1.0)
-        s = self.confuseScorePhoneme(a[i], b[j])
-        if s <= threshold:
-          # It fails, let's see if we still have the budget for it
-          if score <= 1.0:
-            return 0.0
-          # Check if substitution with the next char is better
-          if j + 1 < len(b) and (t := self.confuseScorePhoneme(a[i], b[j+1])) > threshold:
-            # Missing a phoneme in B, so skip it
-            j = j+1
-          elif i + 1 < len(a) and (t := self.confuseScorePhoneme(a[i+1], b[j])) > threshold:
-            # Missing phoneme in A, so skip it
-            i = i+1
-          # Else, let's assume it's a replacement
-
-          score = score - 1.0
-
-        j = j + 1
-        i = i + 1
+    return self._alignBanded(a, b, budget)[0]
 
-      return score
+  def _alignBanded(self, a, b, budget, prefix = False):
+    """ Weighted Levenshtein alignment of string of phoneme A vs string of phoneme B, limited to the budget.
+        A substitution costs 1 - similarity of the phonemes and an insertion or a deletion costs 1.
+        Since each insertion or deletion costs 1, no alignment within the budget can leave the diagonal by more than
+        the budget, so only a band of cells around the diagonal is computed (Ukkonen's cutoff) and the search stops
+        as soon as all the cells of a row are over budget. This is a O(len(A) * budget) operation.
+
+        If prefix is True, A is aligned against any prefix of B (the end of B is free) instead of the whole B.
+        This returns a tuple of the remaining budget (0 if no alignment fits) and the number of consumed phonemes in B
+    """
+    sim = self.rows
+    la = len(a); lb = len(b)
+    # Maximum number of insertions/deletions that still leaves some budget
+    k = max(0, math.ceil(budget) - 1)
+    if not prefix and abs(la - lb) > k:
+      return (0.0, 0)
+
+    inf = float("inf")
+    prevLo = 0
+    prev = [ float(j) for j in range(min(lb, k) + 1) ]
+    for i in range(1, la + 1):
+      lo = max(0, i - k); hi = min(lb, i + k)
+      if lo > hi:
+        # A is longer than B by more than the band allows
+        return (0.0, 0)
+      row = sim[a[i - 1]]
+      prevHi = prevLo + len(prev) - 1
+      cur = []
+      for j in range(lo, hi + 1):
+        # Deletion of a phoneme of A
+        best = prev[j - prevLo] + 1.0 if j <= prevHi else inf
+        # Insertion of a phoneme of B
+        if j > lo and cur[-1] + 1.0 < best:
+          best = cur[-1] + 1.0
+        # Substitution (or match)
+        if j > prevLo:
+          v = prev[j - 1 - prevLo] + 1.0 - row[b[j - 1]]
+          if v < best:
+            best = v
+        cur.append(best)
+      if min(cur) >= budget:
+        # All the cells in the band are over budget, no need to continue
+        return (0.0, 0)
+      prev = cur; prevLo = lo
+
+    if prefix:
+      cost = min(prev)
+      consumed = prevLo + prev.index(cost)
+    else:
+      cost = prev[lb - prevLo]
+      consumed = lb
+    if cost >= budget:
+      return (0.0, 0)
+    return (budget - cost, consumed)
 
   def _confuseScore(self, A, B, budget = None):
     """ Get the similarity score of string of phoneme A vs string of phoneme B. Similar phonemes will have a score close to 1, while dissimilar phonemes will have a score close to 0
@@ -186,38 +510,269 @@ class ConfusionMatrix(object):
         Similar phonemes will have a score close to 1, while dissimilar phonemes will have a score close to 0
         This returns a tuple of the remaining budget for the best match and the number of consumed phonemes, where each change decreasing the budget by the confusion matrix score. It stops matching if budget is 0.
     """
+    if isinstance(B, SOPCursor):
+      # Only look at the words that can be matched word by word, and use the flat view of the buffer for the rest
+      countB = len(B)
+      b = B.flat()
+      B = B.words(len(A))
+    else:
+      countB = len(B)
+      b = None
+
     if not isinstance(A, list) or not isinstance(B, list):
       # Preprocessed input is a list of list of indexes
       # So bail out if not given what we expect
       return 0.0
-    
+
     # The algorithm here is a bit more complex
     # Typically, we'll first try to match word by word
-    # If score pass then we return this score
-    # Else, we'll rebuild a whole sentence without spaces and try matching again
-    # If score pass then we return this score
-    # Else, we return 0
-    tmpBudget = budget
+    # If the match is perfect, we return this score
+    # Else, we'll rebuild a whole sentence without spaces and align A against the beginning of B, since the words
+    # might have been split differently (this score is never worse than the word by word score)
+    # If the word by word score is as good, it's preferred since it consumes whole words
+    tmpBudget = 0.0
     consumed = 0
-    for c in zip(A, B):
-      score = self._confuseScorePre(c[0], c[1], tmpBudget)
-      consumed = consumed + min(len(c[0]), len(c[1]))
-      if score == 0:
-        tmpBudget = 0.0
-        consumed = 0
-        break
-      tmpBudget = score
-    
-    if tmpBudget > 0:
-      return (tmpBudget, consumed)
+    if countB >= len(A):
+      tmpBudget = budget
+      for c in zip(A, B):
+        score = self._confuseScorePre(c[0], c[1], tmpBudget)
+        consumed = consumed + len(c[1])
+        if score == 0:
+          tmpBudget = 0.0
+          consumed = 0
+          break
+        tmpBudget = score
+
+      if tmpBudget >= budget:
+        return (tmpBudget, consumed)
 
     # Rebuild the sentence and try again by flattening the strings
     a = [x for word in A for x in word]
-    b = [x for word in B for x in word]    
-    return (self._confuseScorePre(a, b, budget), min(len(a), len(b)))
+    if b == None:
+      b = [x for word in B for x in word]
+    r = self._alignBanded(a, b, budget, prefix = True)
+    if tmpBudget > 0 and tmpBudget >= r[0]:
+      return (tmpBudget, consumed)
+    return r
+
+  def _alignBatch(self, a, la, b, budget, prefix = False):
+    """ Vectorized version of _alignBanded, aligning many strings of phoneme A (padded in a 2D array, with la their lengths)
+        against the same string of phoneme B. Rows are computed for all candidates at once, and the insertion chain of a row
+        is resolved with a running minimum since an insertion always costs 1.
+        This returns an array of the alignment costs (inf if it doesn't fit the budget) and an array of consumed phonemes in B """
+    n = a.shape[0]
+    lb = len(b)
+    j = np.arange(lb + 1, dtype = np.float64)
+    prev = np.broadcast_to(j, (n, lb + 1))
+    # Candidates that are done with their string are captured when reaching their length
+    last = prev.copy()
+    finished = la == 0
+    b = np.asarray(b, dtype = np.intp)
+    for i in range(1, a.shape[1] + 1):
+      active = la >= i
+      if not active.any():
+        break
+      cur = np.empty_like(prev)
+      cur[:, 0] = prev[:, 0] + 1.0
+      # Deletion of a phoneme of A or substitution
+      cur[:, 1:] = np.minimum(prev[:, 1:] + 1.0, (prev[:, :-1] + 1.0) - self.sim[a[:, i - 1][:, None], b[None, :]])
+      # Insertion of a phoneme of B
+      cur = np.minimum.accumulate(cur - j, axis = 1) + j
+      done = la == i
+      last[done] = cur[done]
+      finished |= done
+      prev = cur
+      if (prev[active].min(axis = 1) >= budget).all():
+        # All remaining candidates are over budget
+        break
+
+    if prefix:
+      consumed = np.argmin(last, axis = 1)
+      cost = last[np.arange(n), consumed]
+    else:
+      consumed = np.full(n, lb)
+      cost = last[:, lb].copy()
+    # Candidates that exited early (or are over budget) don't fit
+    over = (cost >= budget) | ~finished
+    cost[over] = np.inf
+    consumed[over] = 0
+    return (cost, consumed)
+
+  def endCosts(self, packed, b):
+    """ Get the cost of aligning each candidate (a PackedSOPs instance) against B[:j], for every end j, in a single pass.
+        It's the unbanded version of _alignBatch, keeping the whole last row of each candidate.
+        This returns an array of len(packed) rows of len(B) + 1 costs """
+    n = len(packed)
+    lb = len(b)
+    b = np.asarray(b, dtype = np.intp)
+    j = np.arange(lb + 1, dtype = np.float64)
+    prev = np.tile(j, (n, 1))
+    for i in range(1, packed.flat.shape[1] + 1):
+      # Deletion of a phoneme of A or substitution
+      cur = prev + 1.0
+      cur[:, 1:] = np.minimum(cur[:, 1:], prev[:, :-1] + 1.0 - self.sim[packed.flat[:, i - 1][:, None], b[None, :]])
+      # Insertion of a phoneme of B
+      cur = np.minimum.accumulate(cur - j, axis = 1) + j
+      prev = np.where((packed.flatLen >= i)[:, None], cur, prev)
+    return prev
+
+  def startCosts(self, packed, b):
+    """ For each position s in the string of phoneme B, get the minimum cost of aligning any of the candidates (a PackedSOPs
+        instance) against a prefix of B[s:], for all the positions in a single pass.
+        It's the prefix alignment of _alignBanded for every suffix of B, computed backward (from the end of the candidates)
+        so that the start in B is free: row i holds the cost of aligning the end of the candidates from their i-th phoneme.
+        Since a word by word alignment is also an alignment against a prefix, this is a lower bound of the cost of
+        confuseScorePre at each position: if it's over the budget, confuseScorePre can't match there.
+        This returns an array of len(B) + 1 costs """
+    n = len(packed)
+    lb = len(b)
+    if n == 0:
+      return np.full(lb + 1, np.inf)
+    b = np.asarray(b, dtype = np.intp)
+    j = np.arange(lb + 1, dtype = np.float64)
+    # Aligning the empty end of a candidate costs nothing, wherever it starts
+    nxt = np.zeros((n, lb + 1))
+    for i in range(packed.flat.shape[1] - 1, -1, -1):
+      # Deletion of the i-th phoneme of A or substitution
+      cur = nxt + 1.0
+      cur[:, :-1] = np.minimum(cur[:, :-1], nxt[:, 1:] + 1.0 - self.sim[packed.flat[:, i][:, None], b[None, :]])
+      # Insertion of a phoneme of B before, resolved with a running minimum from the end
+      cur = np.minimum.accumulate((cur + j)[:, ::-1], axis = 1)[:, ::-1] - j
+      nxt = np.where((packed.flatLen > i)[:, None], cur, nxt)
+    return nxt.min(axis = 0)
+
+  def confuseScorePreBatch(self, packed, B, budget):
+    """ Score many candidates SOP (a PackedSOPs instance) against the same string of phonemes B in a single vectorized pass.
+        This gives the same result as calling confuseScorePre on each candidate, that is, it returns a tuple of an array
+        of the remaining budget for each candidate (0 if no match) and an array of the number of consumed phonemes in B """
+    n = len(packed)
+    remaining = np.zeros(n)
+    consumed = np.zeros(n, dtype = np.int64)
+    if n == 0 or budget <= 0:
+      return (remaining, consumed)
+    if n < ConfusionMatrix.batchThreshold:
+      # Not worth the numpy overhead
+      for i in range(n):
+        remaining[i], consumed[i] = self.confuseScorePre(packed.sop(i), B, budget)
+      return (remaining, consumed)
+
+    if isinstance(B, SOPCursor):
+      countB = len(B)
+      b = B.flat()
+      B = B.words(packed.words.shape[1])
+    else:
+      countB = len(B)
+      b = [x for word in B for x in word]
+
+    # Word by word first, only for candidates with at most as many words as B
+    wordBudget = np.where(packed.wordCount <= countB, float(budget), 0.0)
+    wordConsumed = np.zeros(n, dtype = np.int64)
+    for w in range(min(packed.words.shape[1], len(B))):
+      inWord = (packed.wordCount > w) & (wordBudget > 0)
+      if not inWord.any():
+        break
+      idx = np.nonzero(inWord)[0]
+      cost = self._alignBatch(packed.words[idx, w, :], packed.wordLen[idx, w], B[w], budget)[0]
+      fail = cost >= wordBudget[idx]
+      wordBudget[idx] = np.where(fail, 0.0, wordBudget[idx] - cost)
+      wordConsumed[idx] += len(B[w])
+    wordConsumed[wordBudget <= 0] = 0
+
+    # Then the flattened prefix alignment for the imperfect ones
+    remaining[:] = wordBudget
+    consumed[:] = wordConsumed
+    imperfect = np.nonzero(wordBudget < budget)[0]
+    if len(imperfect):
+      # No alignment within budget can consume more than the longest candidate plus the allowed insertions
+      b = b[:packed.flat.shape[1] + math.ceil(budget)]
+      cost, prefixConsumed = self._alignBatch(packed.flat[imperfect], packed.flatLen[imperfect], b, budget, prefix = True)
+      prefixBudget = np.where(np.isinf(cost), 0.0, budget - cost)
+      better = (wordBudget[imperfect] <= 0) | (wordBudget[imperfect] < prefixBudget)
+      sel = imperfect[better]
+      remaining[sel] = prefixBudget[better]
+      consumed[sel] = prefixConsumed[better]
+    return (remaining, consumed)
 
 
   def confuseScorePhoneme(self, A, B):
-    # TODO: Supports confusion matrix here
-    return 1.0 if A == B else 0.0
+    """ Get the similarity of phoneme A vs phoneme B (both being submap indexes) """
+    return self.rows[A][B]
+
+
+
+
+class PackedSOPs(object):
+  """ A batch of SOPs (list of list of submap indexes) packed in padded numpy arrays for vectorized scoring.
+      flat is the flattened SOPs (one row per SOP) with flatLen their lengths, words is the SOPs split by words
+      (one row per SOP and word) with wordLen their lengths and wordCount the number of words in each SOP.
+
+      The SOPs themselves are stored in a SOPArena (a new one by default, so they're freed with the batch), see sop and
+      SOPs. The padded arrays are
+      only built the first time they're used, since small batches are scored one SOP at a time (see batchThreshold) and
+      the forms of a large alternative node are searched in its trie instead """
+  __slots__ = ("arena", "spans", "wordCount", "flatLen", "arrays")
+
+  def __init__(self, SOPs, arena = None):
+    self.arena = arena if arena != None else SOPArena()
+    # First word and word count of each SOP in the arena
+    self.spans = array("I")
+    for sop in SOPs:
+      self.spans.extend(self.arena.add(sop))
+    self.wordCount = np.array([len(x) for x in SOPs], dtype = np.int64)
+    self.flatLen = np.array([sum(len(w) for w in x) for x in SOPs], dtype = np.int64)
+    self.arrays = None
+
+  @classmethod
+  def fromSpans(cls, arena, spans):
+    """ Pack the SOPs already stored in the arena, given by their spans (first word, word count), without copying them """
+    packed = cls.__new__(cls)
+    packed.arena = arena
+    packed.spans = array("I")
+    for span in spans:
+      packed.spans.extend(span)
+    packed.wordCount = np.array([x[1] for x in spans], dtype = np.int64)
+    packed.flatLen = np.array([arena.length(*x) for x in spans], dtype = np.int64)
+    packed.arrays = None
+    return packed
+
+  def sop(self, i):
+    """ Get the i-th SOP as a list of words """
+    return self.arena.sop(self.spans[2 * i], self.spans[2 * i + 1])
+
+  @property
+  def SOPs(self):
+    return [self.sop(i) for i in range(len(self))]
+
+  def pack(self):
+    """ Build the padded arrays (flat, words, wordLen) """
+    n = len(self)
+    SOPs = self.SOPs
+    maxWords = int(self.wordCount.max()) if n else 0
+    maxWordLen = max((len(w) for x in SOPs for w in x), default = 0)
+    flat = np.zeros((n, int(self.flatLen.max()) if n else 0), dtype = np.intp)
+    words = np.zeros((n, maxWords, maxWordLen), dtype = np.intp)
+    wordLen = np.zeros((n, maxWords), dtype = np.int64)
+    for i, sop in enumerate(SOPs):
+      f = [x for word in sop for x in word]
+      flat[i, :len(f)] = f
+      for w, word in enumerate(sop):
+        words[i, w, :len(word)] = word
+        wordLen[i, w] = len(word)
+    # Set at once, so a concurrent match either sees all the arrays or builds them too
+    self.arrays = (flat, words, wordLen)
+    return self.arrays
+
+  @property
+  def flat(self):
+    return (self.arrays or self.pack())[0]
+
+  @property
+  def words(self):
+    return (self.arrays or self.pack())[1]
+
+  @property
+  def wordLen(self):
+    return (self.arrays or self.pack())[2]
 
+  def __len__(self):
+    return len(self.flatLen)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Precompiled grammar files
+#
+# Building a grammar transliterates and discodes every node, which is slow for large intent sets. saveGrammar writes the
+# converted grammar to a compact binary file, and GrammarFile memory maps it and rebuilds the intents on demand without
+# calling Epitran, so many processes can share the same read-only grammar image.
+#
+# The file is made of a header followed by sections of 32 bits aligned arrays:
+#   - header: magic, version, then the item count of each section
+#   - strings offsets (uint32) and the UTF-8 bytes of all the strings (ids, names, texts)
+#   - words offsets (uint32) in the phoneme arena, and the phoneme arena (uint16 submap indexes)
+#   - intents offsets (uint32) in the node stream, and the node stream (uint32)
+# In the node stream, an intent is its name and its child count followed by each child: its type and its fields, a string
+# being an index in the strings table and a SOP being the index of its first word and its word count.
+from array import array
+import mmap
+import struct
+
+from .confusionmatrix import PackedSOPs
+from .matchresults import ID
+from .sop import SOPArena
+from .node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+
+magic = b"PHMG"
+version = 1
+header = struct.Struct("<4sI6I")
+noString = 0xFFFFFFFF
+
+# Node types in the stream
+basicType, alternativeType, parametricType, optionalType, endType = 1, 2, 3, 4, 5
+
+
+class _Writer(object):
+  def __init__(self):
+    self.strings = []
+    self.stringIndex = {}
+    self.arena = array("H")
+    self.words = array("I", [0])
+    self.intents = array("I", [0])
+    self.stream = array("I")
+
+  def string(self, text):
+    if text == None:
+      return noString
+    text = str(text)
+    if text not in self.stringIndex:
+      self.stringIndex[text] = len(self.strings)
+      self.strings.append(text)
+    return self.stringIndex[text]
+
+  def sop(self, SOP):
+    first = len(self.words) - 1
+    for word in SOP:
+      self.arena.extend(word)
+      self.words.append(len(self.arena))
+    self.stream.extend((first, len(SOP)))
+
+  def node(self, node):
+    s = self.stream
+    if isinstance(node, BasicNode):
+      s.extend((basicType, self.string(getattr(node, "id", None)), len(node.text)))
+      s.extend(self.string(x) for x in node.text)
+      self.sop(node.SOP)
+    elif isinstance(node, AlternativeNode):
+      s.extend((alternativeType, len(node.forms)))
+      for form in node.forms:
+        s.append(self.string(form[0]))
+        self.sop(form[1])
+    elif isinstance(node, ParametricNode):
+      if node.values != None:
+        raise TypeError("Can't save the value grammar of parameter {}".format(node.name))
+      s.extend((parametricType, self.string(node.name), node.maxParamCount))
+    elif isinstance(node, OptionalNode):
+      s.extend((optionalType, len(node.texts)))
+      for text, sop in zip(node.optionalText, node.texts):
+        s.append(self.string(text))
+        self.sop(sop)
+    elif isinstance(node, EndNode):
+      s.append(endType)
+    else:
+      raise TypeError("Can't save node of type {}".format(type(node).__name__))
+
+  def intent(self, intent, root):
+    self.stream.extend((self.string(intent), len(root.children)))
+    for child in root.children:
+      self.node(child)
+    self.intents.append(len(self.stream))
+
+  def write(self, path):
+    encoded = [x.encode("utf-8") for x in self.strings]
+    stringOffsets = array("I", [0])
+    for x in encoded:
+      stringOffsets.append(stringOffsets[-1] + len(x))
+    sections = [stringOffsets, b"".join(encoded), self.words, self.arena, self.intents, self.stream]
+    with open(path, "wb") as f:
+      f.write(header.pack(magic, version, len(stringOffsets), len(sections[1]), len(self.words), len(self.arena), len(self.intents), len(self.stream)))
+      for section in sections:
+        data = section.tobytes() if isinstance(section, array) else section
+        f.write(data)
+        # Keep the sections aligned
+        f.write(b"\0" * (-len(data) % 4))
+
+
+def saveGrammar(intents, path):
+  """ Save the grammar to the given path. intents is a dictionary or a list of tuple (intent, root TreeNode),
+      or a single root TreeNode """
+  writer = _Writer()
+  if isinstance(intents, TreeNode):
+    intents = [(None, intents)]
+  for intent, root in (intents.items() if isinstance(intents, dict) else intents):
+    writer.intent(intent, root)
+  writer.write(path)
+
+
+class GrammarFile(object):
+  """ A grammar file loaded with saveGrammar. The file is memory mapped and each intent's root TreeNode is only built
+      when it's first accessed. It behaves like a read-only list of tuple (intent, root TreeNode), so it can be given to
+      an IntentGraph directly.
+      The forms of the alternative and optional nodes aren't copied: they're read from the mapped file through a
+      read-only arena (see SOPArena.view), so processes loading the same file share their memory """
+  def __init__(self, path):
+    with open(path, "rb") as f:
+      self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    fields = header.unpack_from(self.map, 0)
+    if fields[0] != magic or fields[1] != version:
+      raise ValueError("Not a phonomatic grammar file (or unsupported version): {}".format(path))
+    counts = fields[2:]
+
+    self.view = view = memoryview(self.map)
+    offset = header.size
+    sections = []
+    for count, itemSize, format in zip(counts, (4, 1, 4, 2, 4, 4), ("I", "B", "I", "H", "I", "I")):
+      size = count * itemSize
+      sections.append(view[offset:offset + size].cast(format))
+      offset = offset + size + (-size % 4)
+    self.stringOffsets, self.stringBytes, self.words, self.arena, self.intentOffsets, self.stream = sections
+    self.sopArena = SOPArena.view(self.arena, self.words)
+    self.roots = {}
+
+  def __len__(self):
+    return len(self.intentOffsets) - 1
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def close(self):
+    """ Release the memory mapping (the already built intents stay usable: the forms they read from the file are first
+        copied to a private arena) """
+    arena = SOPArena()
+    for root in self.roots.values():
+      for node in root.children:
+        if isinstance(node, (AlternativeNode, OptionalNode)) and node.packed.arena is self.sopArena:
+          node.packed = PackedSOPs(node.packed.SOPs, arena)
+    self.sopArena = None
+    for section in (self.stringOffsets, self.stringBytes, self.words, self.arena, self.intentOffsets, self.stream):
+      section.release()
+    self.view.release()
+    self.map.close()
+
+  def __getitem__(self, index):
+    if index < 0:
+      index = index + len(self)
+    if index < 0 or index >= len(self):
+      raise IndexError("Intent index out of range")
+    return (self.intent(index), self.root(index))
+
+  def string(self, index):
+    if index == noString:
+      return None
+    return bytes(self.stringBytes[self.stringOffsets[index]:self.stringOffsets[index + 1]]).decode("utf-8")
+
+  def intent(self, index):
+    """ Get the name of the index-th intent (without building it) """
+    return self.string(self.stream[self.intentOffsets[index]])
+
+  def sop(self, first, count):
+    return self.sopArena.sop(first, count)
+
+  def root(self, index):
+    """ Get the root TreeNode of the index-th intent, building it on first access """
+    if index not in self.roots:
+      self.roots[index] = self._build(self.intentOffsets[index])
+    return self.roots[index]
+
+  def _build(self, pos):
+    s = self.stream
+    root = TreeNode()
+    count = s[pos + 1]
+    pos = pos + 2
+    for _ in range(count):
+      kind = s[pos]
+      if kind == basicType:
+        id = self.string(s[pos + 1])
+        textCount = s[pos + 2]
+        text = [ self.string(x) for x in s[pos + 3:pos + 3 + textCount] ]
+        pos = pos + 3 + textCount
+        node = BasicNode.fromSOP(ID(id) if id != None else None, text, self.sop(s[pos], s[pos + 1]))
+        pos = pos + 2
+      elif kind == alternativeType:
+        forms = []
+        for i in range(s[pos + 1]):
+          p = pos + 2 + 3 * i
+          forms.append((self.string(s[p]), (s[p + 1], s[p + 2])))
+        pos = pos + 2 + 3 * s[pos + 1]
+        node = AlternativeNode.fromPacked([ x[0] for x in forms ], PackedSOPs.fromSpans(self.sopArena, [ x[1] for x in forms ]))
+      elif kind == parametricType:
+        node = ParametricNode(self.string(s[pos + 1]), maximumParameterWordCount = s[pos + 2])
+        pos = pos + 3
+      elif kind == optionalType:
+        optionalText = []
+        texts = []
+        for i in range(s[pos + 1]):
+          p = pos + 2 + 3 * i
+          optionalText.append(self.string(s[p]))
+          texts.append((s[p + 1], s[p + 2]))
+        pos = pos + 2 + 3 * s[pos + 1]
+        node = OptionalNode.fromPacked(optionalText, PackedSOPs.fromSpans(self.sopArena, texts))
+      elif kind == endType:
+        node = EndNode()
+        pos = pos + 1
+      else:
+        raise ValueError("Corrupted grammar file, unknown node type {}".format(kind))
+      root.appendChild(node)
+    return root
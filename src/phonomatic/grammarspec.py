@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Declarative grammars
+#
+# Building the nodes one at a time transliterates each text on its own, so a large grammar calls Epitran once per form
+# even if most of its words are shared. Here, the whole grammar is parsed first, every distinct text (or word, when the
+# matcher transliterates word by word) is transliterated once, every distinct IPA word is discoded once, then the nodes
+# are assembled from the converted words with fromSOP. The nodes are the same as the ones built one at a time.
+#
+# An intent is given by one or more sentences in this syntax:
+#   Open the <object: curtain|cover|door> <name> [please]
+# where:
+#   - a plain word is a basic node (without ID)
+#   - <label: a|b|c> is an alternative node, each form's ID being its text, or written id=text to give another ID (like
+#     <action: open=Ouvrez|close=Fermez>). The label only documents the alternative. With a single form, it's a basic
+#     node with the form's ID
+#   - <name> is a parametric node, or an alternative node with the forms of the entity of that name if there's one
+#   - [a|b] (or [optional: a|b]) is an optional node
+# and the sentence ends with an end node (unless end is False).
+#
+# A grammar file is a JSON (or YAML, if PyYAML is installed) object with the intents, as intent => sentence or list of
+# sentences, and optionally the entities, as name => { id: text or list of texts }:
+#   { "entities": { "object": { "curtain": "rideaux", "cover": ["volets", "persiennes"] } },
+#     "intents": { "open": "<action: open=Ouvrez> les <object>", "volume": ["Baissez le volume de <value> [pourcent]"] } }
+import json
+import re
+
+from .matchresults import ID
+from .sop import SOPArena
+from .node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+
+_token = re.compile(r"<[^<>\[\]]*>|\[[^<>\[\]]*\]|[^\s<>\[\]]+")
+
+def parseSentence(sentence, entities = None, end = True):
+  """ Parse the sentence into its list of node specifications, each being one of:
+        ("basic", id, text), ("alternative", [(id, text), ...]), ("optional", [text, ...]), ("parametric", name), ("end",)
+      entities is an optional dictionary of name => list of tuple (id, text), see parseEntities """
+  nodes = []
+  pos = 0
+  for match in _token.finditer(sentence):
+    if sentence[pos:match.start()].strip():
+      break
+    pos = match.end()
+    token = match.group(0)
+    if token[0] == "<":
+      label, colon, forms = token[1:-1].partition(":")
+      if not colon:
+        name = label.strip()
+        if not name:
+          raise ValueError("Empty parameter in sentence [{}]".format(sentence))
+        nodes.append(("alternative", entities[name]) if entities and name in entities else ("parametric", name))
+        continue
+      forms = [ (x.partition("=")[0].strip(), x.partition("=")[2].strip()) if "=" in x else (x.strip(), x.strip()) for x in forms.split("|") ]
+      if not all(x[0] and x[1] for x in forms):
+        raise ValueError("Empty alternative form in sentence [{}]".format(sentence))
+      nodes.append(("basic", forms[0][0], forms[0][1]) if len(forms) == 1 else ("alternative", forms))
+    elif token[0] == "[":
+      texts = token[1:-1]
+      if texts.startswith("optional:"):
+        texts = texts[len("optional:"):]
+      texts = [ x.strip() for x in texts.split("|") ]
+      if not all(texts):
+        raise ValueError("Empty optional text in sentence [{}]".format(sentence))
+      nodes.append(("optional", texts))
+    else:
+      nodes.append(("basic", None, token))
+  if sentence[pos:].strip():
+    raise ValueError("Unbalanced brackets in sentence [{}] at {}".format(sentence, pos))
+  if end:
+    nodes.append(("end",))
+  return nodes
+
+def parseEntities(entities):
+  """ Convert the entities (name => { id: text or list of texts }) to name => list of tuple (id, text) """
+  return { name: [ (id, text) for id, texts in forms.items() for text in ([texts] if isinstance(texts, str) else texts) ]
+           for name, forms in entities.items() }
+
+def texts(specs):
+  """ All the texts of the node specifications (that's what must be transliterated) """
+  for spec in specs:
+    if spec[0] == "basic":
+      yield spec[2]
+    elif spec[0] == "alternative":
+      for form in spec[1]:
+        yield form[1]
+    elif spec[0] == "optional":
+      for text in spec[1]:
+        yield text
+
+def buildNodes(specs, ctx = None, values = None, arena = None):
+  """ Build the intents from their node specifications, a list of tuple (intent, list of node specifications), with the
+      given Matcher (the default one if None). Each distinct text of the whole grammar is only transliterated once (each
+      distinct word with a transliteration cache or word processing, see Matcher.splitManyToSOP) and each distinct IPA
+      word is only discoded once. values is an optional dictionary of parameter name => ValueGrammar for the parametric nodes.
+      The forms are stored in the given SOPArena, or else in a new one for the grammar (so they're freed with it).
+      Returns a list of tuple (intent, root TreeNode), like an IntentGraph expects """
+  ctx = ctx if ctx != None else TreeNode.matcher
+  arena = arena if arena != None else SOPArena()
+  unique = list(dict.fromkeys(text for _, nodes in specs for text in texts(nodes)))
+  ipa = dict(zip(unique, ctx.splitManyToSOP(unique)))
+  discoded = { x: ctx.submap.discode(x) for x in set(word for words in ipa.values() for word in words) }
+
+  def convert(text):
+    """ The IPA words and SOP of the text """
+    text = [ word for word in ipa[text] if len(word) > 0 ]
+    return (text, [ discoded[x] for x in text ])
+
+  intents = []
+  for intent, nodes in specs:
+    root = TreeNode()
+    for spec in nodes:
+      if spec[0] == "basic":
+        text, SOP = convert(spec[2])
+        node = BasicNode.fromSOP(ID(spec[1]) if spec[1] != None else None, text, SOP)
+      elif spec[0] == "alternative":
+        node = AlternativeNode.fromSOP([ (id, convert(text)[1]) for id, text in spec[1] ], arena = arena)
+      elif spec[0] == "optional":
+        node = OptionalNode.fromSOP(spec[1], [ convert(text)[1] for text in spec[1] ], arena = arena)
+      elif spec[0] == "parametric":
+        node = ParametricNode(spec[1], values = values.get(spec[1]) if values != None else None)
+      elif spec[0] == "end":
+        node = EndNode()
+      else:
+        raise ValueError("Unknown node type {}".format(spec[0]))
+      root.appendChild(node)
+    intents.append((intent, root))
+  return intents
+
+def buildGrammar(intents, entities = None, ctx = None, values = None, end = True, arena = None):
+  """ Build the intents given as a dictionary of intent => sentence or list of sentences (or a list of tuple (intent,
+      sentence)), see the syntax above. entities is an optional dictionary of name => { id: text or list of texts }.
+      Returns a list of tuple (intent, root TreeNode), an intent having one root per sentence """
+  entities = parseEntities(entities) if entities else None
+  specs = []
+  for intent, sentences in (intents.items() if isinstance(intents, dict) else intents):
+    for sentence in ([sentences] if isinstance(sentences, str) else sentences):
+      specs.append((intent, parseSentence(sentence, entities, end)))
+  return buildNodes(specs, ctx, values, arena)
+
+def loadGrammar(path, ctx = None, values = None, end = True, arena = None):
+  """ Load the grammar file (JSON, or YAML if the file ends with .yaml or .yml) and build its intents, see buildGrammar """
+  with open(path, encoding = "utf-8") as f:
+    if path.endswith((".yaml", ".yml")):
+      import yaml
+      grammar = yaml.safe_load(f)
+    else:
+      grammar = json.load(f)
+  return buildGrammar(grammar["intents"], grammar.get("entities"), ctx, values, end, arena)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+from .instrumentation import logger
+from .node import TreeNode
+from .sop import SOPBuffer, SOPCursor
+import heapq
+import math
+
+def latticePaths(arcs, maxPaths = 16):
+  """ Get the maxPaths most likely paths of a word lattice (see IntentGraph.matchLattice), as a list of tuple
+      (text, confidence) sorted by decreasing confidence """
+  outgoing = {}
+  for start, end, word, confidence in arcs:
+    outgoing.setdefault(start, []).append((end, word, confidence))
+  paths = []
+  # Best first search on the path confidence, so the first complete paths are the most likely ones. The counter keeps
+  # the heap from comparing the words
+  heap = [(-1.0, 0, 0, [])]
+  count = 1
+  while heap and len(paths) < maxPaths:
+    confidence, _, state, words = heapq.heappop(heap)
+    if state not in outgoing:
+      paths.append((" ".join(words), -confidence))
+      continue
+    for end, word, arcConfidence in outgoing[state]:
+      heapq.heappush(heap, (confidence * arcConfidence, count, end, words + [word] if word else words))
+      count = count + 1
+  return paths
+
+class GraphNode(object):
+  """ A node of the compiled intent graph. It wraps a TreeNode shared by all the intents that reach it """
+  def __init__(self, node = None):
+    self.node = node
+    # Following graph nodes, by TreeNode key
+    self.children = {}
+    # Intents that are fully matched when reaching this node
+    self.intents = []
+    # Intents whose remaining nodes can't be merged, as (intent, root, index of the first remaining child)
+    self.tails = []
+    # All the intents reachable from this node, to skip the branches without any shortlisted intent
+    self.reachable = set()
+
+class IntentGraph(object):
+  """ Compile many intents (each being a root TreeNode whose children are matched in order) into a single graph
+      where the common leading nodes of the intents are merged, like this:
+
+                       / curtain -> open_curtain
+           Open - the -
+                       \\ cover   -> open_cover
+           Close - the - cover    -> close_cover
+
+      Matching the graph scores each distinct node once for all the intents sharing it and returns all the intents
+      that matched, ranked by remaining budget.
+      Merging stops at the first node that can't be merged (like a parametric node, since it needs its siblings to
+      resynchronize), the remaining nodes of the intent being matched in order like TreeNode.matchText does.
+
+      With an index (an NGramIndex, see prefilter), matching can first shortlist the topM intents that share the most
+      n-grams with the input and only match those, skipping the branches of the graph that lead to no shortlisted intent.
+  """
+  def __init__(self, intents = None, index = None):
+    """ intents is a dictionary or a list of tuple (intent, root TreeNode). index is an optional NGramIndex, the
+        intents are added to it too """
+    self.root = GraphNode()
+    self.nodeCount = 0
+    self.index = index
+    if intents != None:
+      for intent, root in (intents.items() if isinstance(intents, dict) else intents):
+        self.add(intent, root)
+
+  def add(self, intent, root):
+    """ Add the intent given by its root TreeNode to the graph """
+    if self.index != None:
+      self.index.add(intent, root)
+    current = self.root
+    current.reachable.add(intent)
+    for i, child in enumerate(root.children):
+      key = child.key()
+      if key == None:
+        current.tails.append((intent, root, i))
+        return
+      if key not in current.children:
+        current.children[key] = GraphNode(child)
+        self.nodeCount = self.nodeCount + 1
+      current = current.children[key]
+      current.reachable.add(intent)
+    current.intents.append(intent)
+
+  def shortlist(self, SOP, topM, ctx):
+    """ The set of intents to match (None for all of them) """
+    if topM == None or self.index == None:
+      return None
+    with ctx.span("prefilter"):
+      return self.index.shortlist(SOP, topM)
+
+  def matchText(self, text, budget, ctx = None, topM = None):
+    """ Match the given text against all the intents with the given allowed budget and Matcher (the default one if None).
+        If topM is given (and the graph has an index), only the topM intents of the index's shortlist are matched.
+        This returns the list of tuple (remaining budget, intent, ids) for all matching intents, sorted by decreasing budget """
+    ctx = ctx if ctx != None else TreeNode.matcher
+    ctx.begin(text)
+    wl = ctx.splitToList(text)
+    return ctx.end(self.matchSOP(ctx.textToCursor(text), budget, wl, ctx, topM))
+
+  def matchSOP(self, SOP, budget, wl, ctx = None, topM = None):
+    """ Same as matchText for an already converted SOP (a list of words or a SOPCursor, that isn't modified) """
+    ctx = ctx if ctx != None else TreeNode.matcher
+    SOP = SOPCursor.of(SOP)
+    results = []
+    allowed = self.shortlist(SOP, topM, ctx)
+    with ctx.span("scoring"):
+      self._match(self.root, SOP, budget, wl, [], results, ctx, allowed)
+    results.sort(key = lambda x: -x[0])
+    if (ctx.verbosity > 0):
+      logger.debug("Graph match [{}] => {}".format(wl, [(x[0], x[1]) for x in results]))
+    return results
+
+  def matchBeam(self, text, budget, beamWidth = 8, topK = 5, ctx = None, topM = None):
+    """ Match the given text against all the intents with a beam search.
+        Unlike matchText that commits to the best choice of each node, this keeps the beamWidth best partial
+        hypotheses at each step, so a locally worse choice (like skipping an optional node or a worse alternative)
+        can still lead to the best intent. A larger beam is more accurate but slower.
+        topM restricts the search to the shortlist of the index, like matchText.
+        This returns up to topK tuples (remaining budget, intent, ids), one per intent, sorted by decreasing budget """
+    ctx = ctx if ctx != None else TreeNode.matcher
+    ctx.begin(text)
+    wl = ctx.splitToList(text)
+    return ctx.end(self.matchSOPBeam(ctx.textToCursor(text), budget, wl, beamWidth, topK, ctx, topM))
+
+  def matchSOPBeam(self, SOP, budget, wl, beamWidth = 8, topK = 5, ctx = None, topM = None):
+    """ Same as matchBeam for an already converted SOP (a list of words or a SOPCursor, that isn't modified) """
+    ctx = ctx if ctx != None else TreeNode.matcher
+    SOP = SOPCursor.of(SOP)
+    allowed = self.shortlist(SOP, topM, ctx)
+    results = self._beam([(budget, SOP, wl)], beamWidth, topK, ctx, allowed)
+    results = [x[:3] for x in results]
+    if (ctx.verbosity > 0):
+      logger.debug("Beam match [{}] => {}".format(wl, [(x[0], x[1]) for x in results]))
+    return results
+
+  def matchNBest(self, transcripts, budget, beamWidth = None, topK = 5, ctx = None, topM = None, confidenceWeight = 1.0):
+    """ Match the N-best list of an ASR engine in a single beam search, instead of matching each transcript in turn.
+        transcripts is a list of text or of tuple (text, confidence), the confidence being a probability (or any
+        positive score where higher is better). The confidence is folded into the budget: a transcript starts with the
+        budget minus confidenceWeight * log(best confidence / its confidence), so a less likely transcript must match
+        better to win, and one whose starting budget is spent isn't matched at all.
+        All the transcripts start in the same beam, so the unlikely ones are dropped as soon as they fall behind, and
+        hypotheses of different transcripts that reach the same node with the same remaining input are merged. The beam
+        is 8 hypotheses per transcript by default, that's as wide as matching each transcript with matchBeam.
+        Each transcript (or each word, with a transliteration cache or word processing) is only transliterated once.
+        This returns up to topK tuples (remaining budget, intent, ids, index of the transcript), one per intent,
+        sorted by decreasing budget """
+    ctx = ctx if ctx != None else TreeNode.matcher
+    transcripts = [ x if isinstance(x, tuple) else (x, 1.0) for x in transcripts ]
+    beamWidth = beamWidth if beamWidth != None else 8 * max(1, len(transcripts))
+    ctx.begin(" | ".join(x[0] for x in transcripts))
+    with ctx.span("transliteration"):
+      sops = ctx.splitManyToSOP([ x[0] for x in transcripts ])
+    with ctx.span("discode"):
+      cursors = [ SOPBuffer.fromIPA(x, ctx.submap).cursor() for x in sops ]
+
+    bestConfidence = max((x[1] for x in transcripts), default = 1.0)
+    starts = []
+    for (text, confidence), SOP in zip(transcripts, cursors):
+      t = budget - confidenceWeight * math.log(bestConfidence / confidence) if confidence > 0 else 0.0
+      starts.append((t, SOP, ctx.splitToList(text)))
+
+    allowed = None
+    if topM != None and self.index != None:
+      allowed = set()
+      for SOP in cursors:
+        allowed |= self.shortlist(SOP, topM, ctx)
+    results = self._beam(starts, beamWidth, topK, ctx, allowed)
+    if (ctx.verbosity > 0):
+      logger.debug("N-best match {} => {}".format(transcripts, [(x[0], x[1], x[3]) for x in results]))
+    return ctx.end(results)
+
+  def matchLattice(self, arcs, budget, beamWidth = None, topK = 5, ctx = None, topM = None, confidenceWeight = 1.0, maxPaths = 16):
+    """ Match a (small) word lattice, given as a list of arcs (from state, to state, word, confidence). The lattice
+        starts at the state 0 and ends at the states without outgoing arcs. Its maxPaths most likely paths (the
+        confidence of a path being the product of its arcs' confidences) are matched like an N-best list (see matchNBest).
+        This returns up to topK tuples (remaining budget, intent, ids, path text), one per intent, sorted by decreasing budget """
+    paths = latticePaths(arcs, maxPaths)
+    results = self.matchNBest(paths, budget, beamWidth, topK, ctx, topM, confidenceWeight)
+    return [ (x[0], x[1], x[2], paths[x[3]][0]) for x in results ]
+
+  def _beam(self, starts, beamWidth, topK, ctx, allowed):
+    """ The beam search from the given starts, a list of tuple (budget, SOP, word list) """
+    best = {}
+    wls = [ x[2] for x in starts ]
+    # A hypothesis is a tuple (remaining budget, position, remaining SOP, ids, index of its start), the position being
+    # either a GraphNode or a tuple (intent, root, index of the next child) when in the non merged tail of an intent
+    beam = [ (t, self.root, SOP, [], i) for i, (t, SOP, _) in enumerate(starts) if t > 0 ]
+    with ctx.span("scoring"):
+      while beam:
+        candidates = []
+        for t, position, sop, ids, start in beam:
+          if isinstance(position, GraphNode):
+            for intent in position.intents:
+              if allowed == None or intent in allowed:
+                self._complete(best, t, intent, ids, sop, start)
+            successors = [(child.node, child) for child in position.children.values()
+                          if allowed == None or not child.reachable.isdisjoint(allowed)]
+            successors += [(root.children[index], (intent, root, index + 1)) for intent, root, index in position.tails
+                           if allowed == None or intent in allowed]
+          else:
+            intent, root, index = position
+            if index == len(root.children):
+              self._complete(best, t, intent, ids, sop, start)
+              continue
+            successors = [(root.children[index], (intent, root, index + 1))]
+
+          for node, nextPosition in successors:
+            for r in ctx.expandNode(node, sop, t, wls[start], beamWidth):
+              candidates.append((r[0], nextPosition, r[2], ids + [r[1]] if r[1] != None else ids, start))
+
+        # Keep the best hypotheses, preferring the ones that consumed more of the input
+        candidates.sort(key = lambda x: (-x[0], x[2].remaining()))
+        if len(starts) > 1:
+          candidates = self._merge(candidates, beamWidth)
+        beam = candidates[:beamWidth]
+
+    return [x[1] for x in sorted(best.values(), key = lambda x: x[0], reverse = True)[:topK]]
+
+  @staticmethod
+  def _merge(candidates, count):
+    """ Drop the (sorted) candidates that are in the same state as a better one: same position, same remaining input
+        and same results. That's what happens to the transcripts of an N-best list that only differ before this point """
+    seen = set()
+    merged = []
+    for x in candidates:
+      position = id(x[1]) if isinstance(x[1], GraphNode) else (x[1][0], id(x[1][1]), x[1][2])
+      key = (position, tuple(bytes(w) for w in x[2].words()), tuple(str(r) for r in x[3]))
+      if key not in seen:
+        seen.add(key)
+        merged.append(x)
+        if len(merged) == count:
+          break
+    return merged
+
+  @staticmethod
+  def _complete(best, budget, intent, ids, SOP, start = 0):
+    # Like matchText, some input can remain unmatched, but for the same budget, the hypothesis that matched more is better
+    # (and the one that matched more nodes, instead of capturing them in a parameter)
+    key = (budget, -SOP.remaining(), len(ids))
+    if intent not in best or best[intent][0] < key:
+      best[intent] = (key, (budget, intent, ids, start))
+
+  def _match(self, graphNode, SOP, budget, wl, ids, results, ctx, allowed = None):
+    for intent in graphNode.intents:
+      if allowed == None or intent in allowed:
+        results.append((budget, intent, ids))
+
+    for intent, root, index in graphNode.tails:
+      if allowed != None and intent not in allowed:
+        continue
+      t = budget
+      sop = SOP.copy()
+      tailIds = list(ids)
+      for child in root.children[index:]:
+        r = ctx.matchNode(child, sop, t, wl)
+        if r[0] <= 0.0:
+          break
+        if r[1] != None:
+          tailIds.append(r[1])
+        t = r[0]
+      else:
+        results.append((t, intent, tailIds))
+
+    for child in graphNode.children.values():
+      if allowed != None and child.reachable.isdisjoint(allowed):
+        continue
+      sop = SOP.copy()
+      r = ctx.matchNode(child.node, sop, budget, wl)
+      if r[0] > 0.0:
+        self._match(child, sop, r[0], wl, ids + [r[1]] if r[1] != None else ids, results, ctx, allowed)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+# The logger of the library, the matching steps are logged there (at debug level) depending on the matcher's verbosity
+logger = logging.getLogger("phonomatic")
+
+class Instrumentation(object):
+  """ Measures where the matching time goes, to find the slow nodes of a grammar. Set it as the instrumentation of a
+      Matcher to enable it. When a matcher has no instrumentation, nothing is measured.
+
+      It collects:
+        - for each node, the number of calls and the time spent matching it (including the nodes it matches itself,
+          like the node following a parametric node)
+        - for each node type, the number of calls, the time spent, the budget spent by the successful matches and the
+          number of failed matches
+        - for each request (a matchText call), the time spent in each step: transliteration, discode and scoring
+        - if trace is True, the trace of each request: the result each node chose, with the budget before and after
+
+      The report of each request is a dictionary given to the callback if any, or else logged to the given logger
+      (the phonomatic logger by default) at debug level. Requests can be matched from many threads at once """
+  def __init__(self, callback = None, trace = False, logger = logger):
+    self.callback = callback
+    self.trace = trace
+    self.logger = logger
+    self.lock = threading.Lock()
+    # The request being matched by each thread
+    self.local = threading.local()
+    self.reset()
+
+  def reset(self):
+    """ Forget everything that was measured """
+    with self.lock:
+      # Node => [calls, time]
+      self.nodes = {}
+      # Node type => [calls, time, budget spent, failures]
+      self.types = {}
+      self.requests = 0
+
+  def begin(self, text):
+    """ Start a request for the given text: the spans and nodes measured from this thread are part of it until end """
+    self.local.request = { "text": text, "spans": {}, "trace": [] if self.trace else None, "start": time.perf_counter() }
+
+  def end(self, result):
+    """ End the current request with the given result, and report it """
+    request = getattr(self.local, "request", None)
+    self.local.request = None
+    if request == None:
+      return result
+    request["time"] = time.perf_counter() - request.pop("start")
+    request["result"] = result
+    with self.lock:
+      self.requests = self.requests + 1
+    if self.callback != None:
+      self.callback(request)
+    elif self.logger.isEnabledFor(logging.DEBUG):
+      self.logger.debug("Request [{}] took {:.6f}s {} => {}".format(request["text"], request["time"], request["spans"], result))
+      if request["trace"] != None:
+        for step in request["trace"]:
+          self.logger.debug("  {} chose {} with budget {} => {}".format(*step))
+    return result
+
+  @contextmanager
+  def span(self, name):
+    """ Measure the time spent in the given step of the current request """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      request = getattr(self.local, "request", None)
+      if request != None:
+        request["spans"][name] = request["spans"].get(name, 0.0) + time.perf_counter() - start
+
+  def matchNode(self, node, SOP, budget, wl, ctx):
+    start = time.perf_counter()
+    r = node.matchSOP(SOP, budget, wl, ctx)
+    self.record(node, budget, r[0], r[1], time.perf_counter() - start)
+    return r
+
+  def expandNode(self, node, SOP, budget, wl, limit, ctx):
+    start = time.perf_counter()
+    expansions = node.expandSOP(SOP, budget, wl, limit, ctx)
+    best = expansions[0] if expansions else (0.0, None)
+    self.record(node, budget, best[0], best[1], time.perf_counter() - start)
+    return expansions
+
+  def record(self, node, budget, remaining, result, elapsed):
+    """ Record a match of the node, from the given budget to the remaining budget (0 if it failed) """
+    kind = type(node).__name__
+    with self.lock:
+      counters = self.nodes.setdefault(node, [0, 0.0])
+      counters[0] = counters[0] + 1
+      counters[1] = counters[1] + elapsed
+      counters = self.types.setdefault(kind, [0, 0.0, 0.0, 0])
+      counters[0] = counters[0] + 1
+      counters[1] = counters[1] + elapsed
+      if remaining > 0:
+        counters[2] = counters[2] + budget - remaining
+      else:
+        counters[3] = counters[3] + 1
+
+    request = getattr(self.local, "request", None)
+    if request != None and request["trace"] != None:
+      request["trace"].append((kind, str(result) if result != None else None, budget, remaining))
+
+  def slowest(self, count = 10):
+    """ The nodes that took the most time, as a list of tuple (node, calls, time) """
+    with self.lock:
+      nodes = [(node, x[0], x[1]) for node, x in self.nodes.items()]
+    return sorted(nodes, key = lambda x: -x[2])[:count]
+
+  def stats(self):
+    """ Get the statistics per node type as a dictionary """
+    with self.lock:
+      return { "requests": self.requests,
+               "types": { kind: { "calls": x[0], "time": x[1], "budgetSpent": x[2], "failures": x[3] } for kind, x in self.types.items() } }
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from .confusionmatrix import IPASubmap, ConfusionMatrix
+from .instrumentation import logger
+from .sop import SOPBuffer
+from .transliterators import EpitranInst
+from contextlib import nullcontext
+import re
+
+# The default submap, it's never modified so it's shared by all the matchers (the confusion matrices are shared too, per
+# language, see ConfusionMatrix.forLanguage)
+defaultSubmap = IPASubmap()
+
+class Matcher(object):
+  """ The context of a match: the transliterator (and so the language), the confusion matrix, the options and the
+      transliteration cache. It's passed to the nodes' matchSOP, so nothing global is used while matching and many
+      matchers (for different languages or options) can use the same grammar at the same time, from many threads.
+      A matcher isn't modified when matching, and the SOP being matched is a cursor private to each match.
+
+      When no matcher is given, the nodes use TreeNode.matcher, the default matcher that's set up by the TreeNode static
+      methods (setLanguage, setVerbosity...) """
+  def __init__(self, language = None, transliterator = None, confusionMatrix = None, verbosity = 0, wordProcessing = False, cache = None, instrumentation = None):
+    """ transliterator is an object with a transliterate(text) method and a language attribute (see Transliterator),
+        by default an Epitran instance for the given language (Epitran is only loaded when first used). cache is an optional TransliterationCache and instrumentation an optional
+        Instrumentation (both are thread safe) """
+    self.transliterator = transliterator if transliterator != None else EpitranInst(language)
+    self.confusionMatrix = confusionMatrix
+    self.submap = defaultSubmap
+    # What's logged to the phonomatic logger. 0: nothing, 1: include processing steps, 2: include each node's match
+    self.verbosity = verbosity
+    # See TreeNode.setWordProcessing
+    self.wordProcessing = wordProcessing
+    self.cache = cache
+    self.instrumentation = instrumentation
+
+  @property
+  def language(self):
+    return self.transliterator.language
+
+  @property
+  def confusionMatrix(self):
+    """ The confusion matrix given to the matcher, or else the shared matrix of the transliterator's language (so it
+        follows the language when it's changed, English if there's no language) """
+    if self.fixedConfusionMatrix != None:
+      return self.fixedConfusionMatrix
+    return ConfusionMatrix.forLanguage(self.language or "en")
+
+  @confusionMatrix.setter
+  def confusionMatrix(self, confusionMatrix):
+    self.fixedConfusionMatrix = confusionMatrix
+
+  def splitToSOP(self, text):
+    """ Split the text into list of string of phoneme (SOP) """
+    # Remove punctuations since Epitran doesn't deal with it correctly
+    text = re.sub(r"[,.:;']", "", text)
+
+    if self.cache != None:
+      words = list(filter(lambda x: len(x)>0, text.split(' ')))
+      sop = [self.cache.transliterate(self.language, x, self.transliterator.transliterate) for x in words]
+    elif self.wordProcessing:
+      words = list(filter(lambda x: len(x)>0, text.split(' ')))
+      sop = [self.transliterator.transliterate(x) for x in words]
+    else:
+      sop = list(filter(lambda x: len(x)>0, self.transliterator.transliterate(text).split(' ')))
+
+    if (self.verbosity > 1):
+      logger.debug("Text: [{}] transliterated to [{}]".format(text, sop))
+
+    return sop
+
+  def splitManyToSOP(self, texts):
+    """ Split many texts (like the N-best transcripts of an utterance) into their list of SOP, transliterating each
+        distinct text once. When transliterating word by word (with a cache or word processing), each distinct word is
+        only transliterated once for all the texts """
+    if self.cache == None and not self.wordProcessing:
+      sops = {}
+      for text in texts:
+        if text not in sops:
+          sops[text] = self.splitToSOP(text)
+      return [ sops[text] for text in texts ]
+
+    texts = [ self.splitToWords(text) for text in texts ]
+    ipa = self.transliterateWords(word for words in texts for word in words)
+    return [ [ ipa[word] for word in words ] for words in texts ]
+
+  def transliterateWords(self, words):
+    """ Transliterate each distinct word once (with the cache if any), returns a dictionary of word => IPA """
+    ipa = {}
+    for word in words:
+      if word not in ipa:
+        ipa[word] = self.cache.transliterate(self.language, word, self.transliterator.transliterate) if self.cache != None else self.transliterator.transliterate(word)
+    return ipa
+
+  @staticmethod
+  def splitToWords(text):
+    """ Split the text into the list of words to transliterate (without the punctuations) """
+    return Matcher.splitToList(re.sub(r"[,.:;']", "", text))
+
+  @staticmethod
+  def splitToList(text):
+    """ Split the text into list of non empty words """
+    return list(filter(lambda x: len(x)>0, text.split(' ')))
+
+  def textToCursor(self, text):
+    """ Convert the text to a SOP buffer and get a cursor on it, that's what matchSOP expects """
+    with self.span("transliteration"):
+      sop = self.splitToSOP(text)
+    with self.span("discode"):
+      return SOPBuffer.fromIPA(sop, self.submap).cursor()
+
+  # Instrumentation hooks, they do nothing without instrumentation
+  def begin(self, text):
+    """ Start the request for matching the given text """
+    if self.instrumentation != None:
+      self.instrumentation.begin(text)
+
+  def end(self, result):
+    """ End the current request with the given result (that's returned) """
+    if self.instrumentation != None:
+      return self.instrumentation.end(result)
+    return result
+
+  def span(self, name):
+    """ A context manager measuring the given step of the current request """
+    if self.instrumentation != None:
+      return self.instrumentation.span(name)
+    return nullcontext()
+
+  def matchNode(self, node, SOP, budget, wl):
+    """ Match the node (that's node.matchSOP with this matcher), nodes must use this to match other nodes """
+    if self.instrumentation != None:
+      return self.instrumentation.matchNode(node, SOP, budget, wl, self)
+    return node.matchSOP(SOP, budget, wl, self)
+
+  def expandNode(self, node, SOP, budget, wl, limit = None):
+    """ Expand the node (that's node.expandSOP with this matcher) """
+    if self.instrumentation != None:
+      return self.instrumentation.expandNode(node, SOP, budget, wl, limit, self)
+    return node.expandSOP(SOP, budget, wl, limit, self)
+
+  def matchText(self, root, text, budget):
+    """ Match the given text against the given root TreeNode (or IntentGraph) with this matcher """
+    return root.matchText(text, budget, self)
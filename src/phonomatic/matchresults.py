@@ -2,6 +2,9 @@
 
 # Results of matching
 class Result(object):
+  # A match allocates many results, so they don't have a __dict__
+  __slots__ = ("id",)
+
   def __init__(self, id):
     self.id = id
   
@@ -10,19 +13,27 @@ class Result(object):
 
 class Optional(Result):
   """ An optional node was detected, this stores the optional text that matched. """
+  __slots__ = ()
+
   def __init__(self, text):
     super().__init__(text)
 
 class ID(Result):
   """ An identified was detected, this stores the identifier that matched. """
+  __slots__ = ()
+
   def __init__(self, id):
     super().__init__(id)
 
 class Parameter(Result):
-  """ A parameter was detected, this stores the actual text found for the parameter. """
-  def __init__(self, id, value):
+  """ A parameter was detected, this stores the actual text found for the parameter and its value.
+      Without a value grammar, the value is the text, else it's the normalized value (like a number) """
+  __slots__ = ("value", "text")
+
+  def __init__(self, id, value, text = None):
     super().__init__(id)
     self.value = value
+    self.text = text if text != None else value
 
   def __str__(self):
-    return super().__str__() + " = " + self.value
\ No newline at end of file
+    return super().__str__() + " = " + str(self.value)
\ No newline at end of file
@@ -1,35 +1,16 @@
 # -*- coding: utf-8 -*-
-from .confusionmatrix import IPASubmap, ConfusionMatrix
+from .confusionmatrix import PackedSOPs
+from .instrumentation import logger
 from .matchresults import Optional, ID, Parameter
-import epitran
-import re
-
-submap = IPASubmap()
-confusionMatrix = ConfusionMatrix()
-
-class EpitranInst:
-  """ The instance wrapper of Epitran that can change language at runtime """
-  def __init__(self, language = None):
-    if language == None:
-      self.epiInst = None
-    else:
-      self.epiInst = epitran.Epitran(language)
-
-  def transliterate(self, text):
-    if self.epiInst == None:
-      return text
-    return self.epiInst.transliterate(text)
-
-  def setLanguage(self, language):
-    self.epiInst = epitran.Epitran(language)
+from .matcher import Matcher, EpitranInst, defaultSubmap as submap
+from .phonetictrie import PhoneticTrie
+import math
+import numpy as np
 
 class TreeNode(object):
-  epiInst = EpitranInst()
-  # Increase the verbosity to the logger. 0: nothing, 1: include processing steps
-  verbosity = 0
-  # From an old issue in Epitran Github, it's said it should transliterate only words not sentences. Yet, it seems to work better if running on sentences.
-  # Set to True to enable word only processing
-  wordProcessing = False
+  # The default matcher, used to build the nodes and when matching without a matcher (see Matcher)
+  matcher = Matcher()
+  epiInst = matcher.transliterator
 
   """ A tree node in the intent graph. There are multiple possible type of TreeNode object
       The *basic* version is a textual version that must match 1:1 with the expressed string
@@ -38,7 +19,11 @@ class TreeNode(object):
       The *parametric* version allow any value that are well defined for the language
       The *optional* version is a node that would also match being missing or 1:1
       The *end* version is a node that used reject any SOP if anything remains
+
+      Nodes (and results) use __slots__ since a grammar can have a lot of them
   """
+  __slots__ = ("parent", "children")
+
   def __init__(self, parent = None, verbosity = 0):
     self.parent = parent
     self.children = []
@@ -53,11 +38,19 @@ class TreeNode(object):
   def setLanguage(language):
     """ Static method to set the language of the Epitran instance.
         Refer to https://github.com/dmort27/epitran for a list of supported languages """
-    TreeNode.epiInst.setLanguage(language)
+    TreeNode.matcher.transliterator.setLanguage(language)
+
+  @staticmethod
+  def setTransliterator(transliterator):
+    """ Static method to set the transliterator used to build the nodes, like a ChainTransliterator that looks the words
+        up in a lexicon before using Epitran (see Transliterator) """
+    TreeNode.matcher.transliterator = transliterator
+    TreeNode.epiInst = transliterator
 
   @staticmethod
   def setVerbosity(verbosity):
-    TreeNode.verbosity = verbosity
+    """ Increase the verbosity to the logger. 0: nothing, 1: include processing steps """
+    TreeNode.matcher.verbosity = verbosity
 
   @staticmethod
   def setWordProcessing(wordProcessing):
@@ -66,79 +59,96 @@ class TreeNode(object):
         to be run on single word only and not plain sentences
         
         By limited testing, seems to behave better without, so defaults to False """
-    TreeNode.wordProcessing = wordProcessing
+    TreeNode.matcher.wordProcessing = wordProcessing
 
   @staticmethod
-  def splitToSOP(text):
-    """ Split the text into list of string of phoneme (SOP) """
-    # Remove punctuations since Epitran doesn't deal with it correctly
-    text = re.sub(r"[,.:;']", "", text)
-    
-    if TreeNode.wordProcessing:    
-      words = list(filter(lambda x: len(x)>0, text.split(' ')))
-      sop = [TreeNode.epiInst.transliterate(x) for x in words]
-    else:
-      sop = list(filter(lambda x: len(x)>0, TreeNode.epiInst.transliterate(text).split(' ')))
-
-    if (TreeNode.verbosity > 1):
-      print("Text: [{}] transliterated to [{}]".format(text, sop))
+  def setTransliterationCache(cache):
+    """ Set the TransliterationCache to use (or None to disable it)
+        When a cache is used, the text is transliterated word by word (like word processing) so each word is only
+        transliterated once by Epitran """
+    TreeNode.matcher.cache = cache
 
-    return sop
+  @staticmethod
+  def splitToSOP(text):
+    """ Split the text into list of string of phoneme (SOP) with the default matcher """
+    return TreeNode.matcher.splitToSOP(text)
 
   @staticmethod
   def splitToList(text):
     """ Split the text into list of non empty words """
-    return list(filter(lambda x: len(x)>0, text.split(' ')))
+    return Matcher.splitToList(text)
 
   @staticmethod
-  def splice(SOP, indexes, wordBoundaries = False):
-      lenInput = [len(x) for x in SOP]
-      # Then splice the string from all required elements (including leaking words)
-      for i in range(0, len(SOP)):
-        if indexes >= lenInput[i]:
-          SOP.pop(0)
-          indexes = indexes - lenInput[i]
-        elif indexes > 0:
-          # If we always cut at word boundaries, let's drop the end of this current word anyway
-          if (wordBoundaries):
-            SOP.pop(0)
-          else:
-            SOP[0][:] = SOP[0][indexes:]
-          break
-        else:
-          break
+  def textToCursor(text):
+    """ Convert the text to a SOP buffer and get a cursor on it, that's what matchSOP expects """
+    return TreeNode.matcher.textToCursor(text)
 
-  def matchText(self, text, budget):
+  def matchText(self, text, budget, ctx = None):
     """ Match the given text with the given allowed budget.
         The text is first converted to SOP (you can use matchSOP if you already have the SOP
         The tree is followed as long as the budget isn't spent for a branch.
         This method returns the node with the highest budget if one found with a remaining budget
         or None if none matched withing the budget
+        ctx is the Matcher to use (the default matcher if None)
     """
+    ctx = ctx if ctx != None else TreeNode.matcher
+    ctx.begin(text)
     ids = []
-    wl = TreeNode.splitToList(text)
-    vt = submap.discode(TreeNode.splitToSOP(text))
-    print("Matching [{}] => {} with".format(wl, vt))
+    wl = ctx.splitToList(text)
+    vt = ctx.textToCursor(text)
+    if (ctx.verbosity > 0):
+      logger.debug("Matching [{}] => {}".format(wl, vt))
     t = budget
-    for child in self.children:
-      r = child.matchSOP(vt, t, wl)
-      if r[0] > 0.0:
-        if r[1] != None:
-          ids.append(r[1])
-        t = r[0]
-      else: 
-        ids = None
-        break
-    print("Result {}".format(ids))
-    return ids
+    with ctx.span("scoring"):
+      for child in self.children:
+        r = ctx.matchNode(child, vt, t, wl)
+        if r[0] > 0.0:
+          if r[1] != None:
+            ids.append(r[1])
+          t = r[0]
+        else: 
+          ids = None
+          break
+    if (ctx.verbosity > 0):
+      logger.debug("Result {}".format(ids))
+    return ctx.end(ids)
 
   @staticmethod
   def results_to_str(ids, withOptionals = False):
     return [str(x) for x in ids if withOptionals or not isinstance(x, Optional)]
 
-  def matchSOP(self, SOP, budget, wl = None):
+  def matchSOP(self, SOP, budget, wl = None, ctx = None):
+    """ Match the beginning of the SOP (a SOPCursor) with the given allowed budget and Matcher (the default one if None).
+        On success, the cursor is moved after what was matched.
+        This returns a tuple of the remaining budget (0 if not matched) and the result (or None) """
     pass
 
+  def expandSOP(self, SOP, budget, wl, limit = None, ctx = None):
+    """ Get all the possible ways this node can match the beginning of the SOP, as a list of tuple
+        (remaining budget, result, remaining SOP), sorted by decreasing budget and limited to limit items if given.
+        Unlike matchSOP, this doesn't modify the given SOP and doesn't commit to the best choice, so a search can explore
+        many hypotheses. By default, this is the best match only """
+    sop = SOP.copy()
+    r = self.matchSOP(sop, budget, wl, ctx)
+    if r[0] <= 0.0:
+      return []
+    return [(r[0], r[1], sop)]
+
+  def key(self):
+    """ A hashable key identifying what this node matches, used to merge identical nodes of different intents.
+        Returns None if the node can't be merged (because its matching depends on its siblings) """
+    return None
+
+  def startCosts(self, flat, ctx):
+    """ A lower bound of the cost of matching this node at each position of the flat SOP (see ConfusionMatrix.startCosts),
+        used to find where the node can start after a parameter. Returns None if the node can't tell """
+    return None
+
+  def inputLength(self):
+    """ The number of phonemes this node needs to be fully matched (its longest form). When the input is still
+        incomplete (like a streaming transcript), matching the node is delayed until that much input is available """
+    return 0
+
   def dump(self):
     print("TreeNode with {} children".format(len(self.children)))
     for child in self.children:
@@ -150,30 +160,53 @@ class TreeNode(object):
 
 class BasicNode(TreeNode):
   """ A basic node is a node that is 1:1 with the string of phonemes (SOP) """
+  __slots__ = ("id", "text", "SOP", "packed")
 
   def __init__(self, text, id = None, parent = None):
     super().__init__(parent)
-    if id != None:
-      self.id = id
+    self.id = id
     if isinstance(text, tuple):
       self.id = ID(text[0])
       text = text[1]
     self.text = TreeNode.splitToSOP(text)
     self.SOP = submap.discode(self.text)
 
-  def matchSOP(self, SOP, budget, wl):
+  @classmethod
+  def fromSOP(cls, id, text, SOP, parent = None):
+    """ Build the node from its already converted text (list of IPA words) and SOP, without transliterating anything """
+    node = cls.__new__(cls)
+    TreeNode.__init__(node, parent)
+    node.id = id
+    node.text = text
+    node.SOP = SOP
+    return node
+
+  def matchSOP(self, SOP, budget, wl, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
     if budget <= 0:
       return (0.0, None)
     
-    r = confusionMatrix.confuseScorePre(self.SOP, SOP, budget)
-    if (TreeNode.verbosity > 1):
-      print("Basic match {} SOP{} T{}".format(r, SOP, self.SOP))
+    r = ctx.confusionMatrix.confuseScorePre(self.SOP, SOP, budget)
+    if (ctx.verbosity > 1):
+      logger.debug("Basic match {} SOP{} T{}".format(r, SOP, self.SOP))
     if r[0] > 0.0:
       # Remove the number of element of self.SOP from SOP to avoid rematching them if we selected them
-      TreeNode.splice(SOP, r[1], wordBoundaries = True) # Remove any leaking words 
+      SOP.advance(r[1], wordBoundaries = True) # Remove any leaking words 
 
     return (r[0], self.id)
 
+  def startCosts(self, flat, ctx):
+    # Only packed when the node follows a parameter
+    if getattr(self, "packed", None) == None:
+      self.packed = PackedSOPs([self.SOP])
+    return ctx.confusionMatrix.startCosts(self.packed, flat)
+
+  def inputLength(self):
+    return sum(len(x) for x in self.SOP)
+
+  def key(self):
+    return ("basic", str(self.id), tuple(tuple(x) for x in self.SOP))
+
   def dump(self):
     print("BasicNode with id {} and text {} => {}".format(self.id, self.text, self.SOP))
 
@@ -182,44 +215,117 @@ class BasicNode(TreeNode):
 
 
 class AlternativeNode(TreeNode):
-  """ An alternative node is a node that has multiple possible SOPs """
-  def __init__(self, alternatePossibilities, parent = None):
+  """ An alternative node is a node that has multiple possible SOPs
+      Above trieThreshold forms, the forms are indexed in a phonetic trie instead of being all scored for each match
+      The SOPs of the forms are stored packed (see PackedSOPs) in a SOPArena, the node's own one unless an arena is given
+      (like the grammar's) """
+  __slots__ = ("ids", "packed", "trie")
+  trieThreshold = 256
+
+  def __init__(self, alternatePossibilities, parent = None, arena = None):
     """ alternatePossibilities is a list of tuple containing the ID and the text of the alternative in the form:
         (ID, text)
     """
     super().__init__(parent)
-    self.forms = []
-    for form in alternatePossibilities:
-      self.forms.append((form[0], submap.discode(TreeNode.splitToSOP(form[1]))))
-
-  def matchSOP(self, SOP, budget, wl):
+    self.setForms([(form[0], submap.discode(TreeNode.splitToSOP(form[1]))) for form in alternatePossibilities], arena)
+
+  @classmethod
+  def fromSOP(cls, forms, parent = None, arena = None):
+    """ Build the node from its already converted forms, a list of tuple (ID, SOP), without transliterating anything """
+    node = cls.__new__(cls)
+    TreeNode.__init__(node, parent)
+    node.setForms(forms, arena)
+    return node
+
+  @classmethod
+  def fromPacked(cls, ids, packed, parent = None):
+    """ Build the node from the IDs of its forms and their SOPs already packed (like a grammar file's, see
+        PackedSOPs.fromSpans), without copying them """
+    node = cls.__new__(cls)
+    TreeNode.__init__(node, parent)
+    node.setPacked(ids, packed)
+    return node
+
+  def setForms(self, forms, arena = None):
+    self.setPacked([x[0] for x in forms], PackedSOPs([x[1] for x in forms], arena))
+
+  def setPacked(self, ids, packed):
+    self.ids = ids
+    self.packed = packed
+    self.trie = PhoneticTrie(packed.SOPs) if len(ids) >= AlternativeNode.trieThreshold else None
+
+  def form(self, m):
+    """ Get the m-th form as a tuple (ID, SOP) """
+    return (self.ids[m], self.packed.sop(m))
+
+  @property
+  def forms(self):
+    """ The list of forms, as tuple (ID, SOP) """
+    return [self.form(m) for m in range(len(self.ids))]
+
+  def matchSOP(self, SOP, budget, wl, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
     if budget <= 0:
       return (0.0, None)
 
-    scores = {}
-    consumed = {}
-    for form in self.forms:
-      t = budget
-      t = confusionMatrix.confuseScorePre(form[1], SOP, t)
-      if (TreeNode.verbosity > 1):
-        print("Alt match {} SOP{} T{}".format(t, SOP, form[1]))
-      if t[0] <= 0:
-        scores[form[0]] = 0
-        consumed[form[0]] = 0
-      else:
-        scores[form[0]] = t[0]
-        consumed[form[0]] = t[1]
-
-    # Find the maximum score here
-    m = max(scores, key=scores.get)
+    if self.trie != None:
+      r = self.trie.best(SOP.flat(), budget, ctx.confusionMatrix)
+      if (ctx.verbosity > 1):
+        logger.debug("Alt trie match {} SOP{}".format(r, SOP))
+      if r == None:
+        return (0.0, None)
+      # The trie gives the best form, rescore it to know how much of the SOP it consumes
+      form = self.form(r[1])
+      r = ctx.confusionMatrix.confuseScorePre(form[1], SOP, budget)
+      SOP.advance(r[1])
+      return (r[0], ID(form[0]))
+
+    # Score all forms at once and find the maximum score here
+    scores, consumed = ctx.confusionMatrix.confuseScorePreBatch(self.packed, SOP, budget)
+    m = int(np.argmax(scores))
+    if (ctx.verbosity > 1):
+      logger.debug("Alt match {} SOP{} T{}".format(list(zip(scores, consumed)), SOP, [x[1] for x in self.forms]))
     if scores[m] > 0:
       # Splice the string from what's recognized so far
-      TreeNode.splice(SOP, consumed[m])
+      SOP.advance(int(consumed[m]))
+      return (float(scores[m]), ID(self.ids[m]))
 
-    return (scores[m], ID(m) if scores[m] > 0 else None)
+    return (0.0, None)
+
+  def expandSOP(self, SOP, budget, wl, limit = None, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
+    if budget <= 0:
+      return []
+
+    if self.trie != None:
+      found = sorted(self.trie.search(SOP.flat(), budget, ctx.confusionMatrix), key = lambda x: (-x[0], x[1]))
+      # The trie doesn't know how much of the SOP is consumed, so rescore the selected forms
+      candidates = [(m, ctx.confusionMatrix.confuseScorePre(self.form(m)[1], SOP, budget)) for _, m in found[:limit]]
+    else:
+      scores, consumed = ctx.confusionMatrix.confuseScorePreBatch(self.packed, SOP, budget)
+      order = [int(x) for x in np.argsort(-scores, kind = "stable") if scores[x] > 0]
+      candidates = [(m, (float(scores[m]), int(consumed[m]))) for m in order[:limit]]
+
+    expansions = []
+    for m, r in candidates:
+      sop = SOP.copy().advance(r[1])
+      expansions.append((r[0], ID(self.ids[m]), sop))
+    return expansions
+
+  def startCosts(self, flat, ctx):
+    # Too many forms to score them all, the trie is better at this
+    if self.trie != None:
+      return None
+    return ctx.confusionMatrix.startCosts(self.packed, flat)
+
+  def inputLength(self):
+    return int(self.packed.flatLen.max()) if len(self.ids) else 0
+
+  def key(self):
+    return ("alternative", tuple((x[0], tuple(tuple(w) for w in x[1])) for x in self.forms))
 
   def dump(self):
-    print("AlternativeNode with forms {} = {}".format([x[0] for x in self.forms], [x[1] for x in self.forms]))
+    print("AlternativeNode with forms {} = {}".format(self.ids, [x[1] for x in self.forms]))
 
 
 
@@ -230,12 +336,18 @@ class ParametricNode(TreeNode):
       It's a bit more complex than usual node because there's no limit to the parameter so the next nodes in the tree must resynchronize to the remaining SOP 
       
       Parametric nodes can only match complete words
+
+      With a value grammar (see values.py), the parameter only captures the words that form a value of the grammar and
+      its result is the normalized value. Matching the value spends budget, like any other node
   """
-  def __init__(self, parameterName, parent = None, maximumParameterWordCount = 8):
-    """ optionalText is a text or a list of text """
+  __slots__ = ("name", "maxParamCount", "values")
+
+  def __init__(self, parameterName, parent = None, maximumParameterWordCount = 8, values = None):
+    """ values is an optional ValueGrammar """
     super().__init__(parent)
     self.name = parameterName
     self.maxParamCount = maximumParameterWordCount
+    self.values = values
     
   def extractText(self, SOP, wl, length):
     # Split the matching word list from the SOP and given len
@@ -244,8 +356,19 @@ class ParametricNode(TreeNode):
     remainingWords = wl[start:stop]
     return " ".join(remainingWords)
 
-  
-  def matchSOP(self, SOP, budget, wl):
+  def captures(self, SOP, budget, wl, ctx, maxWords):
+    """ The possible captures at the beginning of the SOP, as a list of tuple (remaining budget, value, number of words)
+        sorted by increasing number of words. Without value grammar, it's any number of words (up to maxWords) """
+    if self.values == None:
+      return [(budget, None, i + 1) for i in range(min(maxWords, len(SOP)))]
+    return self.values.expand(SOP, budget, wl, ctx, maxWords)
+
+  def result(self, SOP, wl, value, count):
+    text = self.extractText(SOP, wl, count)
+    return Parameter(self.name, value, text) if self.values != None else Parameter(self.name, text)
+
+  def matchSOP(self, SOP, budget, wl, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
     if budget <= 0:
       return (0.0, None)
     # Matching parameters is a more complex
@@ -254,6 +377,8 @@ class ParametricNode(TreeNode):
     # This can be a O(N²) operation here, since we don't know when it's supposed to re-synchronize
     # So we limit the search to a limited number of words (by default it's 8 words), in worst case, we'll try to match the next node 7 times, 
     # but it's usually less since parameters are at end of sentence.
+    # To avoid it, the next node first gives a lower bound of its cost at each position in a single pass, and it's only
+    # matched where it can fit in the budget.
     # We search in SOP space not text. 
     
     nextNodeIndex = self.parent.children.index(self) + 1
@@ -267,23 +392,38 @@ class ParametricNode(TreeNode):
 
 
       if isinstance(nextNode, EndNode):
+        if self.values != None:
+          # Capture the best value (and the longest for the same budget), the end node will reject what remains
+          captures = self.captures(SOP, budget, wl, ctx, self.maxParamCount)
+          if not captures:
+            return (0.0, None)
+          t, value, count = max(captures, key = lambda x: (x[0], x[2]))
+          result = self.result(SOP, wl, value, count)
+          SOP.skipWords(count)
+          return (t, result)
         # Now other node after us, let's capture everything that remains
         return (budget, Parameter(self.name, self.extractText(SOP, wl, 0)))
 
       if isinstance(nextNode, ParametricNode):
         raise Exception("Parametric nodes can not be successive in the tree")
 
-      # We are not, let's check the minimum length to search for
-      paramCount = min(self.maxParamCount, len(SOP) - 1) # At least one word for matching this node
+      # We are not, let's check the possible captures (at least one word for matching this node)
+      captures = self.captures(SOP, budget, wl, ctx, min(self.maxParamCount, len(SOP) - 1))
       # Then let it match the next node until we get a score
-      if (TreeNode.verbosity > 1):
-        print("Param match {} SOP{}".format(budget, SOP))
+      if (ctx.verbosity > 1):
+        logger.debug("Param match {} SOP{}".format(budget, SOP))
 
+      # Find where the next node can start in a single pass, and only match it there
+      flat = SOP.flat()
+      maxCount = captures[-1][2] if captures else 0
+      costs = nextNode.startCosts(flat[:SOP.length(maxCount + 1) + nextNode.inputLength() + math.ceil(budget)], ctx)
       scores = []
-      for i in range(paramCount):
-        t = budget
-        sop = SOP[1+i:]
-        r = nextNode.matchSOP(sop, t, wl)
+      for t, value, count in captures:
+        sop = SOP.copy().skipWords(count)
+        if costs is not None and costs[sop.pos - SOP.pos] >= t + 1e-9:
+          scores.append(0.0)
+          continue
+        r = ctx.matchNode(nextNode, sop, t, wl)
         if r[0] > 0 and r[1] == None:
           # Next node is likely an Optional node that hasn't found anything, so special treatment here 
           scores.append(0.0)
@@ -291,13 +431,13 @@ class ParametricNode(TreeNode):
           scores.append(r[0])
       
       # Find the maximum score
-      m = scores.index(max(scores))
-      if scores[m] > 0:
+      m = scores.index(max(scores)) if scores else 0
+      if scores and scores[m] > 0:
         # Ok, found a potential match here, let's save it
-        cumLen = sum(len(x) for x in SOP[:m+1])
-        text = self.extractText(SOP, wl, m + 1) # Must be done before the SOP is modified
-        TreeNode.splice(SOP, cumLen)
-        return (budget, Parameter(self.name, text))
+        t, value, count = captures[m]
+        result = self.result(SOP, wl, value, count) # Must be done before the SOP is modified
+        SOP.advance(SOP.length(count))
+        return (t, result)
       
       # Capture everything here if next node is an optional node and got a 0 score
       if isinstance(nextNode, OptionalNode):
@@ -307,6 +447,30 @@ class ParametricNode(TreeNode):
       # Not a optional node so let's return 
       return (0.0, None)
 
+  def expandSOP(self, SOP, budget, wl, limit = None, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
+    # Instead of resynchronizing with the next node, give all the possible parameter lengths, the search will try the
+    # next nodes after each of them. If only optional nodes follow, the parameter can also capture everything
+    if budget <= 0 or len(SOP) == 0:
+      return []
+    if self.values != None:
+      # The value grammar tells where the parameter ends
+      expansions = [(t, self.result(SOP, wl, value, count), SOP.copy().skipWords(count)) for t, value, count in self.captures(SOP, budget, wl, ctx, self.maxParamCount)]
+      return sorted(expansions, key = lambda x: -x[0])[:limit]
+    following = self.parent.children[self.parent.children.index(self) + 1:]
+    if all(isinstance(x, EndNode) for x in following):
+      return [(budget, Parameter(self.name, self.extractText(SOP, wl, 0)), SOP.copy().skipWords(len(SOP)))]
+
+    expansions = []
+    for i in range(min(self.maxParamCount, len(SOP))):
+      expansions.append((budget, Parameter(self.name, self.extractText(SOP, wl, i + 1)), SOP.copy().skipWords(i + 1)))
+    if len(SOP) > self.maxParamCount and all(isinstance(x, (OptionalNode, EndNode)) for x in following):
+      expansions.append((budget, Parameter(self.name, self.extractText(SOP, wl, 0)), SOP.copy().skipWords(len(SOP))))
+    return expansions[:limit]
+
+  def inputLength(self):
+    return 1
+
   def dump(self):
     print("ParametricNode with name {}".format(self.name))
 
@@ -314,53 +478,91 @@ class ParametricNode(TreeNode):
 
 
 class OptionalNode(TreeNode):
-  """ An optional node is a node that has multiple possible SOPs but none is useful for intent processing """
-  def __init__(self, optionalText, parent = None):
+  """ An optional node is a node that has multiple possible SOPs but none is useful for intent processing
+      The SOPs of the texts are stored packed (see PackedSOPs) in a SOPArena, the node's own one unless an arena is given
+      (like the grammar's) """
+  __slots__ = ("optionalText", "packed")
+
+  def __init__(self, optionalText, parent = None, arena = None):
     """ optionalText is a text or a list of text """
     super().__init__(parent)
-    self.texts = []
-    
     if isinstance(optionalText, str):
       optionalText = [optionalText]
-
+    self.setTexts(optionalText, [submap.discode(TreeNode.splitToSOP(text)) for text in optionalText], arena)
+
+  @classmethod
+  def fromSOP(cls, optionalText, texts, parent = None, arena = None):
+    """ Build the node from its texts and their already converted SOPs, without transliterating anything """
+    node = cls.__new__(cls)
+    TreeNode.__init__(node, parent)
+    node.setTexts(optionalText, texts, arena)
+    return node
+
+  @classmethod
+  def fromPacked(cls, optionalText, packed, parent = None):
+    """ Build the node from its texts and their SOPs already packed, without copying them """
+    node = cls.__new__(cls)
+    TreeNode.__init__(node, parent)
+    node.optionalText = optionalText
+    node.packed = packed
+    return node
+
+  def setTexts(self, optionalText, texts, arena = None):
     self.optionalText = optionalText
+    self.packed = PackedSOPs(texts, arena)
 
-    for text in optionalText:
-      self.texts.append(submap.discode(TreeNode.splitToSOP(text)))
+  @property
+  def texts(self):
+    """ The SOP of each text """
+    return self.packed.SOPs
 
-  def matchSOP(self, SOP, budget, wl):
+  def matchSOP(self, SOP, budget, wl, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
     if budget <= 0:
       return (0.0, None)
 
     if len(SOP) == 0:
       return (budget, None)
 
-    scores = []
-    consumed = []
     # Find the optional node with the highest score
-    for text in self.texts:
-      t = budget
-      t = confusionMatrix.confuseScorePre(text, SOP, t)
-      if (TreeNode.verbosity > 1):
-        print("Opt match {} SOP{} T{}".format(t, SOP, text))
-      if t[0] <= 0:
-        scores.append(0)
-        consumed.append(0)
-      else:
-        scores.append(t[0])
-        consumed.append(len(text))
-
-    # Find the maximum score here
-    m = scores.index(max(scores))
+    scores = ctx.confusionMatrix.confuseScorePreBatch(self.packed, SOP, budget)[0]
+    m = int(np.argmax(scores))
+    if (ctx.verbosity > 1):
+      logger.debug("Opt match {} SOP{} T{}".format(scores, SOP, self.texts))
     if scores[m] > 0:
       # Splice the string from what's recognized so far
-      consumedLen = sum([len(self.texts[m][x]) for x in range(0, consumed[m])])
-      TreeNode.splice(SOP, consumedLen)
-      return (scores[m], Optional(self.optionalText[m]))
+      SOP.advance(int(self.packed.flatLen[m]))
+      return (float(scores[m]), Optional(self.optionalText[m]))
     
     # No optional found, let's mark it
     return (budget, None)
 
+  def expandSOP(self, SOP, budget, wl, limit = None, ctx = None):
+    ctx = ctx if ctx != None else TreeNode.matcher
+    if budget <= 0:
+      return []
+
+    # Skipping the optional node is always possible
+    expansions = [(budget, None, SOP.copy())]
+    if len(SOP) > 0:
+      scores = ctx.confusionMatrix.confuseScorePreBatch(self.packed, SOP, budget)[0]
+      for m in np.argsort(-scores, kind = "stable"):
+        if scores[m] <= 0:
+          break
+        sop = SOP.copy().advance(int(self.packed.flatLen[m]))
+        expansions.append((float(scores[m]), Optional(self.optionalText[m]), sop))
+    expansions.sort(key = lambda x: -x[0])
+    return expansions[:limit]
+
+  def startCosts(self, flat, ctx):
+    return ctx.confusionMatrix.startCosts(self.packed, flat)
+
+  def inputLength(self):
+    return int(self.packed.flatLen.max()) if len(self.optionalText) else 0
+
+  def key(self):
+    return ("optional", tuple(self.optionalText), tuple(tuple(tuple(w) for w in x) for x in self.texts))
+
   def dump(self):
     print("OptionalNode with text {}".format(self.texts))
 
@@ -369,14 +571,19 @@ class OptionalNode(TreeNode):
 class EndNode(TreeNode):
   """ An end node is a node that terminate an utterance, it doesn't accept any lingering utterance when it's reached.
       If there's still text to match against, it'll return no match """
+  __slots__ = ()
+
   def __init__(self, parent = None):
     super().__init__(parent)
 
-  def matchSOP(self, SOP, budget, wl):
+  def matchSOP(self, SOP, budget, wl, ctx = None):
     if budget <= 0 or len(SOP) > 0:
       return (0.0, None)
     return (budget, None)
 
+  def key(self):
+    return ("end",)
+
   def dump(self):
     print("EndNode")
 
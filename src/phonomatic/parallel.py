@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
+from .node import TreeNode
+from .graph import IntentGraph
+from .grammarfile import GrammarFile
+
+# The grammar of the worker process, built once by the pool initializer
+_graph = None
+
+def _loadGraph(grammar, language):
+  """ Build the IntentGraph from the given grammar: a path to a grammar file saved with saveGrammar (or the opened
+      GrammarFile), or a callable
+      returning the intents (a dictionary or a list of tuple (intent, root TreeNode), or a single root TreeNode) """
+  if language != None:
+    TreeNode.setLanguage(language)
+  intents = GrammarFile(grammar) if isinstance(grammar, str) else grammar if isinstance(grammar, GrammarFile) else grammar()
+  if isinstance(intents, TreeNode):
+    intents = [(None, intents)]
+  return IntentGraph(intents)
+
+def _initWorker(grammar, language, verbosity):
+  global _graph
+  TreeNode.setVerbosity(verbosity)
+  _graph = _loadGraph(grammar, language)
+
+def _matchChunk(texts, budget):
+  return [_graph.matchText(text, budget) for text in texts]
+
+def matchMany(grammar, texts, budget, language = None, workers = None, chunkSize = 32):
+  """ Match many texts against the grammar, spreading the work over a pool of processes.
+      grammar is either a path to a grammar file saved with saveGrammar (the fastest, since it's memory mapped and
+      doesn't need Epitran to load) or a picklable callable (like a module level function) building the intents.
+      Each worker process loads the grammar and sets the language once, then transliterates and matches its chunks of
+      texts. Identical texts are only matched once.
+      If workers is 0, everything is done in the current process (it's the same as matching each text with an IntentGraph).
+
+      This returns a list with the result of IntentGraph.matchText for each text, in the input order """
+  texts = list(texts)
+  unique = list(dict.fromkeys(texts))
+  chunks = [unique[i:i + chunkSize] for i in range(0, len(unique), chunkSize)]
+
+  if workers == 0:
+    # A grammar file opened here is closed once matched (the workers keep theirs open for their whole life)
+    opened = GrammarFile(grammar) if isinstance(grammar, str) else None
+    try:
+      graph = _loadGraph(opened if opened != None else grammar, language)
+      results = [[graph.matchText(text, budget) for text in chunk] for chunk in chunks]
+    finally:
+      if opened != None:
+        opened.close()
+  else:
+    language = language if language != None else TreeNode.matcher.language
+    with ProcessPoolExecutor(max_workers = workers, initializer = _initWorker,
+                             initargs = (grammar, language, TreeNode.matcher.verbosity)) as executor:
+      results = list(executor.map(_matchChunk, chunks, [budget] * len(chunks)))
+
+  found = {}
+  for chunk, result in zip(chunks, results):
+    found.update(zip(chunk, result))
+  return [found[text] for text in texts]
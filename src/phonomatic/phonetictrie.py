@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from array import array
+import math
+
+class PhoneticTrie(object):
+  """ A trie of (flattened) string of phonemes, used to index large sets of forms (like entity names) so they share their prefixes.
+
+      Searching the trie is a budget bounded fuzzy descent: each trie node computes one row of the banded weighted
+      Levenshtein alignment of the node's prefix against the input (see ConfusionMatrix._alignBanded) from its parent's row,
+      so common prefixes are only scored once, and a whole subtree is pruned as soon as its row is over budget.
+      The scores are the same as the flattened prefix alignment of ConfusionMatrix.confuseScorePre
+
+      Once built, the trie is stored in flat arrays instead of a Python object per trie node: the nodes are numbered in
+      breadth first order, so the children of node n are the nodes childStart[n] to childStart[n + 1] - 1, labels[n] is
+      the phoneme of node n and forms[formStart[n]:formStart[n + 1]] are the forms ending at node n
+  """
+  __slots__ = ("labels", "childStart", "formStart", "forms", "depth", "size")
+
+  def __init__(self, SOPs):
+    """ SOPs is a list of SOP (list of list of submap indexes), the i-th SOP being reported as the form i """
+    # While building, a node is a list of [children dict (phoneme => node), list of forms ending here]
+    root = [{}, []]
+    self.depth = 0
+    self.size = len(SOPs)
+    for i, sop in enumerate(SOPs):
+      node = root
+      depth = 0
+      for word in sop:
+        for x in word:
+          node = node[0].setdefault(x, [{}, []])
+          depth = depth + 1
+      node[1].append(i)
+      self.depth = max(self.depth, depth)
+
+    self.labels = array("H", [0])
+    self.childStart = array("I")
+    self.formStart = array("I")
+    self.forms = array("I")
+    queue = [root]
+    for node in queue:
+      self.childStart.append(len(queue))
+      self.formStart.append(len(self.forms))
+      self.forms.extend(node[1])
+      for phoneme, child in node[0].items():
+        self.labels.append(phoneme)
+        queue.append(child)
+    self.childStart.append(len(queue))
+    self.formStart.append(len(self.forms))
+
+  def __len__(self):
+    return self.size
+
+  def search(self, b, budget, confusionMatrix, bestOnly = False):
+    """ Search the forms matching the beginning of the (flattened) string of phonemes B within the given budget.
+        This returns a list of tuple (remaining budget, form index) for all the forms that fit in the budget
+        If bestOnly is True, subtrees that can't beat the best form found so far are pruned too, so only the best forms
+        (and maybe some worse forms found before them) are returned """
+    results = []
+    bestCost = float("inf")
+    if budget <= 0:
+      return results
+    sim = confusionMatrix.rows
+    k = max(0, math.ceil(budget) - 1)
+    # No alignment within budget can consume more than the deepest form plus the allowed insertions
+    lb = min(len(b), self.depth + k)
+    inf = float("inf")
+
+    labels, childStart, formStart, forms = self.labels, self.childStart, self.formStart, self.forms
+
+    row = [ float(j) for j in range(min(lb, k) + 1) ]
+    results.extend((budget - min(row), f) for f in forms[formStart[0]:formStart[1]])
+    stack = [ (child, 1, row, 0) for child in range(childStart[0], childStart[1]) ]
+    while stack:
+      node, i, prev, prevLo = stack.pop()
+      lo = max(0, i - k); hi = min(lb, i + k)
+      if lo > hi:
+        continue
+      simRow = sim[labels[node]]
+      prevHi = prevLo + len(prev) - 1
+      cur = []
+      for j in range(lo, hi + 1):
+        best = prev[j - prevLo] + 1.0 if j <= prevHi else inf
+        if j > lo and cur[-1] + 1.0 < best:
+          best = cur[-1] + 1.0
+        if j > prevLo:
+          v = prev[j - 1 - prevLo] + 1.0 - simRow[b[j - 1]]
+          if v < best:
+            best = v
+        cur.append(best)
+      cost = min(cur)
+      if cost >= budget or cost > bestCost:
+        # Prune the whole subtree, it can only get worse
+        continue
+      if formStart[node] != formStart[node + 1]:
+        results.extend((budget - cost, f) for f in forms[formStart[node]:formStart[node + 1]])
+        if bestOnly:
+          bestCost = min(bestCost, cost)
+      stack.extend((child, i + 1, cur, lo) for child in range(childStart[node], childStart[node + 1]))
+    return results
+
+  def best(self, b, budget, confusionMatrix):
+    """ Get the best matching form for the beginning of B as a tuple (remaining budget, form index), or None if none fits the budget.
+        When many forms have the same score, the first one is selected """
+    results = self.search(b, budget, confusionMatrix, bestOnly = True)
+    if not results:
+      return None
+    return max(results, key = lambda x: (x[0], -x[1]))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from .node import BasicNode, AlternativeNode, OptionalNode, TreeNode
+from .sop import SOPCursor
+import numpy as np
+
+class NGramIndex(object):
+  """ An inverted index from the phoneme n-grams of the intents' forms to the forms that contain them, to find the few
+      intents that are worth matching before running any budgeted alignment.
+
+      Each form (the SOP of a basic node, each form of an alternative node, each text of an optional node) is cut into
+      n-grams per word, the words being padded with a boundary phoneme so the beginning and end of words count too.
+      An input is scored by counting, for each form, the n-grams of the input it contains. An intent's score is the sum
+      of the score of the best form of each of its nodes, so an intent with thousands of alternative forms doesn't win
+      just because it has more n-grams. An intent given by many roots (like one per sentence) has the score of its best
+      root, so it's only ranked once. Only the postings of the input's n-grams are read, so with thousands of intents,
+      ranking them is much cheaper than matching them all.
+
+      Parametric nodes have no forms, they don't count in the score """
+  # The boundary phoneme added before and after each word (the submap indexes are lower)
+  boundary = 511
+
+  def __init__(self, intents = None, n = 2):
+    """ intents is a dictionary or a list of tuple (intent, root TreeNode), n is the number of phonemes in a n-gram """
+    self.n = n
+    self.intents = []
+    # Intent => its index in intents
+    self.intentIndex = {}
+    # N-gram => list of form indexes
+    self.postings = {}
+    # For each form, the index of its slot (the node it belongs to), for each slot, the index of its root and for each
+    # root, the index of its intent
+    self.formSlots = []
+    self.slotRoots = []
+    self.rootIntents = []
+    self.compiled = None
+    if intents != None:
+      for intent, root in (intents.items() if isinstance(intents, dict) else intents):
+        self.add(intent, root)
+
+  @staticmethod
+  def forms(node):
+    """ The forms of the node (each being a list of words), that's what's indexed """
+    if isinstance(node, BasicNode):
+      return [node.SOP]
+    if isinstance(node, AlternativeNode):
+      return [x[1] for x in node.forms]
+    if isinstance(node, OptionalNode):
+      return node.texts
+    return []
+
+  def ngrams(self, words):
+    """ The set of n-grams of the words (each being a sequence of submap indexes), each n-gram encoded as an integer """
+    grams = set()
+    n = self.n
+    for word in words:
+      word = [NGramIndex.boundary] + list(word) + [NGramIndex.boundary]
+      for i in range(len(word) - n + 1):
+        gram = 0
+        for x in word[i:i + n]:
+          gram = (gram << 9) | x
+        grams.add(gram)
+    return grams
+
+  def add(self, intent, root):
+    """ Add the intent given by its root TreeNode to the index """
+    if intent not in self.intentIndex:
+      self.intentIndex[intent] = len(self.intents)
+      self.intents.append(intent)
+    rootIndex = len(self.rootIntents)
+    self.rootIntents.append(self.intentIndex[intent])
+    for child in root.children:
+      forms = self.forms(child)
+      if not forms:
+        continue
+      slot = len(self.slotRoots)
+      self.slotRoots.append(rootIndex)
+      for form in forms:
+        formIndex = len(self.formSlots)
+        self.formSlots.append(slot)
+        for gram in self.ngrams(form):
+          self.postings.setdefault(gram, []).append(formIndex)
+    self.compiled = None
+
+  def compile(self):
+    """ Convert the postings to arrays for scoring (done on the first ranking after a change) """
+    postings = { gram: np.array(forms, dtype = np.int32) for gram, forms in self.postings.items() }
+    formSlots = np.array(self.formSlots, dtype = np.int32)
+    # The forms of a slot are contiguous, so the best form of each slot is a reduction from the slot's first form
+    slotStarts = np.flatnonzero(np.r_[True, formSlots[1:] != formSlots[:-1]]) if len(formSlots) else formSlots
+    self.compiled = (postings, slotStarts, np.array(self.slotRoots, dtype = np.int32), np.array(self.rootIntents, dtype = np.int32))
+    return self.compiled
+
+  def scores(self, SOP):
+    """ The score of each intent (in the order they were added) for the given SOP (a list of words or a SOPCursor) """
+    postings, slotStarts, slotRoots, rootIntents = self.compiled if self.compiled != None else self.compile()
+    hits = [postings[gram] for gram in self.ngrams(SOPCursor.of(SOP).words()) if gram in postings]
+    if not hits or not len(slotStarts):
+      return np.zeros(len(self.intents))
+    counts = np.bincount(np.concatenate(hits), minlength = len(self.formSlots))
+    best = np.maximum.reduceat(counts, slotStarts)
+    roots = np.bincount(slotRoots, weights = best, minlength = len(rootIntents))
+    scores = np.zeros(len(self.intents))
+    np.maximum.at(scores, rootIntents, roots)
+    return scores
+
+  def rank(self, SOP, topM):
+    """ The topM best intents for the given SOP, as a list of tuple (score, intent) sorted by decreasing score """
+    scores = self.scores(SOP)
+    if topM < len(scores):
+      top = np.argpartition(-scores, topM)[:topM]
+    else:
+      top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind = "stable")]
+    return [(float(scores[i]), self.intents[i]) for i in top]
+
+  def shortlist(self, SOP, topM):
+    """ The set of the topM best intents for the given SOP """
+    return set(x[1] for x in self.rank(SOP, topM))
+
+
+def shortlistRecall(graph, texts, budget, topM, ctx = None):
+  """ Measure how often the shortlist of the graph's index contains the intent that matching all the intents of the
+      graph finds (the best one), for the given texts. Texts that don't match any intent aren't counted.
+      Returns a tuple (recall, number of texts counted) """
+  ctx = ctx if ctx != None else TreeNode.matcher
+  found = 0
+  counted = 0
+  for text in texts:
+    SOP = ctx.textToCursor(text)
+    results = graph.matchSOP(SOP, budget, ctx.splitToList(text), ctx)
+    if not results:
+      continue
+    counted = counted + 1
+    if results[0][1] in graph.index.shortlist(SOP, topM):
+      found = found + 1
+  return (found / counted if counted else 1.0, counted)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+from array import array
+import threading
+
+class SOPBuffer(object):
+  """ An immutable string of phonemes (SOP), stored flat: one array of all the phoneme indexes and the offsets of each word,
+      so the i-th word is phonemes[offsets[i]:offsets[i+1]].
+      The buffer is never modified when matching, nodes move a SOPCursor on it instead """
+  __slots__ = ("phonemes", "offsets", "view")
+
+  def __init__(self, words = None, phonemes = None, offsets = None):
+    """ Build the buffer from a list of words (each being a list of submap indexes) or from the already packed arrays """
+    if words != None:
+      phonemes = array("H")
+      offsets = array("I", [0])
+      for word in words:
+        phonemes.extend(word)
+        offsets.append(len(phonemes))
+    self.phonemes = phonemes if phonemes != None else array("H")
+    self.offsets = offsets if offsets != None else array("I", [0])
+    self.view = memoryview(self.phonemes)
+
+  @staticmethod
+  def fromIPA(text, submap):
+    """ Build the buffer by discoding the given list of IPA words with the given IPASubmap """
+    phonemes, offsets = submap.discodeBatch(text)
+    return SOPBuffer(phonemes = phonemes, offsets = offsets)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def cursor(self):
+    """ Get a cursor on the beginning of the buffer """
+    return SOPCursor(self, 0, 0)
+
+
+class SOPCursor(object):
+  """ A position in a SOPBuffer. It's what nodes match against: the remaining SOP starts at the cursor.
+      Moving the cursor doesn't copy anything and copying a cursor is cheap, so many positions can be explored at once.
+      The cursor behaves like the remaining list of words, the first word being cut if the cursor is in the middle of it """
+  __slots__ = ("buffer", "pos", "word")
+
+  def __init__(self, buffer, pos = 0, word = 0):
+    self.buffer = buffer
+    # Index of the next phoneme to match, and index of the word containing it
+    self.pos = pos
+    self.word = word
+
+  @staticmethod
+  def of(SOP):
+    """ Get a cursor on the given SOP, either a list of words (each being a list of submap indexes) or a cursor (that's copied) """
+    if isinstance(SOP, SOPCursor):
+      return SOP.copy()
+    return SOPBuffer(SOP).cursor()
+
+  def copy(self):
+    return SOPCursor(self.buffer, self.pos, self.word)
+
+  def __len__(self):
+    """ The number of remaining words (including the current word if cut) """
+    return len(self.buffer.offsets) - 1 - self.word
+
+  def remaining(self):
+    """ The number of remaining phonemes """
+    return len(self.buffer.phonemes) - self.pos
+
+  def length(self, words):
+    """ The number of phonemes in the next given number of words """
+    return self.buffer.offsets[min(self.word + words, len(self.buffer.offsets) - 1)] - self.pos
+
+  def words(self, limit = None):
+    """ The remaining words, as views on the buffer (limited to the given number of words if given) """
+    offsets = self.buffer.offsets
+    view = self.buffer.view
+    stop = len(offsets) - 1 if limit == None else min(len(offsets) - 1, self.word + limit)
+    if self.word >= stop:
+      return []
+    words = [view[self.pos:offsets[self.word + 1]]]
+    words.extend(view[offsets[w]:offsets[w + 1]] for w in range(self.word + 1, stop))
+    return words
+
+  def flat(self):
+    """ The remaining phonemes, as a view on the buffer """
+    return self.buffer.view[self.pos:]
+
+  def advance(self, count, wordBoundaries = False):
+    """ Move the cursor after the given number of phonemes (it's the SOP that was matched).
+        Words that are completely consumed are skipped. If the cursor ends in the middle of a word and wordBoundaries is True,
+        the end of the word is skipped too """
+    offsets = self.buffer.offsets
+    words = len(offsets) - 1
+    while self.word < words:
+      left = offsets[self.word + 1] - self.pos
+      if count >= left:
+        count = count - left
+        self.word = self.word + 1
+        self.pos = offsets[self.word]
+      elif count > 0:
+        if wordBoundaries:
+          self.word = self.word + 1
+          self.pos = offsets[self.word]
+        else:
+          self.pos = self.pos + count
+        break
+      else:
+        break
+    return self
+
+  def skipWords(self, count):
+    """ Move the cursor to the beginning of the count-th next word (or at the end) """
+    offsets = self.buffer.offsets
+    self.word = min(self.word + count, len(offsets) - 1)
+    self.pos = offsets[self.word]
+    return self
+
+  def __repr__(self):
+    return str([list(x) for x in self.words()])
+
+
+class SOPArena(object):
+  """ A packed store of many SOPs, like the forms of the grammar's nodes: all the phonemes in one array and the offsets
+      of each word, so the i-th word is phonemes[words[i]:words[i+1]] (that's the layout of a grammar file too).
+      A SOP is stored as the index of its first word and its word count, which costs a few bytes instead of a list of
+      lists. An arena only grows and lives as long as a node uses it, so each grammar (or node) has its own arena by
+      default: a grammar that's dropped or rebuilt frees its forms. SOPArena.shared is a process wide arena for the
+      callers that ask for it, and view gives a read-only arena over existing arrays (like a memory mapped grammar file) """
+  __slots__ = ("phonemes", "words", "lock")
+
+  def __init__(self):
+    self.phonemes = array("H")
+    self.words = array("I", [0])
+    self.lock = threading.Lock()
+
+  @classmethod
+  def view(cls, phonemes, words):
+    """ A read-only arena over the given phonemes (uint16) and words offsets (uint32), like memoryviews of a grammar file.
+        Nothing is copied, the arena keeps them alive """
+    arena = cls.__new__(cls)
+    arena.phonemes = phonemes
+    arena.words = words
+    arena.lock = None
+    return arena
+
+  def add(self, SOP):
+    """ Store the SOP (a list of words, each being a list of submap indexes), returns (first word, word count) """
+    if self.lock == None:
+      raise TypeError("Can't add to a read-only arena")
+    with self.lock:
+      first = len(self.words) - 1
+      for word in SOP:
+        self.phonemes.extend(word)
+        self.words.append(len(self.phonemes))
+    return (first, len(SOP))
+
+  def sop(self, first, count):
+    """ Get the stored SOP as a list of words """
+    w = self.words
+    return [ self.phonemes[w[i]:w[i + 1]].tolist() for i in range(first, first + count) ]
+
+  def length(self, first, count):
+    """ The number of phonemes of the stored SOP """
+    return self.words[first + count] - self.words[first]
+
+  def __getstate__(self):
+    # A view is pickled as a copy of its arrays
+    return (array("H", self.phonemes), array("I", self.words))
+
+  def __setstate__(self, state):
+    self.phonemes, self.words = state
+    self.lock = threading.Lock()
+
+# The process wide arena, only used when asked for (it's never freed)
+SOPArena.shared = SOPArena()
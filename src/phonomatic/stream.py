@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from array import array
+from .instrumentation import logger
+from .node import TreeNode
+from .graph import GraphNode
+from .sop import SOPBuffer, SOPCursor
+
+class MatchSession(object):
+  """ An incremental match of a growing text (like the partial transcripts of a streaming ASR) against an IntentGraph.
+
+      Words are appended as they come, and only the new words are transliterated. The session runs the same beam search
+      as IntentGraph.matchBeam, but it keeps the partial hypotheses between the appends: a node that would need more input
+      than what's available (see TreeNode.inputLength) isn't matched yet, the hypothesis waits for the next words.
+      A node whose match reaches the end of the input (like a parameter capturing the last words) is matched again when
+      more words arrive, since its match can still grow.
+
+      After each append, the session tells if the intent is already decided (all the remaining hypotheses lead to the
+      same intent) or rejected (no hypothesis left), so a command can be acted upon before the end of the utterance.
+      Call finish once the text is complete to get the results """
+  def __init__(self, graph, budget, beamWidth = 8, ctx = None):
+    self.graph = graph
+    self.budget = budget
+    self.beamWidth = beamWidth
+    self.ctx = ctx if ctx != None else TreeNode.matcher
+    self.wl = []
+    self.buffer = SOPBuffer()
+    # Hypotheses waiting for more input, as tuple (remaining budget, node to match, next position, SOP, ids),
+    # positions being like in IntentGraph.matchSOPBeam
+    self.waiting = [(budget, None, graph.root, self.buffer.cursor(), [])]
+    self.best = {}
+    self.reachable = {}
+    self.finished = False
+
+  def append(self, text):
+    """ Append the given words to the text and match them. This returns the state of the session (see state) """
+    assert not self.finished, "Can't append to a finished session"
+    words = self.ctx.splitToList(text)
+    if not words:
+      return self.state()
+    # Only transliterate the new words (all at once, like a text given to matchText, since the transliteration of a word
+    # can depend on its neighbours). If the words and their SOP don't match, transliterate them one by one
+    ipa = self.ctx.splitToSOP(" ".join(words))
+    if len(ipa) != len(words):
+      ipa = [" ".join(self.ctx.splitToSOP(word)) for word in words]
+    phonemes, offsets = self.ctx.submap.discodeBatch(ipa)
+    base = len(self.buffer.phonemes)
+    self.buffer = SOPBuffer(phonemes = self.buffer.phonemes + phonemes,
+                            offsets = self.buffer.offsets + array("I", (base + x for x in offsets[1:])))
+    self.wl = self.wl + words
+    self._run(False)
+    return self.state()
+
+  def finish(self, topK = 5):
+    """ Mark the text as complete and match what was waiting for more input.
+        This returns up to topK tuples (remaining budget, intent, ids), one per intent, sorted by decreasing budget """
+    if not self.finished:
+      self.finished = True
+      self._run(True)
+    return self.results(topK)
+
+  def results(self, topK = 5):
+    """ The intents that matched so far, as up to topK tuples (remaining budget, intent, ids) sorted by decreasing budget """
+    return [x[1] for x in sorted(self.best.values(), key = lambda x: x[0], reverse = True)[:topK]]
+
+  def intents(self):
+    """ The set of intents that are still possible: the ones already matched and the ones that waiting hypotheses lead to """
+    intents = set(self.best)
+    if not self.finished:
+      for item in self.waiting:
+        intents.update(self._reachable(item[2]))
+    return intents
+
+  def state(self):
+    """ The state of the session as a dictionary: decided is the intent if only one is still possible (else None),
+        rejected is True if none is possible anymore and pending is the list of possible intents """
+    intents = self.intents()
+    return { "decided": next(iter(intents)) if len(intents) == 1 else None, "rejected": len(intents) == 0, "pending": list(intents) }
+
+  def _reachable(self, position):
+    # Intents that can be matched from the position
+    if not isinstance(position, GraphNode):
+      return {position[0]}
+    if position not in self.reachable:
+      intents = set(position.intents)
+      intents.update(x[0] for x in position.tails)
+      for child in position.children.values():
+        intents.update(self._reachable(child))
+      self.reachable[position] = intents
+    return self.reachable[position]
+
+  @staticmethod
+  def _key(position, SOP, budget, ids):
+    position = id(position) if isinstance(position, GraphNode) else (id(position[1]), position[2])
+    return (position, SOP.pos, budget, tuple(str(x) for x in ids))
+
+  def _complete(self, budget, intent, ids, SOP):
+    # Like IntentGraph._complete, the position in the input is the number of consumed phonemes
+    key = (budget, SOP.pos, len(ids))
+    if intent not in self.best or self.best[intent][0] < key:
+      self.best[intent] = (key, (budget, intent, ids))
+
+  def _successors(self, position):
+    if isinstance(position, GraphNode):
+      return [(child.node, child) for child in position.children.values()] + \
+             [(root.children[index], (intent, root, index + 1)) for intent, root, index in position.tails]
+    intent, root, index = position
+    return [(root.children[index], (intent, root, index + 1))]
+
+  def _run(self, final):
+    # The waiting hypotheses are matched against the new buffer: their positions in the input don't change
+    work = [(t, node, position, SOPCursor(self.buffer, sop.pos, sop.word), ids) for t, node, position, sop, ids in self.waiting]
+    waiting = {}
+    while work:
+      candidates = {}
+      i = 0
+      while i < len(work):
+        t, node, position, sop, ids = work[i]
+        i = i + 1
+        if node == None:
+          # The hypothesis reached the position, complete its intents and match its next nodes
+          if isinstance(position, GraphNode):
+            for intent in position.intents:
+              self._complete(t, intent, ids, sop)
+          elif position[2] == len(position[1].children):
+            self._complete(t, position[0], ids, sop)
+            continue
+          work.extend((t, child, nextPosition, sop, ids) for child, nextPosition in self._successors(position))
+          continue
+
+        remaining = sop.remaining()
+        if not final and (remaining == 0 or remaining < node.inputLength()):
+          waiting.setdefault(self._key(position, sop, t, ids) + (id(node),), (t, node, position, sop, ids))
+          continue
+        expansions = self.ctx.expandNode(node, sop, t, self.wl, self.beamWidth)
+        if not final and any(x[2].remaining() == 0 for x in expansions):
+          # The node's match may grow with more input, so match it again then
+          waiting.setdefault(self._key(position, sop, t, ids) + (id(node),), (t, node, position, sop, ids))
+        for r in expansions:
+          nextIds = ids + [r[1]] if r[1] != None else ids
+          candidates.setdefault(self._key(position, r[2], r[0], nextIds), (r[0], None, position, r[2], nextIds))
+
+      # Keep the best hypotheses, preferring the ones that consumed more of the input
+      work = sorted(candidates.values(), key = lambda x: (-x[0], x[3].remaining()))[:self.beamWidth]
+
+    self.waiting = sorted(waiting.values(), key = lambda x: (-x[0], x[3].remaining()))[:self.beamWidth]
+    if (self.ctx.verbosity > 0):
+      logger.debug("Session [{}] => {} waiting, {}".format(self.wl, len(self.waiting), [(x[1][0], x[1][1]) for x in self.best.values()]))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import sqlite3
+import threading
+
+class TransliterationCache(object):
+  """ A word level cache of transliterations, keyed by (language, word), with a bounded LRU eviction.
+      If a path is given, the transliterations are also stored in a SQLite database, so they survive restarts
+      (the memory cache is then a front for the database, evicted words are still found on disk).
+
+      hits and misses count the lookups found (in memory or on disk) or not found in the cache """
+  def __init__(self, capacity = 65536, path = None):
+    self.capacity = capacity
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    self.db = None
+    self.pending = 0
+    if path != None:
+      self.db = sqlite3.connect(path, check_same_thread = False)
+      self.db.execute("CREATE TABLE IF NOT EXISTS translit (language TEXT, word TEXT, ipa TEXT, PRIMARY KEY (language, word))")
+
+  def __len__(self):
+    return len(self.entries)
+
+  def _remember(self, key, ipa):
+    self.entries[key] = ipa
+    self.entries.move_to_end(key)
+    if len(self.entries) > self.capacity:
+      self.entries.popitem(last = False)
+
+  def get(self, language, word):
+    """ Get the cached transliteration of the word, or None if it's not cached """
+    key = (language, word)
+    with self.lock:
+      ipa = self.entries.get(key)
+      if ipa != None:
+        self.entries.move_to_end(key)
+      elif self.db != None:
+        row = self.db.execute("SELECT ipa FROM translit WHERE language = ? AND word = ?", key).fetchone()
+        if row != None:
+          ipa = row[0]
+          self._remember(key, ipa)
+      if ipa != None:
+        self.hits = self.hits + 1
+      else:
+        self.misses = self.misses + 1
+      return ipa
+
+  def put(self, language, word, ipa):
+    """ Store the transliteration of the word """
+    key = (language, word)
+    with self.lock:
+      self._remember(key, ipa)
+      if self.db != None:
+        self.db.execute("INSERT OR REPLACE INTO translit VALUES (?, ?, ?)", (language, word, ipa))
+        self.pending = self.pending + 1
+        if self.pending >= 256:
+          self.db.commit()
+          self.pending = 0
+
+  def transliterate(self, language, word, transliterate):
+    """ Get the transliteration of the word from the cache, or compute it with the given function (and cache it) """
+    ipa = self.get(language, word)
+    if ipa == None:
+      ipa = transliterate(word)
+      self.put(language, word, ipa)
+    return ipa
+
+  def flush(self):
+    """ Make sure all the transliterations are written to the database """
+    with self.lock:
+      if self.db != None and self.pending:
+        self.db.commit()
+        self.pending = 0
+
+  def close(self):
+    self.flush()
+    if self.db != None:
+      self.db.close()
+      self.db = None
+
+  def stats(self):
+    """ Get the cache statistics as a dictionary """
+    lookups = self.hits + self.misses
+    return { "size": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+             "hitRate": self.hits / lookups if lookups else 0.0 }
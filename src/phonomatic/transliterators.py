@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import threading
+
+def readLexicon(path):
+  """ Read a lexicon file: one word per line followed by its IPA, separated by a tab or spaces (lines starting with # are
+      ignored). Yields tuple (word, IPA), the IPA being empty if the line only has the word """
+  with open(path, encoding = "utf-8") as f:
+    for line in f:
+      line = line.strip()
+      if not line or line.startswith("#"):
+        continue
+      parts = line.split(None, 1)
+      yield (parts[0], parts[1].strip() if len(parts) == 2 else "")
+
+def fixedLanguage(transliterator, language):
+  """ The setLanguage of the transliterators that only know their language """
+  if transliterator.language not in (None, language):
+    raise ValueError("{} is for {}, it can't transliterate {}".format(type(transliterator).__name__, transliterator.language, language))
+
+class Transliterator(object):
+  """ The interface of the transliterators given to a Matcher: transliterate(text) gives the IPA of a text and language
+      is the language code (it keys the transliteration cache and selects the confusion matrix).
+
+      A transliterator can also tell the IPA of a single word with lookup(word), that returns None if it doesn't know the
+      word, so a ChainTransliterator can try the next one. By default, the text is transliterated word by word and the
+      words that aren't known are kept as is. setLanguage(language) changes the language (see TreeNode.setLanguage),
+      switchable is False for the transliterators that only know one language (like a lexicon) """
+  language = None
+  switchable = True
+
+  def lookup(self, word):
+    """ The IPA of the word, or None if it's not known """
+    return None
+
+  def transliterate(self, text):
+    words = [ x for x in text.split(' ') if len(x) > 0 ]
+    ipa = [ self.lookup(x) for x in words ]
+    return " ".join(x if x != None else word for x, word in zip(ipa, words))
+
+  def setLanguage(self, language):
+    self.language = language
+
+
+class EpitranInst(Transliterator):
+  """ The instance wrapper of Epitran that can change language at runtime.
+      Epitran is a heavy import and loading a language takes time, so it's only done when the first text is transliterated
+      (so a grammar loaded from a file, or a chain whose dictionary knows all the words, never loads it) """
+  def __init__(self, language = None):
+    self.language = language
+    self.epiInst = None
+    self.lock = threading.Lock()
+
+  def instance(self):
+    """ The Epitran instance for the language (None if there's no language), created on first use """
+    if self.epiInst == None and self.language != None:
+      with self.lock:
+        if self.epiInst == None:
+          import epitran
+          self.epiInst = epitran.Epitran(self.language)
+    return self.epiInst
+
+  def lookup(self, word):
+    epiInst = self.instance()
+    return epiInst.transliterate(word) if epiInst != None else None
+
+  def transliterate(self, text):
+    epiInst = self.instance()
+    if epiInst == None:
+      return text
+    return epiInst.transliterate(text)
+
+  def setLanguage(self, language):
+    with self.lock:
+      self.language = language
+      self.epiInst = None
+
+
+class DictionaryTransliterator(Transliterator):
+  """ A precomputed pronunciation dictionary (a lexicon): a hash lookup of the words' IPA. Words are looked up as given
+      then in lower case.
+      The lexicon is a dictionary of word => IPA or the path of a file with one word per line, followed by its IPA (separated
+      by a tab or spaces, lines starting with # are ignored, the first pronunciation of a word is used).
+      A lexicon is for one language, it can't change language (unless its language is None, then it's used for any) """
+  switchable = False
+
+  def __init__(self, lexicon, language = None):
+    self.language = language
+    self.lexicon = {}
+    if isinstance(lexicon, str):
+      self.load(lexicon)
+    else:
+      self.lexicon.update(lexicon)
+
+  def __len__(self):
+    return len(self.lexicon)
+
+  def load(self, path):
+    """ Add the words of the lexicon file """
+    for word, ipa in readLexicon(path):
+      if ipa and word not in self.lexicon:
+        self.lexicon[word] = ipa
+
+  def save(self, path):
+    """ Save the lexicon to a file that can be loaded back """
+    with open(path, "w", encoding = "utf-8") as f:
+      for word, ipa in self.lexicon.items():
+        f.write("{}\t{}\n".format(word, ipa))
+
+  @classmethod
+  def precompute(cls, words, transliterator):
+    """ Build the lexicon of the given words with another transliterator (like Epitran), once, to save it for later """
+    lexicon = {}
+    for word in words:
+      if word not in lexicon:
+        lexicon[word] = transliterator.transliterate(word)
+    return cls(lexicon, transliterator.language)
+
+  def setLanguage(self, language):
+    fixedLanguage(self, language)
+
+  def lookup(self, word):
+    ipa = self.lexicon.get(word)
+    return ipa if ipa != None else self.lexicon.get(word.lower())
+
+
+class RuleTransliterator(Transliterator):
+  """ A rule based transliterator: the rules are rewrites of graphemes (one or more letters) to IPA, applied from the
+      beginning of the word to its end, the longest graphemes first. It's a crude fallback for regular spellings (or
+      spelled acronyms), a word with a letter that no rule covers isn't known.
+      The rules are a dictionary of graphemes => IPA (the IPA can be empty for silent letters), a list of tuple (graphemes,
+      IPA) or the path of a file with the graphemes and their IPA on each line (like a lexicon, graphemes alone are silent).
+      Like a lexicon, the rules are for one language """
+  switchable = False
+
+  def __init__(self, rules, language = None):
+    self.language = language
+    self.rules = dict(readLexicon(rules) if isinstance(rules, str) else rules.items() if isinstance(rules, dict) else rules)
+    self.longest = max((len(x) for x in self.rules), default = 0)
+
+  def setLanguage(self, language):
+    fixedLanguage(self, language)
+
+  def lookup(self, word):
+    word = word.lower()
+    ipa = []
+    i = 0
+    while i < len(word):
+      for size in range(min(self.longest, len(word) - i), 0, -1):
+        rewrite = self.rules.get(word[i:i + size])
+        if rewrite != None:
+          ipa.append(rewrite)
+          i = i + size
+          break
+      else:
+        return None
+    return "".join(ipa)
+
+
+class ChainTransliterator(Transliterator):
+  """ Transliterate each word with the first transliterator of the chain that knows it, like a dictionary, then rules, then
+      Epitran as the last resort (that knows every word). Since most of a grammar's vocabulary is usually in the dictionary,
+      the slower transliterators are rarely used.
+      The text is transliterated word by word (Epitran is then also given single words, see TreeNode.setWordProcessing).
+      When the chain's language is changed, it's passed on to the transliterators that can switch (like Epitran), the
+      others (like a lexicon) are only used while the chain has their language.
+      hits counts the words found by each transliterator and misses the words that none knew (they are kept as is) """
+  def __init__(self, transliterators, language = None):
+    self.transliterators = list(transliterators)
+    self.language = language if language != None else next((x.language for x in self.transliterators if x.language != None), None)
+    self.hits = [0] * len(self.transliterators)
+    self.misses = 0
+
+  def setLanguage(self, language):
+    """ Change the language of the chain and of its transliterators that can switch """
+    self.language = language
+    for transliterator in self.transliterators:
+      if getattr(transliterator, "switchable", hasattr(transliterator, "setLanguage")):
+        transliterator.setLanguage(language)
+
+  def lookup(self, word):
+    for i, transliterator in enumerate(self.transliterators):
+      if transliterator.language not in (None, self.language):
+        continue
+      ipa = transliterator.lookup(word)
+      if ipa != None:
+        self.hits[i] += 1
+        return ipa
+    self.misses += 1
+    return None
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from .confusionmatrix import PackedSOPs
+from .node import TreeNode, submap
+import re
+
+class ValueGrammar(object):
+  """ The grammar of the values of a ParametricNode. Instead of capturing any words, the parameter then only captures
+      the words that form a value of the grammar, and gives the normalized value (like the number 98 for the words
+      "quatre vingt dix huit").
+      A value grammar gives all the ways it can match the beginning of the SOP, as a list of tuple
+      (remaining budget, value, number of words), sorted by increasing number of words """
+  def expand(self, SOP, budget, wl, ctx, maxWords):
+    """ Get the possible values at the beginning of the SOP (a SOPCursor), for at most maxWords words """
+    return []
+
+  @staticmethod
+  def words(SOP, wl, count):
+    """ The next count words of the text at the SOP position """
+    start = len(wl) - len(SOP)
+    return wl[start:start + count]
+
+
+class EntityValues(ValueGrammar):
+  """ A closed list of values, each having one or more texts. The texts are converted to SOP when the grammar is built
+      and packed together, so they're all scored at once against the input """
+  def __init__(self, entities):
+    """ entities is a dictionary of value => text (or list of texts), or a list of tuple (value, text) """
+    values = []
+    forms = []
+    for value, texts in (entities.items() if isinstance(entities, dict) else entities):
+      for text in ([texts] if isinstance(texts, str) else texts):
+        values.append(value)
+        forms.append(submap.discode(TreeNode.splitToSOP(text)))
+    self.setForms(values, forms)
+
+  @classmethod
+  def fromSOP(cls, values, forms):
+    """ Build the grammar from the values and their already converted forms, without transliterating anything """
+    grammar = cls.__new__(cls)
+    grammar.setForms(values, forms)
+    return grammar
+
+  def setForms(self, values, forms):
+    self.values = values
+    self.packed = PackedSOPs(forms)
+    # No value can span more words than its longest form
+    self.maxWords = int(self.packed.wordCount.max()) if len(forms) else 0
+
+  def expand(self, SOP, budget, wl, ctx, maxWords):
+    maxWords = min(maxWords, self.maxWords, len(SOP))
+    if maxWords == 0 or budget <= 0:
+      return []
+    # Cost of each form against the input up to the end of each word
+    ends = [SOP.length(k) for k in range(1, maxWords + 1)]
+    costs = ctx.confusionMatrix.endCosts(self.packed, SOP.flat()[:ends[-1]])
+    expansions = []
+    for k, end in enumerate(ends):
+      m = int(costs[:, end].argmin())
+      if costs[m, end] < budget:
+        expansions.append((budget - float(costs[m, end]), self.values[m], k + 1))
+    return expansions
+
+
+# Number words per language, they generate the text of a number
+def _frenchNumber(n):
+  units = ["zéro", "un", "deux", "trois", "quatre", "cinq", "six", "sept", "huit", "neuf", "dix", "onze", "douze", "treize",
+           "quatorze", "quinze", "seize"]
+  tens = {2: "vingt", 3: "trente", 4: "quarante", 5: "cinquante", 6: "soixante"}
+  if n < 17:
+    return units[n]
+  if n < 20:
+    return "dix " + units[n - 10]
+  if n < 70:
+    unit = n % 10
+    return tens[n // 10] + ("" if unit == 0 else " et un" if unit == 1 else " " + units[unit])
+  if n < 80:
+    return "soixante " + ("et onze" if n == 71 else _frenchNumber(n - 60))
+  if n < 100:
+    return "quatre vingts" if n == 80 else "quatre vingt " + _frenchNumber(n - 80)
+  if n < 1000:
+    hundreds, rest = divmod(n, 100)
+    text = "cent" if hundreds == 1 else units[hundreds] + (" cents" if rest == 0 else " cent")
+    return text + (" " + _frenchNumber(rest) if rest else "")
+  thousands, rest = divmod(n, 1000)
+  text = "mille" if thousands == 1 else _frenchNumber(thousands) + " mille"
+  return text + (" " + _frenchNumber(rest) if rest else "")
+
+def _englishNumber(n):
+  units = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve",
+           "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+  tens = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+  if n < 20:
+    return units[n]
+  if n < 100:
+    return tens[n // 10] + ("" if n % 10 == 0 else " " + units[n % 10])
+  if n < 1000:
+    hundreds, rest = divmod(n, 100)
+    return units[hundreds] + " hundred" + (" " + _englishNumber(rest) if rest else "")
+  thousands, rest = divmod(n, 1000)
+  return _englishNumber(thousands) + " thousand" + (" " + _englishNumber(rest) if rest else "")
+
+numberWords = { "fra": _frenchNumber, "eng": _englishNumber }
+
+
+class NumberValues(EntityValues):
+  """ The numbers from minimum to maximum (included), spoken in the given language (the default matcher's language if
+      None, only the language part of the code is used, like "fra" for "fra-Latn-p") """
+  def __init__(self, minimum = 0, maximum = 100, language = None):
+    language = (language if language != None else TreeNode.matcher.language or "").split("-")[0]
+    if language not in numberWords:
+      raise ValueError("No number grammar for language {}".format(language))
+    super().__init__([(n, numberWords[language](n)) for n in range(minimum, maximum + 1)])
+    self.minimum = minimum
+    self.maximum = maximum
+
+
+class PatternValues(ValueGrammar):
+  """ Values given by a regular expression on the words of the text (not their phonemes), like codes or references
+      that are spelled. The value is the matched text, or what convert returns for the match if given """
+  def __init__(self, pattern, convert = None, maxWords = 4):
+    self.pattern = re.compile(pattern)
+    self.convert = convert
+    self.maxWords = maxWords
+
+  def expand(self, SOP, budget, wl, ctx, maxWords):
+    words = self.words(SOP, wl, min(maxWords, self.maxWords))
+    expansions = []
+    for k in range(1, len(words) + 1):
+      match = self.pattern.fullmatch(" ".join(words[:k]))
+      if match:
+        expansions.append((budget, self.convert(match) if self.convert != None else match.group(0), k))
+    return expansions
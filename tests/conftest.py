@@ -0,0 +1,43 @@
+import pytest
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+
+def buildIntent(*nodes):
+    root = TreeNode()
+    for node in nodes:
+        root.appendChild(node)
+    return root
+
+@pytest.fixture
+def makeIntent():
+    """The root of an intent made of the given nodes"""
+    return buildIntent
+
+@pytest.fixture
+def curtainsIntent():
+    """Open or close the curtains or covers, politely if asked"""
+    def make(polite = False):
+        nodes = [AlternativeNode([("open", "Ouvrez"), ("close", "Fermez")]), BasicNode(("the", "les")), AlternativeNode([("curtain", "rideaux"), ("cover", "volets")])]
+        if polite:
+            nodes.append(OptionalNode(["s'il te plait", "s'il vous plait"]))
+        return buildIntent(*nodes, EndNode())
+    return make
+
+@pytest.fixture
+def volumeIntent():
+    """Increase or decrease the volume by a value, the parametric node taking the given arguments"""
+    def make(percent = True, **parameter):
+        nodes = [AlternativeNode([("increase", "Montez"), ("decrease", "Baissez")]), BasicNode(("volume", "le volume de")), ParametricNode("value", **parameter)]
+        if percent:
+            nodes.append(OptionalNode(["pourcent"]))
+        return buildIntent(*nodes)
+    return make
+
+@pytest.fixture
+def deviceIntents(volumeIntent):
+    """Intents sharing their first nodes, one per action on a device, and the volume"""
+    return [
+        ("open_curtain", buildIntent(BasicNode(("open", "Ouvrez")), BasicNode(("the", "les")), BasicNode(("curtain", "rideaux")))),
+        ("open_cover", buildIntent(BasicNode(("open", "Ouvrez")), BasicNode(("the", "les")), BasicNode(("cover", "volets")))),
+        ("close_cover", buildIntent(BasicNode(("close", "Fermez")), BasicNode(("the", "les")), BasicNode(("cover", "volets")))),
+        ("volume", volumeIntent()),
+    ]
@@ -0,0 +1,41 @@
+import asyncio
+from phonomatic.node import TreeNode
+from phonomatic.graph import IntentGraph
+from phonomatic.asyncmatcher import AsyncMatcher
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_AsyncMatcher(curtainsIntent):
+    """Test matching concurrent texts in batches"""
+    graph = IntentGraph([("curtains", curtainsIntent())])
+    texts = ["Ouvrez les rideaux", "Fermez les volets", "Bonjour", "Fermez les rideaux"] * 5
+
+    async def client():
+        async with AsyncMatcher(graph, 1.0, window = 0.05, maxBatch = 8) as matcher:
+            results = await asyncio.gather(*[matcher.match(text) for text in texts])
+            # A late request is still served by the running matcher
+            late = await matcher.match("Ouvrez les volets")
+        return matcher, results, late
+
+    matcher, results, late = asyncio.run(client())
+    found = [TreeNode.results_to_str(x[0][2]) if x else None for x in results]
+    assert found == [["open", "the", "curtain"], ["close", "the", "cover"], None, ["close", "the", "curtain"]] * 5, "Results must be in the callers' order"
+    assert TreeNode.results_to_str(late[0][2]) == ["open", "the", "cover"]
+    assert matcher.texts == 21 and matcher.batches == 4, "Texts should be matched in batches"
+
+def test_AsyncMatcherClose(curtainsIntent):
+    """Test closing while a batch is being collected"""
+    graph = IntentGraph([("curtains", curtainsIntent())])
+
+    async def client():
+        matcher = AsyncMatcher(graph, 1.0, window = 1.0)
+        pending = asyncio.ensure_future(matcher.match("Ouvrez les rideaux"))
+        await asyncio.sleep(0.05)
+        await matcher.close()
+        # The text was taken from the queue for a batch that was never completed, it must be matched anyway
+        return await asyncio.wait_for(pending, 5.0)
+
+    result = asyncio.run(client())
+    assert TreeNode.results_to_str(result[0][2]) == ["open", "the", "curtain"]
@@ -1,4 +1,8 @@
-from phonomatic.confusionmatrix import IPASubmap, ConfusionMatrix
+import pytest
+import random
+import numpy as np
+from phonomatic.confusionmatrix import IPASubmap, ConfusionMatrix, PackedSOPs
+from phonomatic.matcher import Matcher
 
 def test_IPASubmap():
     """Test IPA submap"""
@@ -12,7 +16,7 @@ def test_IPASubmap():
 
 def test_confusionmatrix():
     """Test confusion matrix"""
-    cm = ConfusionMatrix()
+    cm = ConfusionMatrix(weighted = False)
     a = cm.confuseScore("insanity is doing the same thing over and over again", "insanity is doing the same thing over and over again")
     assert a == 1.0, "ConfuseScore of same text failed"
     a = cm.confuseScore("insanity is doing the same thing over and over again".split(" "), "insanity is doing the same thing over and over again".split(" "))
@@ -25,3 +29,157 @@ def test_confusionmatrix():
     assert a == 1.0, "ConfuseScore of deleted char failed"
     a = cm.confuseScore("insanity is doing the same thing over and over again", "insanity is doing the same thing oover and over again", 2.0)
     assert a == 1.0, "ConfuseScore of inserted char failed"
+
+def test_weightedConfusionMatrix():
+    """Test weighted confusion matrix"""
+    cm = ConfusionMatrix()
+    sm = cm.submap
+    o, u, p, t, a = [sm.index[x] for x in "oupta"]
+    assert cm.matrix.shape == (len(sm.alphabet), len(sm.alphabet)), "Matrix should cover the whole submap"
+    assert cm.confuseScorePhoneme(o, o) == 1.0, "Same phoneme should be similar"
+    assert cm.confuseScorePhoneme(o, u) == cm.confuseScorePhoneme(u, o), "Similarity should be symmetric"
+    assert 0.0 < cm.confuseScorePhoneme(p, t) < 1.0, "Confused consonants should be partially similar"
+    assert cm.confuseScorePhoneme(o, t) == 0.0, "Vowel and consonant should be different"
+    assert cm.confuseScorePhoneme(a, a) == 1.0, "Phoneme outside the table should match itself"
+    assert ConfusionMatrix().matrix is cm.matrix, "Matrix should be built once per language"
+
+    a = cm.confuseScore("insanity is doing the same thing over and over again", "insanity is doing the same thing uver and over again")
+    assert a == cm.confuseScorePhoneme(o, u), "ConfuseScore of different text failed"
+    a = cm.confuseScore("insanity is doing the same thing over and over again", "insanity is doing the same thing uver and over again", 2.0)
+    assert a == pytest.approx(1.0 + cm.confuseScorePhoneme(o, u)), "ConfuseScore of replacemed char should be weighted"
+    a = cm.confuseScore("insanity is doing the same thing over and over again", "insanity is doing the same thing ver and over again", 2.0)
+    assert a == 1.0, "ConfuseScore of deleted char failed"
+
+def test_IPASubmapBatch():
+    """Test batch discoding"""
+    sm = IPASubmap()
+    words = "uvʁe lɛ ʁido sil vu plɛ".split(" ")
+    phonemes, offsets = sm.discodeBatch(words)
+    assert len(offsets) == len(words) + 1, "Batch offsets count failed"
+    assert [list(phonemes[offsets[i]:offsets[i+1]]) for i in range(len(words))] == sm.discode(words), "Batch discoding failed"
+    assert sm.discode("ʁ̃") == [sm.alphabet.index("ʁ")], "Discoding should skip unknown characters"
+
+def test_orderedSubmap():
+    """Test the similarity ordered submap and its gap bound"""
+    sm = IPASubmap(ordered = True)
+    assert sorted(sm.alphabet) == sorted(IPASubmap().alphabet), "Ordered alphabet should be a permutation"
+    assert "".join(sm.alphabet[x] for x in sm.discode("uvʁe")) == "uvʁe", "Discoding with the ordered submap failed"
+    cm = ConfusionMatrix(ordered = True)
+    default = ConfusionMatrix()
+    assert cm.matrix is not default.matrix, "Matrix should be built per ordering"
+    text, other = "insanity is doing the same thing over and over again", "insanity is doing the same thing uver and ovel again"
+    assert cm.confuseScore(text, other, 3.0) == pytest.approx(default.confuseScore(text, other, 3.0)), "Ordering shouldn't change the scores"
+
+    # The bound holds for all the pairs of phonemes
+    n = len(sm.alphabet)
+    penalty = 1.0 - cm.matrix
+    gaps = abs(np.arange(n)[:, None] - np.arange(n)[None, :])
+    assert (penalty >= cm.gapPenalty[gaps] - 1e-6).all(), "Gap penalty isn't a lower bound"
+    # And it's tighter than with the Unicode order
+    assert cm.gapPenalty[4] > default.gapPenalty[4], "Ordered submap should give a tighter bound"
+    o = sm.index["o"]
+    start, stop = cm.neighborhood(o, 0.5)
+    assert stop - start < 12, "Neighborhood should be small for low penalties"
+    assert all(start <= x < stop for x in range(n) if penalty[o, x] < 0.5), "Neighborhood should contain all close phonemes"
+    assert cm.penaltyBound(o, sm.index["u"]) <= penalty[o, sm.index["u"]], "Penalty bound failed"
+
+def test_matrixRegistry(tmp_path):
+    """Test the per language confusion matrices"""
+    english = ConfusionMatrix.forLanguage("en")
+    assert ConfusionMatrix.forLanguage("en") is english, "Matrices should be shared"
+    assert ConfusionMatrix.forLanguage("eng-Latn").matrix is english.matrix, "Epitran code should use the language's tables"
+    french = ConfusionMatrix.forLanguage("fra-Latn-p")
+    assert french.matrix is not english.matrix, "Language without tables should fall back to the feature matrix"
+    assert ConfusionMatrix.forLanguage("spa-Latn").matrix is french.matrix, "Feature matrix should be shared"
+    assert ConfusionMatrix.forLanguage("fra-Latn") is french and ConfusionMatrix.forLanguage("spa-Latn") is french, "Languages with the same tables should share the instance"
+    assert ConfusionMatrix.languages["fra-Latn"] is french, "Seen languages should be found without resolving their tables"
+    other = ConfusionMatrix("deu-Latn")
+    assert other.sim is french.sim and other.rows is french.rows and other.gapPenalty is french.gapPenalty, "Views of the matrix should be shared"
+    sm = french.submap
+    p, b, a, t = [sm.index[x] for x in "pbat"]
+    assert 0.0 < french.confuseScorePhoneme(p, b) < 1.0, "Phonemes with close features should be similar"
+    assert french.confuseScorePhoneme(p, b) > french.confuseScorePhoneme(p, a), "Consonant should be closer to consonant than vowel"
+
+    path = tmp_path / "tables.txt"
+    path.write_text("# Test tables\n    p   t\np  80  20\nt  20  80\n\n    a   e\na  90  10\ne  10  90\n", encoding = "utf-8")
+    try:
+        ConfusionMatrix.register("xyz", str(path))
+        custom = ConfusionMatrix.forLanguage("xyz-Latn")
+        assert custom.confuseScorePhoneme(p, t) == pytest.approx(0.25), "Registered tables should be used"
+        assert custom.confuseScorePhoneme(p, b) == 0.0, "Phonemes outside the tables should differ"
+        matcher = Matcher(transliterator = type("Stub", (), { "language": "xyz-Latn" })())
+        assert matcher.confusionMatrix is custom, "Matcher should use the matrix of its language"
+        matcher.transliterator.language = "eng-Latn"
+        assert (matcher.confusionMatrix.matrix == english.matrix).all(), "Matcher should follow the language"
+    finally:
+        del ConfusionMatrix.sources["xyz"]
+
+def test_bandedAlignment():
+    """Test the banded weighted edit distance"""
+    cm = ConfusionMatrix(weighted = False)
+    a = cm.submap.discode("insanity")
+    assert cm._alignBanded(a, cm.submap.discode("insanity"), 1.0) == (1.0, 8), "Alignment of same text failed"
+    assert cm._alignBanded(a, cm.submap.discode("inanty"), 3.0) == (1.0, 6), "Alignment with two deletions failed"
+    assert cm._alignBanded(a, cm.submap.discode("inssannity"), 3.0) == (1.0, 10), "Alignment with two insertions failed"
+    assert cm._alignBanded(a, cm.submap.discode("inanty"), 2.0) == (0.0, 0), "Alignment over budget should fail"
+    assert cm._alignBanded(a, cm.submap.discode("insanity is doing"), 1.0, prefix = True) == (1.0, 8), "Prefix alignment failed"
+    assert cm._alignBanded(a, cm.submap.discode("inanity is doing"), 2.0, prefix = True) == (1.0, 7), "Prefix alignment with deletion failed"
+
+    # Compare with a full (unbanded) weighted Levenshtein distance
+    cm = ConfusionMatrix()
+    random.seed(0)
+    phonemes = cm.submap.discode("aeioupbtdkfvszmnlʁ")
+    for _ in range(200):
+        x = [random.choice(phonemes) for _ in range(random.randint(0, 8))]
+        y = [random.choice(phonemes) for _ in range(random.randint(0, 8))]
+        d = [[float(i + j) if i * j == 0 else 0.0 for j in range(len(y) + 1)] for i in range(len(x) + 1)]
+        for i in range(1, len(x) + 1):
+            for j in range(1, len(y) + 1):
+                d[i][j] = min(d[i-1][j] + 1, d[i][j-1] + 1, d[i-1][j-1] + 1 - cm.confuseScorePhoneme(x[i-1], y[j-1]))
+        r = cm._alignBanded(x, y, 4.0)
+        assert r[0] == pytest.approx(max(0.0, 4.0 - d[-1][-1])), "Banded alignment differs from full alignment"
+
+def test_batchScoring(monkeypatch):
+    """Test vectorized one vs many scoring"""
+    monkeypatch.setattr(ConfusionMatrix, "batchThreshold", 0)
+    cm = ConfusionMatrix()
+    random.seed(1)
+    phonemes = cm.submap.discode("aeioupbtdkfvszmnlʁɔ")
+    def randomSOP(words):
+        return [[random.choice(phonemes) for _ in range(random.randint(0, 6))] for _ in range(words)]
+
+    assert len(cm.confuseScorePreBatch(PackedSOPs([]), randomSOP(2), 2.0)[0]) == 0, "Empty batch failed"
+    for _ in range(100):
+        candidates = [randomSOP(random.randint(0, 3)) for _ in range(random.randint(1, 20))]
+        B = randomSOP(random.randint(0, 5))
+        budget = random.choice([1.0, 2.0, 2.5, 4.0])
+        scores, consumed = cm.confuseScorePreBatch(PackedSOPs(candidates), B, budget)
+        for i, A in enumerate(candidates):
+            r = cm.confuseScorePre(A, B, budget)
+            assert scores[i] == pytest.approx(r[0]), "Batch score differs from single score"
+            if r[0] > 0:
+                assert consumed[i] == r[1], "Batch consumed count differs from single count"
+
+def test_startCosts():
+    """Test the lower bound of the cost of matching at each position"""
+    cm = ConfusionMatrix()
+    random.seed(2)
+    phonemes = cm.submap.discode("aeioupbtdkfvszmnlʁɔ")
+    def randomSOP(words):
+        return [[random.choice(phonemes) for _ in range(random.randint(1, 6))] for _ in range(words)]
+
+    for _ in range(50):
+        candidates = [randomSOP(random.randint(1, 3)) for _ in range(random.randint(1, 5))]
+        B = randomSOP(random.randint(1, 6))
+        b = [x for word in B for x in word]
+        budget = random.choice([1.0, 2.0, 3.0])
+        costs = cm.startCosts(PackedSOPs(candidates), b)
+        assert len(costs) == len(b) + 1
+        for w in range(len(B)):
+            start = sum(len(x) for x in B[:w])
+            best = max(cm.confuseScorePre(A, B[w:], budget)[0] for A in candidates)
+            if best > 0:
+                assert costs[start] <= budget - best + 1e-9, "Start cost must be a lower bound"
+            # And it's the exact prefix alignment cost
+            exact = max(cm._alignBanded([x for word in A for x in word], b[start:], 100.0, prefix = True)[0] for A in candidates)
+            assert costs[start] == pytest.approx(100.0 - exact)
@@ -0,0 +1,51 @@
+import pytest
+from phonomatic.node import TreeNode
+from phonomatic.graph import IntentGraph
+from phonomatic.grammarfile import saveGrammar, GrammarFile
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_GrammarFile(tmp_path, monkeypatch, curtainsIntent, volumeIntent):
+    """Test saving and loading a precompiled grammar"""
+    intents = [
+        ("curtains", curtainsIntent(polite = True)),
+        ("volume", volumeIntent(maximumParameterWordCount = 6)),
+    ]
+    path = str(tmp_path / "grammar.phm")
+    saveGrammar(intents, path)
+
+    # Loading must not transliterate anything
+    def fail(text):
+        raise AssertionError("Epitran shouldn't be called")
+    grammar = GrammarFile(path)
+    monkeypatch.setattr(TreeNode.epiInst, "transliterate", fail)
+    assert len(grammar) == 2
+    assert grammar.intent(1) == "volume"
+    assert grammar.roots == {}, "Intents should be built lazily"
+
+    name, root = grammar[0]
+    assert name == "curtains"
+    assert [type(x) for x in root.children] == [type(x) for x in intents[0][1].children]
+    assert [x.key() for x in root.children] == [x.key() for x in intents[0][1].children]
+    assert root.children[1].text == intents[0][1].children[1].text
+    assert grammar[1][1].children[2].maxParamCount == 6
+    # The forms are read from the mapped file, not copied
+    assert root.children[0].packed.arena is grammar.sopArena and isinstance(grammar.sopArena.phonemes, memoryview)
+    assert root.children[0].forms == intents[0][1].children[0].forms and root.children[3].texts == intents[0][1].children[3].texts
+    with pytest.raises(IndexError):
+        grammar[2]
+    monkeypatch.undo()
+
+    for graph in (IntentGraph(intents), IntentGraph(grammar)):
+        a = graph.matchText("Ouvrez les rideaux s'il vous plait", 1.0)
+        assert a[0][1] == "curtains" and TreeNode.results_to_str(a[0][2]) == ["open", "the", "curtain"]
+        a = graph.matchText("Baissez le volume de cinquante pourcent", 2.0)
+        assert a[0][1] == "volume" and TreeNode.results_to_str(a[0][2]) == ["decrease", "volume", "value = cinquante"]
+    grammar.close()
+    # The intents built from the file are still usable once it's closed
+    assert root.children[0].forms == intents[0][1].children[0].forms
+    for text, expected in (("Fermez les volets s'il vous plait", ["close", "the", "cover"]), ("Montez le volume de dix", ["increase", "volume", "value = dix"])):
+        a = graph.matchText(text, 2.0)
+        assert TreeNode.results_to_str(a[0][2]) == expected
@@ -0,0 +1,72 @@
+import json
+import pytest
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+from phonomatic.matcher import Matcher
+from phonomatic.graph import IntentGraph
+from phonomatic.grammarspec import parseSentence, buildGrammar, loadGrammar
+from phonomatic.values import NumberValues
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_parseSentence():
+    """Test parsing the sentence syntax"""
+    assert parseSentence("Open the <object: curtain|cover=volets> <name> [optional: please|thanks] [now]") == [
+        ("basic", None, "Open"), ("basic", None, "the"), ("alternative", [("curtain", "curtain"), ("cover", "volets")]),
+        ("parametric", "name"), ("optional", ["please", "thanks"]), ("optional", ["now"]), ("end",)]
+    assert parseSentence("<action: open=Ouvrez> <object>", { "object": [("curtain", "rideaux")] }, end = False) == [
+        ("basic", "open", "Ouvrez"), ("alternative", [("curtain", "rideaux")])]
+    for sentence in ("Open <object: curtain", "Open [please", "Open the >", "<object: curtain|>", "<>", "[a||b]"):
+        with pytest.raises(ValueError):
+            parseSentence(sentence)
+
+def test_buildGrammar(tmp_path):
+    """Test building a grammar in bulk"""
+    intents = { "open": "<action: open=Ouvrez|close=Fermez> les <object> [s'il vous plaît]",
+                "volume": ["Baissez le volume de <value> [pourcent]", "Moins fort"] }
+    entities = { "object": { "curtain": "rideaux", "cover": ["volets", "persiennes"] } }
+    grammar = buildGrammar(intents, entities, values = { "value": NumberValues(0, 100) })
+    assert [x[0] for x in grammar] == ["open", "volume", "volume"]
+
+    # Same nodes as when building them one by one
+    expected = [AlternativeNode([("open", "Ouvrez"), ("close", "Fermez")]), BasicNode("les", None), AlternativeNode([("curtain", "rideaux"), ("cover", "volets"), ("cover", "persiennes")]),
+                OptionalNode("s'il vous plaît"), EndNode()]
+    nodes = grammar[0][1].children
+    assert [type(x) for x in nodes] == [type(x) for x in expected]
+    assert [x.key() for x in nodes] == [x.key() for x in expected]
+    assert nodes[1].id == None and nodes[1].text == TreeNode.splitToSOP("les")
+    assert nodes[0].packed.arena is nodes[2].packed.arena is grammar[1][1].children[5].packed.arena, "The grammar should have its own arena"
+    assert isinstance(grammar[1][1].children[4], ParametricNode) and isinstance(grammar[1][1].children[4].values, NumberValues)
+
+    graph = IntentGraph(grammar)
+    for text, intent, results in (("Fermez les persiennes", "open", ["close", "cover"]), ("Ouvrez les rideaux s'il vous plaît", "open", ["open", "curtain"]),
+                                  ("Baissez le volume de cinquante pourcent", "volume", ["value = 50"]), ("Moins fort", "volume", [])):
+        a = graph.matchText(text, 2.0)
+        assert a and a[0][1] == intent and TreeNode.results_to_str(a[0][2]) == results, "Matching failed for {}".format(text)
+
+    # Each distinct text (or word when transliterating word by word) is only transliterated once
+    calls = []
+    class Counting(object):
+        language = defaultLanguage
+        def transliterate(self, text):
+            calls.append(text)
+            return text
+    buildGrammar([("a", "<x: un deux|deux> un deux"), ("b", "[un deux] deux")], ctx = Matcher(transliterator = Counting()))
+    assert sorted(calls) == ["deux", "un", "un deux"]
+    del calls[:]
+    buildGrammar([("a", "<x: un deux|deux> un deux"), ("b", "[un deux] deux")], ctx = Matcher(transliterator = Counting(), wordProcessing = True))
+    assert sorted(calls) == ["deux", "un"]
+
+    path = str(tmp_path / "grammar.json")
+    with open(path, "w", encoding = "utf-8") as f:
+        json.dump({ "intents": intents, "entities": entities }, f)
+    loaded = loadGrammar(path)
+    assert [[x.key() for x in root.children] for _, root in loaded] == [[x.key() for x in root.children] for _, root in grammar]
+
+    yaml = pytest.importorskip("yaml")
+    path = str(tmp_path / "grammar.yaml")
+    with open(path, "w", encoding = "utf-8") as f:
+        yaml.safe_dump({ "intents": intents }, f, allow_unicode = True)
+    loaded = loadGrammar(path)
+    assert isinstance(loaded[0][1].children[2], ParametricNode) and loaded[0][1].children[2].name == "object"
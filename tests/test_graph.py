@@ -0,0 +1,87 @@
+from phonomatic.node import TreeNode, BasicNode, OptionalNode
+from phonomatic.graph import IntentGraph, latticePaths
+from phonomatic.matcher import Matcher
+import math
+import pytest
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+@pytest.fixture
+def graph(deviceIntents):
+    return IntentGraph(deviceIntents)
+
+def test_IntentGraph(graph):
+    """Test compiled intent graph matching"""
+    # Ouvrez and les are shared by the first two intents
+    assert graph.nodeCount == 9
+
+    a = graph.matchText("Ouvrez les rideaux", 1.0)
+    assert a[0][1] == "open_curtain"
+    assert TreeNode.results_to_str(a[0][2]) == ["open", "the", "curtain"]
+
+    a = graph.matchText("Fermée le veau les", 5.0)
+    assert a[0][1] == "close_cover"
+    assert [x[0] for x in a] == sorted([x[0] for x in a], reverse = True)
+
+    a = graph.matchText("Baissez le volume de cinquante pourcent", 2.0)
+    assert a[0][1] == "volume"
+    assert TreeNode.results_to_str(a[0][2]) == ["decrease", "volume", "value = cinquante"]
+
+    assert graph.matchText("Bonjour", 1.0) == []
+
+def test_IntentGraphBeam(graph, makeIntent):
+    """Test beam search over the intent graph"""
+    a = graph.matchBeam("Ouvrez les rideaux", 1.0)
+    assert a[0][1] == "open_curtain"
+    assert TreeNode.results_to_str(a[0][2]) == ["open", "the", "curtain"]
+
+    a = graph.matchBeam("Montez le volume de quatre vingt dix huit pourcent", 2.0, topK = 1)
+    assert len(a) == 1
+    assert TreeNode.results_to_str(a[0][2]) == ["increase", "volume", "value = quatre vingt dix huit"]
+
+    # Greedy matching takes the optional word and can't match the next node anymore, the beam search backtracks
+    graph = IntentGraph([("volume", makeIntent(OptionalNode(["le"]), BasicNode(("volume", "le volume"))))])
+    assert graph.matchText("le volume", 1.0) == []
+    a = graph.matchBeam("le volume", 1.0)
+    assert a[0][0] == 1.0 and a[0][1] == "volume"
+
+def test_IntentGraphNBest(graph):
+    """Test matching N-best lists and word lattices"""
+    transcripts = [("Ouvrez les volets", 0.5), ("Ouvrez les rideaux", 0.4), ("Fermez les volets", 0.1)]
+    a = graph.matchNBest(transcripts, 2.0)
+    assert [(x[1], x[3]) for x in a] == [("open_cover", 0), ("open_curtain", 1), ("close_cover", 2)]
+    # The confidence is folded into the budget
+    assert a[0][0] == 2.0 and a[1][0] == pytest.approx(2.0 - math.log(0.5 / 0.4))
+    assert TreeNode.results_to_str(a[1][2]) == ["open", "the", "curtain"]
+    # A transcript that's much less likely than the best one isn't matched
+    assert [x[1] for x in graph.matchNBest([("Ouvrez les volets", 0.9), ("Fermez les volets", 0.05)], 2.0)] == ["open_cover"]
+
+    # A likely but garbled transcript loses against a less likely one that matches
+    a = graph.matchNBest([("Ouvrez lait ride", 0.6), ("Baissez le volume de cinquante pourcent", 0.4)], 2.0, topK = 1)
+    assert a[0][1] == "volume" and TreeNode.results_to_str(a[0][2]) == ["decrease", "volume", "value = cinquante"]
+    assert graph.matchNBest(["Ouvrez les rideaux"], 1.0)[0][:3] == tuple(graph.matchBeam("Ouvrez les rideaux", 1.0)[0])[:3]
+
+    arcs = [(0, 1, "Ouvrez", 0.9), (0, 1, "Fermez", 0.1), (1, 2, "les", 1.0), (2, 3, "rideaux", 0.3), (2, 3, "volets", 0.7)]
+    paths = latticePaths(arcs, 3)
+    assert [x[0] for x in paths] == ["Ouvrez les volets", "Ouvrez les rideaux", "Fermez les volets"]
+    assert [x[1] for x in paths] == pytest.approx([0.63, 0.27, 0.07])
+    a = graph.matchLattice(arcs, 2.0)
+    assert [(x[1], x[3]) for x in a] == [("open_cover", "Ouvrez les volets"), ("open_curtain", "Ouvrez les rideaux")]
+
+def test_splitManyToSOP():
+    """Test transliterating N-best transcripts once"""
+    calls = []
+    class Counting(object):
+        language = "test"
+        def transliterate(self, text):
+            calls.append(text)
+            return text
+    matcher = Matcher(transliterator = Counting())
+    assert matcher.splitManyToSOP(["a b", "a b", "a c"]) == [["a", "b"], ["a", "b"], ["a", "c"]]
+    assert calls == ["a b", "a c"]
+    del calls[:]
+    matcher.wordProcessing = True
+    assert matcher.splitManyToSOP(["a b", "a, c", "b"]) == [["a", "b"], ["a", "c"], ["b"]]
+    assert calls == ["a", "b", "c"]
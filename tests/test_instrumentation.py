@@ -0,0 +1,41 @@
+import logging
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, EndNode
+from phonomatic.matcher import Matcher
+from phonomatic.graph import IntentGraph
+from phonomatic.instrumentation import Instrumentation
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_Instrumentation(caplog):
+    """Test measuring the matching"""
+    root = TreeNode()
+    root.appendChild(AlternativeNode([("increase", "Montez"), ("decrease", "Baissez")]))
+    root.appendChild(BasicNode(("volume", "le volume de")))
+    root.appendChild(ParametricNode("value"))
+    root.appendChild(BasicNode(("percent", "pourcent")))
+
+    reports = []
+    instrumentation = Instrumentation(callback = reports.append, trace = True)
+    ctx = Matcher(defaultLanguage, instrumentation = instrumentation)
+    ids = root.matchText("Baissez le volume de cinquante pourcent", 2.0, ctx)
+    assert TreeNode.results_to_str(ids) == ["decrease", "volume", "value = cinquante", "percent"]
+
+    assert len(reports) == 1 and reports[0]["result"] is ids
+    assert sorted(reports[0]["spans"]) == ["discode", "scoring", "transliteration"]
+    assert reports[0]["trace"][:2] == [("AlternativeNode", "decrease", 2.0, reports[0]["trace"][0][3]), ("BasicNode", "volume", reports[0]["trace"][0][3], reports[0]["trace"][1][3])]
+    stats = instrumentation.stats()
+    assert stats["requests"] == 1
+    # The parametric node matches the next node to find the end of the parameter
+    assert stats["types"]["BasicNode"]["calls"] > 2 and stats["types"]["ParametricNode"]["calls"] == 1
+    assert stats["types"]["AlternativeNode"]["budgetSpent"] == 2.0 - reports[0]["trace"][0][3]
+    assert instrumentation.slowest(1)[0][0] in root.children
+
+    # Without callback, the report is logged, and the graph matches are measured too
+    instrumentation = Instrumentation()
+    ctx = Matcher(defaultLanguage, instrumentation = instrumentation)
+    with caplog.at_level(logging.DEBUG, logger = "phonomatic"):
+        assert IntentGraph([("volume", root)]).matchText("Montez le volume de dix pourcent", 2.0, ctx)[0][1] == "volume"
+    assert "Request [Montez le volume de dix pourcent]" in caplog.text
+    assert instrumentation.stats()["types"]["AlternativeNode"]["calls"] == 1
@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, EndNode
+from phonomatic.matcher import Matcher
+from phonomatic.graph import IntentGraph
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_Matcher(curtainsIntent, makeIntent):
+    """Test matching many languages from many threads"""
+    french = IntentGraph([("curtains", curtainsIntent())])
+    TreeNode.setLanguage('spa-Latn')
+    try:
+        spanish = IntentGraph([("curtains", makeIntent(AlternativeNode([("open", "Abre"), ("close", "Cierra")]), BasicNode(("the", "las")), AlternativeNode([("curtain", "cortinas"), ("cover", "persianas")]), EndNode()))])
+    finally:
+        TreeNode.setLanguage(defaultLanguage)
+
+    matchers = { "fr": Matcher(defaultLanguage), "es": Matcher('spa-Latn', wordProcessing = True) }
+    assert matchers["es"].language == 'spa-Latn' and TreeNode.matcher.language == defaultLanguage, "Matchers must not change the default matcher"
+    queries = [("fr", french, "Ouvrez les rideaux", ["open", "the", "curtain"]), ("es", spanish, "Cierra las persianas", ["close", "the", "cover"]),
+               ("fr", french, "Fermez les volets", ["close", "the", "cover"]), ("es", spanish, "Abre las cortinas", ["open", "the", "curtain"])] * 8
+
+    def run(query):
+        r = matchers[query[0]].matchText(query[1], query[2], 1.0)
+        return TreeNode.results_to_str(r[0][2]) if r else None
+
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        results = list(executor.map(run, queries))
+    assert results == [x[3] for x in queries]
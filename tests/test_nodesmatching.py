@@ -1,4 +1,8 @@
 from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+from phonomatic.matcher import Matcher
+from phonomatic.instrumentation import Instrumentation
+from phonomatic.matchresults import ID, Optional, Parameter
+from phonomatic.sop import SOPArena
 
 defaultLanguage = 'fra-Latn-p'
 
@@ -130,3 +134,60 @@ def test_ComplexIntentMatchingWithParameter():
 
     a = root.matchText("Montez le volume de cinquante voiture", 2.0)
     assert a == None
+
+def test_AlternativeNodeTrie(monkeypatch):
+    """Test alternative matching through the phonetic trie index"""
+    monkeypatch.setattr(AlternativeNode, "trieThreshold", 2)
+    root = TreeNode()
+
+    root.appendChild(AlternativeNode([("open", "Ouvrez"), ("close", "Fermez")]))
+    root.appendChild(BasicNode(("the", "les")))
+    root.appendChild(AlternativeNode([("curtain", "rideaux"), ("cover", "volets"), ("door", "portes")]))
+    assert root.children[2].trie != None
+
+    a = root.matchText("Ouvré lé riz d'eau", 2.0)
+    assert TreeNode.results_to_str(a) == ["open", "the", "curtain"]
+
+    a = root.matchText("Fermée le veau les", 5.0)
+    assert TreeNode.results_to_str(a) == ["close", "the", "cover"]
+
+    a = root.matchText("Fermez les portes", 1.0)
+    assert TreeNode.results_to_str(a) == ["close", "the", "door"]
+
+def test_NodeStorage():
+    """Test the nodes keep their forms packed and have no instance dictionary"""
+    arena = SOPArena()
+    forms = [("open", [[1, 2, 3], [4]]), ("close", [[5, 6]]), ("stop", [[7]])]
+    node = AlternativeNode.fromSOP(forms, arena = arena)
+    assert node.forms == forms and node.form(1) == forms[1]
+    assert len(arena.phonemes) == 7, "Forms should be stored in the given arena"
+    optional = OptionalNode.fromSOP(["s'il vous plaît", "merci"], [[[1], [2, 3]], [[4]]], arena = arena)
+    assert optional.texts == [[[1], [2, 3]], [[4]]]
+
+    # Without an arena, each node has its own, so dropped nodes don't leave their forms behind
+    shared = len(SOPArena.shared.phonemes)
+    for _ in range(3):
+        node = AlternativeNode.fromSOP([("form{}".format(i), [[i % 300, 1, 2]]) for i in range(1000)])
+        assert len(node.packed.arena.phonemes) == 3000
+    assert len(SOPArena.shared.phonemes) == shared, "The shared arena should only be used when asked for"
+    assert AlternativeNode.fromSOP(forms, arena = SOPArena.shared).packed.arena is SOPArena.shared
+
+    for x in (TreeNode(), node, optional, BasicNode.fromSOP(ID("a"), ["a"], [[1]]), ParametricNode("value"), EndNode(), ID("a"), Optional("a"), Parameter("a", 1)):
+        assert not hasattr(x, "__dict__"), "{} shouldn't have a dictionary".format(type(x).__name__)
+
+def test_ParametricResync():
+    """Test the parametric node only matches the next node where it can start"""
+    root = TreeNode()
+    root.appendChild(BasicNode(("set", "Réglez")))
+    root.appendChild(ParametricNode("value"))
+    root.appendChild(OptionalNode(["s'il vous plait"]))
+    root.appendChild(AlternativeNode([("percent", "pourcent"), ("degrees", "degrés")]))
+
+    instrumentation = Instrumentation()
+    ctx = Matcher(defaultLanguage, instrumentation = instrumentation)
+    a = root.matchText("Réglez quatre vingt dix huit pourcent", 1.0, ctx)
+    assert TreeNode.results_to_str(a) == ["set", "value = quatre vingt dix huit", "percent"]
+    types = instrumentation.stats()["types"]
+    # Each node is matched once after the parameter, and the parameter only tries where they can start
+    assert types["AlternativeNode"]["calls"] == 2, "Alternative node should only be tried where it can start"
+    assert types["OptionalNode"]["calls"] == 1, "Optional node can't start anywhere"
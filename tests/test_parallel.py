@@ -0,0 +1,34 @@
+from phonomatic.node import TreeNode
+from phonomatic.grammarfile import saveGrammar, GrammarFile
+import phonomatic.parallel
+from phonomatic.parallel import matchMany
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_matchMany(tmp_path, monkeypatch, curtainsIntent, volumeIntent):
+    """Test matching many texts with a pool of processes"""
+    intents = [
+        ("curtains", curtainsIntent(polite = True)),
+        ("volume", volumeIntent(percent = False)),
+    ]
+    path = str(tmp_path / "grammar.phm")
+    saveGrammar(intents, path)
+
+    texts = ["Ouvrez les rideaux s'il vous plait", "Baissez le volume de cinquante", "Fermez les volets", "Bonjour", "Ouvrez les rideaux s'il vous plait"]
+    opened = []
+    class Recording(GrammarFile):
+        def __init__(self, path):
+            super().__init__(path)
+            opened.append(self)
+    monkeypatch.setattr(phonomatic.parallel, "GrammarFile", Recording)
+    serial = matchMany(path, texts, 2.0, workers = 0)
+    assert len(opened) == 1 and opened[0].map.closed, "The grammar file opened by matchMany should be closed"
+    monkeypatch.undo()
+    assert [x[0][1] if x else None for x in serial] == ["curtains", "volume", "curtains", None, "curtains"]
+    assert TreeNode.results_to_str(serial[2][0][2]) == ["close", "the", "cover"]
+
+    parallel = matchMany(path, texts, 2.0, workers = 2, chunkSize = 2)
+    assert [[(x[0], x[1], TreeNode.results_to_str(x[2])) for x in r] for r in parallel] == \
+           [[(x[0], x[1], TreeNode.results_to_str(x[2])) for x in r] for r in serial]
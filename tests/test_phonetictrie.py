@@ -0,0 +1,30 @@
+import random
+import pytest
+from phonomatic.confusionmatrix import ConfusionMatrix
+from phonomatic.phonetictrie import PhoneticTrie
+
+def test_PhoneticTrie():
+    """Test phonetic trie search"""
+    cm = ConfusionMatrix()
+    random.seed(2)
+    phonemes = cm.submap.discode("aeioupbtdkfvszmnlʁɔ")
+    def randomSOP(words):
+        return [[random.choice(phonemes) for _ in range(random.randint(1, 5))] for _ in range(words)]
+
+    forms = [randomSOP(random.randint(1, 3)) for _ in range(300)]
+    # Add some shared prefixes
+    forms += [form[:1] + randomSOP(1) for form in forms[:100]]
+    trie = PhoneticTrie(forms)
+    assert len(trie) == len(forms)
+    for _ in range(30):
+        B = random.choice(forms) + randomSOP(2) if random.random() < 0.5 else randomSOP(4)
+        budget = random.choice([1.0, 2.0, 3.5])
+        found = dict((f, r) for r, f in trie.search([x for word in B for x in word], budget, cm))
+        for i, A in enumerate(forms):
+            r = cm.confuseScorePre(A, B, budget)[0]
+            assert found.get(i, 0.0) == pytest.approx(r), "Trie score differs from linear score"
+
+    sop = forms[42]
+    best = trie.best([x for word in sop for x in word], 1.0, cm)
+    assert best[0] == 1.0 and forms[best[1]] == sop, "Trie should find exact form"
+    assert trie.best(cm.submap.discode("ʔʔʔʔʔʔʔʔ"), 1.0, cm) == None, "Trie shouldn't find anything"
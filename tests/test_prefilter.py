@@ -0,0 +1,58 @@
+import pytest
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode
+from phonomatic.graph import IntentGraph
+from phonomatic.prefilter import NGramIndex, shortlistRecall
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+@pytest.fixture
+def graph(deviceIntents, makeIntent):
+    return IntentGraph(deviceIntents + [
+        ("light", makeIntent(AlternativeNode([("on", "Allumez"), ("off", "Éteignez")]), BasicNode(("the", "la")), BasicNode(("light", "lumière")))),
+    ], NGramIndex())
+
+def test_NGramIndex(graph):
+    """Test the n-gram shortlist of intents"""
+    index = graph.index
+    ranked = index.rank(TreeNode.textToCursor("Ouvrez les rideaux"), 3)
+    assert len(ranked) == 3
+    assert ranked[0][1] == "open_curtain"
+    assert [x[0] for x in ranked] == sorted([x[0] for x in ranked], reverse = True)
+    # The best form of an alternative node counts, not all its forms
+    assert index.rank(TreeNode.textToCursor("Éteignez la lumière"), 1)[0][1] == "light"
+    assert index.shortlist(TreeNode.textToCursor("Baissez le volume de cinquante pourcent"), 1) == {"volume"}
+    assert len(index.shortlist(TreeNode.textToCursor("Bonjour"), 10)) == 5
+
+def test_IntentGraphShortlist(graph):
+    """Test matching only the shortlisted intents"""
+    for text in ("Ouvrez les rideaux", "Fermez les volets", "Baissez le volume de cinquante pourcent", "Allumez la lumière"):
+        full = graph.matchText(text, 2.0)
+        a = graph.matchText(text, 2.0, topM = 1)
+        assert [x[1] for x in a] == [full[0][1]]
+        assert TreeNode.results_to_str(a[0][2]) == TreeNode.results_to_str(full[0][2])
+        assert graph.matchBeam(text, 2.0, topM = 1)[0][1] == full[0][1]
+
+    # Intents that aren't shortlisted aren't matched, even when they share nodes with a shortlisted one
+    a = graph.matchText("Ouvrez les volets", 5.0, topM = 1)
+    assert [x[1] for x in a] == ["open_cover"]
+
+    assert shortlistRecall(graph, ["Ouvrez les rideaux", "Fermez les volets", "Allumez la lumière", "Bonjour"], 2.0, 1) == (1.0, 3)
+
+def test_NGramIndexSentences(makeIntent):
+    """Test an intent given by many roots (one per sentence) is only ranked once"""
+    index = NGramIndex([
+        ("open", makeIntent(BasicNode(("open", "Ouvrez")), BasicNode(("curtain", "les rideaux")))),
+        ("open", makeIntent(BasicNode(("open", "Ouvrez")), BasicNode(("cover", "les volets")))),
+        ("close", makeIntent(BasicNode(("close", "Fermez")), BasicNode(("cover", "les volets")))),
+        ("light", makeIntent(BasicNode(("on", "Allumez")), BasicNode(("light", "la lumière")))),
+    ])
+    assert index.intents == ["open", "close", "light"]
+    SOP = TreeNode.textToCursor("Ouvrez les volets")
+    ranked = index.rank(SOP, 2)
+    assert [x[1] for x in ranked] == ["open", "close"], "Each intent should be ranked once"
+    # The intent's score is its best root's
+    single = NGramIndex([("open", makeIntent(BasicNode(("open", "Ouvrez")), BasicNode(("cover", "les volets"))))])
+    assert ranked[0][0] == single.rank(SOP, 1)[0][0]
+    assert index.shortlist(SOP, 3) == {"open", "close", "light"}
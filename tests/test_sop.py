@@ -0,0 +1,70 @@
+import pytest
+import random
+import pickle
+from phonomatic.sop import SOPBuffer, SOPCursor, SOPArena
+
+def splice(SOP, indexes, wordBoundaries = False):
+    """ The list based splicing the cursor replaces """
+    lenInput = [len(x) for x in SOP]
+    for i in range(0, len(SOP)):
+        if indexes >= lenInput[i]:
+            SOP.pop(0)
+            indexes = indexes - lenInput[i]
+        elif indexes > 0:
+            if (wordBoundaries):
+                SOP.pop(0)
+            else:
+                SOP[0][:] = SOP[0][indexes:]
+            break
+        else:
+            break
+
+def test_SOPCursor():
+    """Test SOP cursor moves"""
+    words = [[1, 2, 3], [4, 5], [], [6, 7, 8, 9]]
+    buffer = SOPBuffer(words)
+    assert len(buffer) == 4
+    c = buffer.cursor()
+    assert len(c) == 4 and c.remaining() == 9
+    assert [list(x) for x in c.words()] == words
+    assert [list(x) for x in c.words(2)] == words[:2]
+
+    d = c.copy().advance(4)
+    assert [list(x) for x in d.words()] == [[5], [], [6, 7, 8, 9]]
+    assert list(d.flat()) == [5, 6, 7, 8, 9]
+    assert d.length(2) == 1
+    assert [list(x) for x in c.words()] == words, "Copies must move independently"
+    assert len(c.copy().skipWords(2)) == 2
+    assert len(c.copy().skipWords(10)) == 0
+
+    random.seed(3)
+    for _ in range(200):
+        words = [[random.randint(0, 9) for _ in range(random.randint(0, 4))] for _ in range(random.randint(0, 5))]
+        SOP = [list(x) for x in words]
+        c = SOPCursor.of(words)
+        for _ in range(3):
+            n = random.randint(0, 6)
+            boundaries = random.random() < 0.5
+            splice(SOP, n, boundaries)
+            c.advance(n, boundaries)
+            assert [list(x) for x in c.words()] == SOP, "Cursor differs from list splicing"
+            assert len(c) == len(SOP)
+
+def test_SOPArena():
+    """Test the packed storage of SOPs"""
+    arena = SOPArena()
+    random.seed(2)
+    SOPs = [[[random.randrange(400) for _ in range(random.randint(1, 6))] for _ in range(random.randint(1, 3))] for _ in range(50)]
+    spans = [arena.add(x) for x in SOPs]
+    assert [arena.sop(*x) for x in spans] == SOPs, "Stored SOPs don't round trip"
+    assert arena.add([]) == (len(arena.words) - 1, 0) and arena.sop(len(arena.words) - 1, 0) == [], "Empty SOP failed"
+    copy = pickle.loads(pickle.dumps(arena))
+    assert [copy.sop(*x) for x in spans] == SOPs, "Pickled arena doesn't round trip"
+    assert copy.add([[1, 2]]) == (len(arena.words) - 1, 1), "Pickled arena should be usable"
+
+    view = SOPArena.view(memoryview(arena.phonemes), memoryview(arena.words))
+    assert [view.sop(*x) for x in spans] == SOPs and view.length(*spans[3]) == sum(len(w) for w in SOPs[3])
+    with pytest.raises(TypeError):
+        view.add([[1]])
+    copy = pickle.loads(pickle.dumps(view))
+    assert [copy.sop(*x) for x in spans] == SOPs, "Pickled view should be a copy"
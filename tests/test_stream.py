@@ -0,0 +1,37 @@
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, EndNode
+from phonomatic.graph import IntentGraph
+from phonomatic.stream import MatchSession
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_MatchSession(makeIntent, curtainsIntent, volumeIntent):
+    """Test matching a growing text"""
+    graph = IntentGraph([
+        ("curtains", curtainsIntent(polite = True)),
+        ("volume", volumeIntent()),
+        ("lights", makeIntent(AlternativeNode([("open", "Ouvrez"), ("close", "Fermez")]), BasicNode(("the", "les")), AlternativeNode([("light", "lumières")]), EndNode())),
+    ])
+
+    session = MatchSession(graph, 2.0)
+    state = session.append("Ouvrez les")
+    assert state["decided"] == None and sorted(state["pending"]) == ["curtains", "lights"]
+    assert session.append("rideaux s'il")["decided"] == "curtains", "Intent should be decided before the end"
+    session.append("vous plait")
+    a = session.finish()
+    assert a[0][1] == "curtains" and TreeNode.results_to_str(a[0][2]) == ["open", "the", "curtain"]
+
+    # The parameter grows with the appended words
+    session = MatchSession(graph, 2.0)
+    assert session.append("Baissez le volume de")["decided"] == "volume"
+    session.append("cinquante")
+    session.append("deux")
+    assert session.append("pourcent")["decided"] == "volume"
+    a = session.finish()
+    assert [(x[1], TreeNode.results_to_str(x[2])) for x in a] == [(x[1], TreeNode.results_to_str(x[2])) for x in graph.matchBeam("Baissez le volume de cinquante deux pourcent", 2.0)]
+    assert TreeNode.results_to_str(a[0][2]) == ["decrease", "volume", "value = cinquante deux"]
+
+    session = MatchSession(graph, 2.0)
+    assert session.append("Bonjour")["rejected"], "Nothing should match"
+    assert session.finish() == []
@@ -0,0 +1,49 @@
+from phonomatic.translitcache import TransliterationCache
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_TransliterationCache(tmp_path):
+    """Test transliteration cache"""
+    calls = []
+    def transliterate(word):
+        calls.append(word)
+        return word.upper()
+
+    cache = TransliterationCache(capacity = 2)
+    assert cache.transliterate("fra", "a", transliterate) == "A"
+    assert cache.transliterate("fra", "a", transliterate) == "A"
+    assert cache.transliterate("eng", "a", transliterate) == "A"
+    assert calls == ["a", "a"], "Cache is keyed by language and word"
+    cache.transliterate("fra", "b", transliterate)
+    assert cache.get("fra", "a") == None, "Least recently used word should be evicted"
+    assert len(cache) == 2
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 4
+
+    path = str(tmp_path / "translit.db")
+    cache = TransliterationCache(path = path)
+    cache.transliterate("fra", "c", transliterate)
+    cache.close()
+    cache = TransliterationCache(path = path)
+    assert cache.get("fra", "c") == "C", "Transliteration should persist"
+    cache.close()
+
+def test_NodeMatchingWithCache():
+    """Test node matching with a transliteration cache"""
+    cache = TransliterationCache()
+    TreeNode.setTransliterationCache(cache)
+    try:
+        root = TreeNode()
+        root.appendChild(AlternativeNode([("open", "Ouvrez"), ("close", "Fermez")]))
+        root.appendChild(BasicNode(("the", "les")))
+        root.appendChild(AlternativeNode([("curtain", "rideaux"), ("cover", "volets")]))
+
+        a = root.matchText("Ouvrez les rideaux", 1.0)
+        assert TreeNode.results_to_str(a) == ["open", "the", "curtain"]
+        a = root.matchText("Fermez les volets", 1.0)
+        assert TreeNode.results_to_str(a) == ["close", "the", "cover"]
+        assert cache.hits == 6 and cache.misses == 5, "Matched words were already transliterated when building the tree"
+    finally:
+        TreeNode.setTransliterationCache(None)
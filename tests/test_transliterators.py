@@ -0,0 +1,94 @@
+from phonomatic.transliterators import EpitranInst, DictionaryTransliterator, RuleTransliterator, ChainTransliterator
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, EndNode
+from phonomatic.matcher import Matcher
+import os
+import pytest
+import subprocess
+import sys
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_LazyEpitran():
+    """Test that Epitran is only imported and loaded when it's used"""
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path))
+    code = "import sys, phonomatic; assert 'epitran' not in sys.modules; phonomatic.TreeNode.setLanguage('fra-Latn-p'); assert 'epitran' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], env = env, check = True)
+
+    epitran = EpitranInst(defaultLanguage)
+    assert epitran.epiInst == None
+    assert epitran.transliterate("rideaux") == epitran.lookup("rideaux") == "rido"
+    assert epitran.epiInst != None
+    assert EpitranInst().transliterate("rideaux") == "rideaux" and EpitranInst().lookup("rideaux") == None
+
+def test_Transliterators(tmp_path):
+    """Test the dictionary, rule based and chained transliterators"""
+    lexicon = DictionaryTransliterator({ "ouvrez": "uvʁe", "les": "le" }, "fra")
+    assert lexicon.lookup("Ouvrez") == "uvʁe" and lexicon.lookup("volets") == None
+    assert lexicon.transliterate("Ouvrez  les volets") == "uvʁe le volets"
+    path = str(tmp_path / "lexicon.txt")
+    lexicon.save(path)
+    with open(path, "a", encoding = "utf-8") as f:
+        f.write("# Comment\nles lɛ\n")
+    assert DictionaryTransliterator(path).lexicon == lexicon.lexicon, "First pronunciation should be used"
+
+    path = str(tmp_path / "rules.txt")
+    with open(path, "w", encoding = "utf-8") as f:
+        f.write("v v\no o\nl l\ne ɛ\net ɛ\ns\nt t\n")
+    rules = RuleTransliterator(path)
+    assert rules.lookup("volets") == "volɛ", "Longest graphemes should be used first"
+    assert rules.lookup("rideaux") == None
+
+    calls = []
+    class Counting(object):
+        language = "fra"
+        def lookup(self, word):
+            calls.append(word)
+            return word.upper()
+    chain = ChainTransliterator([lexicon, rules, Counting()])
+    assert chain.language == "fra"
+    assert chain.transliterate("Ouvrez les volets rideaux") == "uvʁe le volɛ RIDEAUX"
+    assert calls == ["rideaux"] and chain.hits == [2, 1, 1] and chain.misses == 0
+    assert ChainTransliterator([lexicon]).transliterate("Ouvrez la") == "uvʁe la" and ChainTransliterator([lexicon]).language == "fra"
+
+    # Build and match with a lexicon precomputed with Epitran, falling back to Epitran for the other words
+    epitran = EpitranInst(defaultLanguage)
+    chain = ChainTransliterator([DictionaryTransliterator.precompute(["Ouvrez", "les", "rideaux", "volets"], epitran), epitran])
+    try:
+        TreeNode.setTransliterator(chain)
+        root = TreeNode()
+        root.appendChild(AlternativeNode([("open", "Ouvrez"), ("close", "Fermez")]))
+        root.appendChild(BasicNode(("the", "les")))
+        root.appendChild(AlternativeNode([("curtain", "rideaux"), ("cover", "volets")]))
+        root.appendChild(EndNode())
+    finally:
+        TreeNode.setTransliterator(Matcher(defaultLanguage).transliterator)
+    assert chain.hits == [4, 1]
+    assert TreeNode.results_to_str(root.matchText("Ouvrez les volets", 1.0, Matcher(transliterator = chain))) == ["open", "the", "cover"]
+    assert TreeNode.matcher.language == defaultLanguage and TreeNode.epiInst is TreeNode.matcher.transliterator
+
+def test_ChainLanguage():
+    """Test changing the language after setting a chain as the default transliterator"""
+    epitran = EpitranInst(defaultLanguage)
+    lexicon = DictionaryTransliterator({ "rideaux": "RIDO" }, defaultLanguage)
+    chain = ChainTransliterator([lexicon, epitran])
+    spanish = EpitranInst('spa-Latn')
+    try:
+        TreeNode.setTransliterator(chain)
+        TreeNode.setLanguage('spa-Latn')
+        assert TreeNode.matcher.language == chain.language == epitran.language == 'spa-Latn'
+        assert lexicon.language == defaultLanguage, "A lexicon can't change language"
+        # The French lexicon isn't used for Spanish
+        assert TreeNode.splitToSOP("cortinas rideaux") == [spanish.transliterate("cortinas"), spanish.transliterate("rideaux")]
+        assert chain.hits == [0, 2]
+        TreeNode.setLanguage(defaultLanguage)
+        assert TreeNode.splitToSOP("rideaux") == ["RIDO"] and chain.hits == [1, 2]
+    finally:
+        TreeNode.setTransliterator(Matcher(defaultLanguage).transliterator)
+    assert TreeNode.matcher.language == defaultLanguage
+    with pytest.raises(ValueError):
+        lexicon.setLanguage('spa-Latn')
+    lexicon.setLanguage(defaultLanguage)
+    with pytest.raises(ValueError):
+        RuleTransliterator({ "a": "a" }, "fra").setLanguage('spa-Latn')
@@ -0,0 +1,51 @@
+from phonomatic.node import TreeNode, BasicNode, AlternativeNode, ParametricNode, OptionalNode, EndNode
+from phonomatic.graph import IntentGraph
+from phonomatic.values import NumberValues, EntityValues, PatternValues, numberWords
+
+defaultLanguage = 'fra-Latn-p'
+
+TreeNode.setLanguage(defaultLanguage)
+
+def test_NumberWords():
+    """Test number grammars"""
+    assert numberWords["fra"](98) == "quatre vingt dix huit"
+    assert numberWords["fra"](71) == "soixante et onze"
+    assert numberWords["fra"](200) == "deux cents"
+    assert numberWords["fra"](1981) == "mille neuf cent quatre vingt un"
+    assert numberWords["eng"](342) == "three hundred forty two"
+
+def test_TypedParameters():
+    """Test parameters with a value grammar"""
+    root = TreeNode()
+    root.appendChild(AlternativeNode([("increase", "Montez"), ("decrease", "Baissez")]))
+    root.appendChild(BasicNode(("volume", "le volume à")))
+    root.appendChild(ParametricNode("value", values = NumberValues(0, 100)))
+    root.appendChild(OptionalNode(["pourcent"]))
+
+    for text, value in (("Baissez le volume à quatre vingt dix huit pourcent", 98), ("Montez le volume à cinquante", 50),
+                        ("Baissez le volume à soixante et onze pourcent", 71)):
+        a = root.matchText(text, 2.0)
+        assert a != None, "Matching failed for {}".format(text)
+        assert a[2].value == value and str(a[2]) == "value = {}".format(value)
+    assert root.matchText("Baissez le volume à bonjour pourcent", 2.0) == None, "Not a number should fail"
+
+    # The capture stops at the end of the value, so the following words are left for the end node
+    root = TreeNode()
+    root.appendChild(BasicNode(("color", "Mets la lumière en")))
+    root.appendChild(ParametricNode("color", values = EntityValues({ "red": ["rouge", "rouge vif"], "blue": "bleu" })))
+    root.appendChild(EndNode())
+    a = root.matchText("Mets la lumière en rouge vif", 1.0)
+    assert a[1].value == "red" and a[1].text == "rouge vif"
+    assert root.matchText("Mets la lumière en bleu", 1.0)[1].value == "blue"
+    assert root.matchText("Mets la lumière en bleu vite", 1.0) == None
+
+    graph = IntentGraph([("color", root)])
+    a = graph.matchBeam("Mets la lumière en rouge vif", 1.0)
+    assert a[0][2][1].value == "red"
+
+    root = TreeNode()
+    root.appendChild(BasicNode(("flight", "Vol")))
+    root.appendChild(ParametricNode("flight", values = PatternValues(r"[A-Z]{2} ?\d+", convert = lambda m: m.group(0).replace(" ", ""))))
+    root.appendChild(OptionalNode(["demain"]))
+    a = root.matchText("Vol AF 1234 demain", 1.0)
+    assert a[1].value == "AF1234" and a[1].text == "AF 1234"